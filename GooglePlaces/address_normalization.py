@@ -0,0 +1,156 @@
+"""
+Address canonicalization and duplicate collapsing.
+
+Location files repeat the same address many times with different casing, whitespace, trailing
+", ., . ." noise or "nan" fields. AddressGroups collapses those rows to one canonical address each,
+so every unique address is classified or geocoded once and the result is fanned back out to all
+rows that share it.
+"""
+
+import math
+import re
+from typing import Any, Dict, Iterable, List
+
+_WHITESPACE = re.compile(r"\s+")
+_SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.;])")
+_TRAILING_NOISE = re.compile(r"(?:\s*[,.;:\-]+\s*)+$")
+_LEADING_NOISE = re.compile(r"^(?:\s*[,.;:\-]+\s*)+")
+_NULL_COMPONENTS = {"", ".", "nan", "none", "null", "n/a", "na"}
+
+
+def canonical_address(value: Any) -> str:
+    """
+    Canonicalize an address for display and for sending to an API.
+
+    Collapses whitespace, drops empty / "nan" comma-separated components and strips leading and
+    trailing punctuation noise, while keeping the original casing.
+
+    Args:
+        value (Any): The raw address value (str, None or a pandas NaN).
+
+    Returns:
+        str: The canonical address, or an empty string for missing values.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+
+    address = _WHITESPACE.sub(" ", str(value)).strip()
+    address = _SPACE_BEFORE_PUNCTUATION.sub(r"\1", address)
+    components = [component.strip() for component in address.split(",")]
+    components = [component for component in components if component.casefold() not in _NULL_COMPONENTS]
+    address = ", ".join(components)
+    address = _TRAILING_NOISE.sub("", address)
+    address = _LEADING_NOISE.sub("", address)
+    return address
+
+
+def address_key(value: Any) -> str:
+    """
+    Build the grouping key of an address: its canonical form, case-folded.
+
+    Args:
+        value (Any): The raw address value.
+
+    Returns:
+        str: The key shared by all spellings of the same address.
+    """
+    return canonical_address(value).casefold()
+
+
+class AddressGroups:
+    """Groups rows by canonical address so each unique address is processed once."""
+
+    def __init__(self, addresses: Iterable[Any]):
+        """
+        Group a column of raw address values.
+
+        Args:
+            addresses (Iterable[Any]): The raw address of every row, in row order.
+        """
+        self.row_keys: List[str] = []
+        self._representatives: Dict[str, str] = {}
+        self._first_rows: Dict[str, int] = {}
+        for row_index, address in enumerate(addresses):
+            key = address_key(address)
+            self.row_keys.append(key)
+            if key not in self._representatives:
+                self._representatives[key] = canonical_address(address)
+                self._first_rows[key] = row_index
+
+    @property
+    def total_count(self) -> int:
+        """Number of rows."""
+        return len(self.row_keys)
+
+    @property
+    def unique_count(self) -> int:
+        """Number of unique canonical addresses."""
+        return len(self._representatives)
+
+    @property
+    def calls_saved(self) -> int:
+        """Number of API calls avoided by processing each unique address once."""
+        return self.total_count - self.unique_count
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Rows per unique address (1.0 means no duplicates)."""
+        return self.total_count / self.unique_count if self.unique_count else 1.0
+
+    def unique_addresses(self) -> List[str]:
+        """
+        The canonical address of every group, in first-seen order.
+
+        Returns:
+            List[str]: One address per group; results must be passed to fan_out in this order.
+        """
+        return list(self._representatives.values())
+
+    def first_row_indices(self) -> List[int]:
+        """
+        The index of the first row of every group, aligned with unique_addresses().
+
+        Returns:
+            List[int]: Row indices, useful to key each unique address by an ID from its first row.
+        """
+        return list(self._first_rows.values())
+
+    def group_ids(self, row_ids: List[Any]) -> List[str]:
+        """
+        A unique ID for every group, taken from its first row, aligned with unique_addresses().
+
+        Args:
+            row_ids (List[Any]): The ID of every row (e.g. its LocationID), in row order.
+
+        Returns:
+            List[str]: One ID per group. Missing IDs become "row-<index>" and repeated IDs get the
+            row index appended, so the IDs can key a batch request or a bulk job.
+        """
+        group_ids, seen_ids = [], set()
+        for row_index in self.first_row_indices():
+            group_id = str(row_ids[row_index] or f"row-{row_index}")
+            if group_id in seen_ids:
+                group_id = f"{group_id}-{row_index}"
+            seen_ids.add(group_id)
+            group_ids.append(group_id)
+        return group_ids
+
+    def fan_out(self, unique_results: Iterable[Any]) -> List[Any]:
+        """
+        Expand one result per unique address back to one result per row.
+
+        Args:
+            unique_results (Iterable[Any]): Results aligned with unique_addresses().
+
+        Returns:
+            List[Any]: The result for every row, in the original row order.
+        """
+        results_by_key = dict(zip(self._representatives.keys(), unique_results))
+        return [results_by_key.get(key) for key in self.row_keys]
+
+    def report(self) -> str:
+        """Human readable summary of how many calls deduplication saved."""
+        return (
+            f"Address dedup: {self.total_count} rows -> {self.unique_count} unique addresses "
+            f"(dedup ratio {self.dedup_ratio:.2f}x, {self.calls_saved} calls saved)"
+        )
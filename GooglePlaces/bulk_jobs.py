@@ -0,0 +1,270 @@
+"""
+Asynchronous bulk-job mode for the location classifiers.
+
+Instead of one synchronous chat call per address, all requests are written to JSONL job files,
+uploaded to the provider's batch endpoint, polled until the jobs finish and the answers are merged
+back by custom_id (the LocationID). The batch endpoint takes at most MAX_JOB_REQUESTS requests and
+200 MB per input file, so large runs are split into several jobs that run side by side. Requests
+without a usable answer (failed, expired, or rejected by the caller) are resubmitted as a smaller
+follow-up job. The base URL is configurable so the whole flow can be exercised against the local
+stand-in in bulk_jobs_stub_server.py.
+"""
+
+import json
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import requests
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+CHAT_COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Input file limits of the batch endpoint; the byte limit (200 MB) is kept with some margin
+MAX_JOB_REQUESTS = 50_000
+MAX_JOB_BYTES = 190 * 1024 * 1024
+FOLLOW_UP_ROUNDS = 1
+
+
+def write_job_files(
+    request_bodies: Iterable[Tuple[str, Dict]], job_path: str, max_requests: int = MAX_JOB_REQUESTS, max_bytes: int = MAX_JOB_BYTES
+) -> List[Tuple[str, int]]:
+    """
+    Write chat completion requests to batch job files, starting a new file whenever one is full.
+
+    Args:
+        request_bodies (Iterable[Tuple[str, Dict]]): (custom_id, chat completion body) pairs.
+        job_path (str): Path of the JSONL job; the files are named <name>.part<N><extension>.
+        max_requests (int, optional): Most requests per file.
+        max_bytes (int, optional): Most bytes per file.
+
+    Returns:
+        List[Tuple[str, int]]: (path, number of requests) of every file written.
+    """
+    root, extension = os.path.splitext(job_path)
+    job_files: List[Tuple[str, int]] = []
+    job_file = None
+    count = size = 0
+    try:
+        for custom_id, body in request_bodies:
+            line = (json.dumps({"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_ENDPOINT, "body": body}) + "\n").encode("utf-8")
+            if job_file is None or count >= max_requests or size + len(line) > max_bytes:
+                if job_file is not None:
+                    job_file.close()
+                    job_files.append((job_file.name, count))
+                job_file = open(f"{root}.part{len(job_files) + 1}{extension}", "wb")
+                count = size = 0
+            job_file.write(line)
+            count += 1
+            size += len(line)
+    finally:
+        if job_file is not None:
+            job_file.close()
+            job_files.append((job_file.name, count))
+    return job_files
+
+
+def read_job_files(job_files: Iterable[Tuple[str, int]], custom_ids: Set[str]) -> Iterator[Tuple[str, Dict]]:
+    """
+    Read back the requests with the given custom_ids from job files, e.g. to resubmit them.
+
+    Args:
+        job_files (Iterable[Tuple[str, int]]): (path, number of requests) as returned by write_job_files().
+        custom_ids (Set[str]): The requests to read.
+
+    Yields:
+        Tuple[str, Dict]: (custom_id, chat completion body) pairs, in file order.
+    """
+    for path, _ in job_files:
+        with open(path, encoding="utf-8") as job_file:
+            for line in job_file:
+                request = json.loads(line)
+                if request["custom_id"] in custom_ids:
+                    yield request["custom_id"], request["body"]
+
+
+def parse_results(results_text: str) -> Dict[str, Optional[str]]:
+    """
+    Extract the message content of every successful request from a batch output file.
+
+    Args:
+        results_text (str): The JSONL content of the output file.
+
+    Returns:
+        Dict[str, Optional[str]]: custom_id -> message content (None for failed requests).
+    """
+    results: Dict[str, Optional[str]] = {}
+    for line in results_text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        content = None
+        if response.get("status_code") == 200:
+            choices = response.get("body", {}).get("choices") or [{}]
+            content = choices[0].get("message", {}).get("content")
+        results[result["custom_id"]] = content
+    return results
+
+
+def load_answer(content: Optional[str]) -> Dict:
+    """
+    Decode the JSON-mode answer of one request.
+
+    Args:
+        content (Optional[str]): The message content, or None if the request failed.
+
+    Returns:
+        Dict: The decoded answer; empty if it was missing or not a JSON object.
+    """
+    try:
+        answer = json.loads(content) if content else {}
+    except json.JSONDecodeError:
+        return {}
+    return answer if isinstance(answer, dict) else {}
+
+
+class BulkJobClient:
+    """Minimal client for the file upload and batch endpoints."""
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL, timeout: float = 60):
+        """
+        Args:
+            api_key (str): API key sent as a bearer token.
+            base_url (str, optional): API base URL; point it at a local stand-in for testing.
+            timeout (float, optional): Per-request timeout in seconds.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def upload_file(self, job_path: str) -> str:
+        """Upload a job file and return its file ID."""
+        with open(job_path, "rb") as job_file:
+            response = self._request("POST", "/files", data={"purpose": "batch"}, files={"file": (job_path, job_file, "application/jsonl")})
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id: str, completion_window: str = "24h") -> Dict:
+        """Start a batch job for an uploaded job file."""
+        payload = {"input_file_id": input_file_id, "endpoint": CHAT_COMPLETIONS_ENDPOINT, "completion_window": completion_window}
+        return self._request("POST", "/batches", json=payload).json()
+
+    def get_batch(self, batch_id: str) -> Dict:
+        """Fetch the current state of a batch job."""
+        return self._request("GET", f"/batches/{batch_id}").json()
+
+    def download_file(self, file_id: str) -> str:
+        """Download the content of a file (e.g. a batch output file)."""
+        return self._request("GET", f"/files/{file_id}/content").text
+
+    def wait_for_batch(self, batch_id: str, poll_interval: float = 60, timeout: Optional[float] = None) -> Dict:
+        """
+        Poll a batch job until it reaches a terminal status.
+
+        Args:
+            batch_id (str): The batch to poll.
+            poll_interval (float, optional): Seconds between polls.
+            timeout (Optional[float], optional): Give up after this many seconds.
+
+        Returns:
+            Dict: The final batch object.
+        """
+        started = time.monotonic()
+        while True:
+            batch = self.get_batch(batch_id)
+            counts = batch.get("request_counts") or {}
+            print(f"Batch {batch_id}: {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', '?')} requests done)")
+            if batch["status"] in TERMINAL_STATUSES:
+                return batch
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise TimeoutError(f"Batch {batch_id} did not finish within {timeout} seconds")
+            time.sleep(poll_interval)
+
+
+def submit_jobs(client: BulkJobClient, job_files: List[Tuple[str, int]], poll_interval: float = 60) -> Dict[str, Optional[str]]:
+    """
+    Submit job files as batches that run side by side, wait for all of them and merge their answers.
+
+    Args:
+        client (BulkJobClient): The client to submit with.
+        job_files (List[Tuple[str, int]]): (path, number of requests) as returned by write_job_files().
+        poll_interval (float, optional): Seconds between status polls.
+
+    Returns:
+        Dict[str, Optional[str]]: custom_id -> message content; requests that failed map to None
+        and requests missing from the output are absent.
+    """
+    batch_ids = []
+    for path, count in job_files:
+        print(f"Submitting {count} requests from {path}")
+        batch_ids.append(client.create_batch(client.upload_file(path))["id"])
+
+    results: Dict[str, Optional[str]] = {}
+    for batch_id in batch_ids:
+        batch = client.wait_for_batch(batch_id, poll_interval=poll_interval)
+        if batch["status"] != "completed":
+            print(f"[ALERT] Batch {batch['id']} ended with status {batch['status']}")
+        if batch.get("output_file_id"):
+            results.update(parse_results(client.download_file(batch["output_file_id"])))
+        if batch.get("error_file_id"):
+            for custom_id in parse_results(client.download_file(batch["error_file_id"])):
+                results.setdefault(custom_id, None)
+    return results
+
+
+def run_bulk_job(
+    client: BulkJobClient,
+    request_bodies: Iterable[Tuple[str, Dict]],
+    job_path: str,
+    poll_interval: float = 60,
+    accept: Optional[Callable[[Optional[str]], bool]] = None,
+    follow_up_rounds: int = FOLLOW_UP_ROUNDS,
+) -> Dict[str, Optional[str]]:
+    """
+    Write, submit and wait for a bulk job, then return the answers keyed by custom_id.
+
+    The requests are split into as many batches as the endpoint's limits require. Requests without
+    a usable answer are resubmitted as a follow-up job, up to follow_up_rounds times.
+
+    Args:
+        client (BulkJobClient): The client to submit with.
+        request_bodies (Iterable[Tuple[str, Dict]]): (custom_id, chat completion body) pairs.
+        job_path (str): Where to write the JSONL job files; see write_job_files().
+        poll_interval (float, optional): Seconds between status polls.
+        accept (Optional[Callable[[Optional[str]], bool]], optional): Whether an answer's message
+            content is usable; by default any successful answer is.
+        follow_up_rounds (int, optional): Most follow-up jobs for requests without a usable answer.
+
+    Returns:
+        Dict[str, Optional[str]]: custom_id -> message content; requests that failed map to None
+        and requests missing from the output are absent.
+    """
+    custom_ids: Set[str] = set()
+
+    def tracked_requests() -> Iterator[Tuple[str, Dict]]:
+        for custom_id, body in request_bodies:
+            custom_ids.add(custom_id)
+            yield custom_id, body
+
+    job_files = write_job_files(tracked_requests(), job_path)
+    if not custom_ids:
+        return {}
+
+    results: Dict[str, Optional[str]] = {}
+    root, extension = os.path.splitext(job_path)
+    for round_number in range(follow_up_rounds + 1):
+        results.update(submit_jobs(client, job_files, poll_interval=poll_interval))
+        custom_ids = {
+            custom_id for custom_id in custom_ids if results.get(custom_id) is None or (accept is not None and not accept(results[custom_id]))
+        }
+        if not custom_ids or round_number == follow_up_rounds:
+            break
+        print(f"Resubmitting {len(custom_ids)} requests without a usable answer as a follow-up job")
+        job_files = write_job_files(read_job_files(job_files, custom_ids), f"{root}.retry{round_number + 1}{extension}")
+    return results
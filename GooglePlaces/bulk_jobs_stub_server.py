@@ -0,0 +1,145 @@
+"""
+Local stand-in for the provider's file and batch endpoints, for exercising bulk_jobs end to end.
+
+Every request in a submitted job is answered with the same canned JSON content, and a batch
+reports "in_progress" on its first poll and "completed" afterwards. Point the classifiers at it with
+bulk_base_url="http://127.0.0.1:8765/v1".
+
+Usage:
+    python bulk_jobs_stub_server.py [port]
+"""
+
+import itertools
+import json
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+DEFAULT_PORT = 8765
+# Contains the answer keys of both classifiers, so either one can run against the stand-in
+DEFAULT_ANSWER = {"classification": "United States", "category": "Office"}
+
+
+class StubBatchService:
+    """In-memory files and batches."""
+
+    def __init__(self, answer: Optional[Dict] = None):
+        self.answer = json.dumps(answer or DEFAULT_ANSWER)
+        self.files: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _new_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}-{next(self._ids)}"
+
+    def add_file(self, content: bytes) -> Dict:
+        file_id = self._new_id("file")
+        self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "purpose": "batch"}
+
+    def create_batch(self, input_file_id: str) -> Dict:
+        batch_id = self._new_id("batch")
+        requests_ = [json.loads(line) for line in self.files[input_file_id].decode("utf-8").splitlines() if line.strip()]
+        output_lines = []
+        for request in requests_:
+            body = {"object": "chat.completion", "choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer}}]}
+            output_lines.append(json.dumps({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}))
+        output_file_id = self.add_file(("\n".join(output_lines) + "\n").encode("utf-8"))["id"]
+
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "status": "in_progress",
+            "input_file_id": input_file_id,
+            "created_at": int(time.time()),
+            "request_counts": {"total": len(requests_), "completed": 0, "failed": 0},
+            "_output_file_id": output_file_id,
+        }
+        self.batches[batch_id] = batch
+        return self.public_batch(batch)
+
+    def poll_batch(self, batch_id: str) -> Dict:
+        batch = self.batches[batch_id]
+        response = self.public_batch(batch)
+        if batch["status"] == "in_progress":
+            batch["status"] = "completed"
+            batch["output_file_id"] = batch["_output_file_id"]
+            batch["request_counts"]["completed"] = batch["request_counts"]["total"]
+        return response
+
+    @staticmethod
+    def public_batch(batch: Dict) -> Dict:
+        return json.loads(json.dumps({key: value for key, value in batch.items() if not key.startswith("_")}))
+
+
+def make_handler(service: StubBatchService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload, content_type: str = "application/json"):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def do_POST(self):
+            if self.path == "/v1/files":
+                content_type = self.headers.get("Content-Type", "")
+                message = BytesParser(policy=default_policy).parsebytes(
+                    f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + self._read_body()
+                )
+                for part in message.iter_parts():
+                    if part.get_param("name", header="content-disposition") == "file":
+                        return self._send(200, service.add_file(part.get_payload(decode=True)))
+                return self._send(400, {"error": {"message": "missing file part"}})
+            if self.path == "/v1/batches":
+                input_file_id = json.loads(self._read_body())["input_file_id"]
+                if input_file_id not in service.files:
+                    return self._send(404, {"error": {"message": f"unknown file {input_file_id}"}})
+                return self._send(200, service.create_batch(input_file_id))
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts[:2] == ["v1", "batches"] and len(parts) == 3 and parts[2] in service.batches:
+                return self._send(200, service.poll_batch(parts[2]))
+            if parts[:2] == ["v1", "files"] and len(parts) == 4 and parts[3] == "content" and parts[2] in service.files:
+                return self._send(200, service.files[parts[2]], content_type="application/jsonl")
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = DEFAULT_PORT, answer: Optional[Dict] = None) -> ThreadingHTTPServer:
+    """
+    Start the stand-in server on a background thread.
+
+    Args:
+        port (int, optional): Port to listen on (0 picks a free one).
+        answer (Optional[Dict], optional): The JSON content every request is answered with.
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(StubBatchService(answer)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(StubBatchService()))
+    print(f"Stand-in batch server listening on http://127.0.0.1:{port}/v1")
+    server.serve_forever()
@@ -0,0 +1,222 @@
+"""
+Persistent on-disk cache for LLM address classifications.
+
+Entries are stored in SQLite and keyed by the normalized address, the model name and a prompt
+version, so changing either the model or the prompt automatically starts a fresh namespace.
+The cache enforces a maximum age and a maximum number of entries and keeps hit/miss counters.
+Access times of hits (used for least-recently-used eviction) are recorded in memory and written in
+one transaction per touch_every hits, and by evict() and close(), so a lookup never commits on its
+own; get_many() looks a whole batch of addresses up with one query.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_CACHE_PATH = "classification_cache.sqlite"
+# Keys per SELECT ... IN (...) query; stays below SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def normalize_cache_key(address: Optional[str]) -> str:
+    """Collapse whitespace and case so trivially different spellings share a cache entry."""
+    if address is None:
+        return ""
+    return " ".join(str(address).split()).casefold()
+
+
+class ClassificationCache:
+    """SQLite backed classification cache with size/age eviction and hit/miss counters."""
+
+    def __init__(
+        self,
+        model: str,
+        prompt_version: str,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 1_000_000,
+        max_age_days: float = 90,
+        evict_every: int = 1000,
+        touch_every: int = 1000,
+    ):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            model (str): The model whose answers are cached.
+            prompt_version (str): Version tag of the prompt; bump it whenever the prompt changes.
+            path (str, optional): Path to the SQLite file. Defaults to DEFAULT_CACHE_PATH.
+            max_entries (int, optional): Maximum number of entries kept across all namespaces.
+            max_age_days (float, optional): Entries older than this are treated as misses and evicted.
+            evict_every (int, optional): Run eviction after this many writes.
+            touch_every (int, optional): Write the access times of hits after this many of them.
+        """
+        self.model = model
+        self.prompt_version = prompt_version
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 60 * 60
+        self.evict_every = evict_every
+        self.touch_every = touch_every
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_eviction = 0
+        # key -> access time of hits not yet written to the database
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classifications (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_classifications_accessed_at ON classifications (accessed_at)")
+        self._connection.commit()
+        self.evict()
+
+    def _key(self, address: Optional[str]) -> str:
+        raw_key = f"{self.model}\x1f{self.prompt_version}\x1f{normalize_cache_key(address)}"
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def _touch(self, key: str, now: float) -> None:
+        # Caller holds the lock
+        self._touched[key] = now
+        if len(self._touched) >= self.touch_every:
+            self._flush_touches()
+
+    def _flush_touches(self) -> None:
+        # Caller holds the lock; all pending access times go out in one transaction
+        if self._touched:
+            self._connection.executemany("UPDATE classifications SET accessed_at = ? WHERE key = ?", [(now, key) for key, now in self._touched.items()])
+            self._connection.commit()
+            self._touched.clear()
+
+    def __contains__(self, address: Optional[str]) -> bool:
+        """Whether a fresh entry exists, without counting a hit or miss or touching its access time."""
+        with self._lock:
+            row = self._connection.execute("SELECT created_at FROM classifications WHERE key = ?", (self._key(address),)).fetchone()
+        return row is not None and time.time() - row[0] <= self.max_age_seconds
+
+    def get(self, address: Optional[str]) -> Optional[Any]:
+        """
+        Look up a cached classification.
+
+        Args:
+            address (Optional[str]): The address that was classified.
+
+        Returns:
+            Optional[Any]: The cached value, or None on a miss.
+        """
+        key = self._key(address)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, created_at FROM classifications WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self._touch(key, now)
+            self.hits += 1
+        return json.loads(row[0])
+
+    def get_many(self, addresses: Iterable[Optional[str]]) -> Dict[Optional[str], Any]:
+        """
+        Look up several addresses at once, with one query per LOOKUP_CHUNK_SIZE addresses.
+
+        Args:
+            addresses (Iterable[Optional[str]]): The addresses to look up.
+
+        Returns:
+            Dict[Optional[str], Any]: The cached values of the addresses that were hits.
+        """
+        addresses = list(addresses)
+        keys = [self._key(address) for address in addresses]
+        unique_keys: List[str] = list(dict.fromkeys(keys))
+        now = time.time()
+        rows: Dict[str, str] = {}
+        with self._lock:
+            for start in range(0, len(unique_keys), LOOKUP_CHUNK_SIZE):
+                chunk = unique_keys[start : start + LOOKUP_CHUNK_SIZE]
+                query = f"SELECT key, value, created_at FROM classifications WHERE key IN ({', '.join('?' * len(chunk))})"
+                for key, value, created_at in self._connection.execute(query, chunk):
+                    if now - created_at <= self.max_age_seconds:
+                        rows[key] = value
+
+            cached = {}
+            for address, key in zip(addresses, keys):
+                if key in rows:
+                    cached[address] = json.loads(rows[key])
+                    self.hits += 1
+                    self._touch(key, now)
+                else:
+                    self.misses += 1
+        return cached
+
+    def set(self, address: Optional[str], value: Any) -> None:
+        """
+        Store a classification.
+
+        Args:
+            address (Optional[str]): The address that was classified.
+            value (Any): A JSON serializable classification. None values are not cached.
+        """
+        if value is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO classifications (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (self._key(address), json.dumps(value), now, now),
+            )
+            self._connection.commit()
+            self._writes_since_eviction += 1
+            should_evict = self._writes_since_eviction >= self.evict_every
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired entries and trim the cache down to max_entries (least recently used first).
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            # Least recently used is judged on up-to-date access times
+            self._flush_touches()
+            removed = self._connection.execute(
+                "DELETE FROM classifications WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            ).rowcount
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM classifications").fetchone()
+            if count > self.max_entries:
+                removed += self._connection.execute(
+                    "DELETE FROM classifications WHERE key IN (SELECT key FROM classifications ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+            self._connection.commit()
+            self._writes_since_eviction = 0
+        return removed
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        """Human readable summary of the cache's hit/miss counters."""
+        return f"Classification cache: {self.hits} hits, {self.misses} misses ({self.hit_rate:.1%} hit rate)"
+
+    def close(self) -> None:
+        """Write pending access times and close the underlying database connection."""
+        with self._lock:
+            self._flush_touches()
+            self._connection.close()
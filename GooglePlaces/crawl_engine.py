@@ -0,0 +1,317 @@
+"""
+Asyncio crawl engine shared by the website crawlers.
+
+All pages are fetched on one event loop over a single httpx connection pool, so thousands of sites
+can be crawled from one process instead of parking a thread on every page download. Two limits
+apply to every request:
+
+- a global connection budget (max_connections) across all sites, and
+- per-host politeness: at most per_host_concurrency requests to a host at once, with request starts
+  to the same host spaced at least per_host_delay seconds apart.
+
+A request only takes a connection from the global budget once its host allows it, so pages from
+other sites keep flowing while one host is being paced.
+
+Bodies are read into a PageBuffer with a hard byte cap (lower for HTML), so memory per page stays
+bounded however many pages are in flight.
+
+Usage:
+    async with CrawlEngine(max_connections=200) as crawler:
+        async for url, page in crawler.crawl_site("https://example.com", max_pages=10):
+            ...
+"""
+
+import asyncio
+import codecs
+from typing import AsyncIterator, Dict, Optional, Sequence, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from crawl_frontier import DEFAULT_MAX_SIZE, CrawlFrontier
+from page_parser import ParsedPage, parse_page
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+}
+
+MAX_CONNECTIONS = 200
+PER_HOST_CONCURRENCY = 2
+PER_HOST_DELAY = 0.5
+MAX_PAGE_BYTES = 10 * 1024 * 1024
+# HTML pages are cut off earlier: contact details and links sit well within the first megabytes
+MAX_HTML_BYTES = 2 * 1024 * 1024
+
+
+def charset(content_type: Optional[str], default: str = "utf-8") -> str:
+    """
+    The charset named in a Content-Type header, if Python knows it.
+
+    Args:
+        content_type (Optional[str]): The header value, e.g. "text/html; charset=ISO-8859-1".
+        default (str, optional): Returned when the header names no (known) charset.
+
+    Returns:
+        str: The codec name.
+    """
+    for parameter in (content_type or "").split(";")[1:]:
+        name, _, value = parameter.partition("=")
+        if name.strip().lower() == "charset":
+            value = value.strip().strip("\"'")
+            try:
+                return codecs.lookup(value).name
+            except LookupError:
+                break
+    return default
+
+
+class PageBuffer:
+    """
+    Download buffer for one page with a hard byte cap.
+
+    Chunks are copied once into a bytearray (preallocated from Content-Length when the server sends
+    it), so building a page is linear in its size, and the cap counts bytes rather than decoded
+    characters. The text is decoded once at the end with an incremental decoder, which drops a
+    multi-byte character cut in half by the cap instead of garbling it.
+    """
+
+    def __init__(
+        self, content_type: Optional[str] = None, content_length: Optional[str] = None, max_bytes: int = MAX_PAGE_BYTES, max_html_bytes: int = MAX_HTML_BYTES
+    ):
+        """
+        Args:
+            content_type (Optional[str], optional): The response's Content-Type header.
+            content_length (Optional[str], optional): The response's Content-Length header, used as a size hint only.
+            max_bytes (int, optional): Most bytes kept for any page.
+            max_html_bytes (int, optional): Most bytes kept for an HTML page.
+        """
+        self.max_bytes = min(max_bytes, max_html_bytes) if "html" in (content_type or "").lower() else max_bytes
+        self.encoding = charset(content_type)
+        self.truncated = False
+        self.length = 0
+        try:
+            preallocate = min(int(content_length), self.max_bytes) if content_length else 0
+        except ValueError:
+            preallocate = 0
+        self._buffer = bytearray(max(preallocate, 0))
+
+    def write(self, chunk: bytes) -> bool:
+        """
+        Append a chunk, up to the cap.
+
+        Args:
+            chunk (bytes): The next bytes of the body.
+
+        Returns:
+            bool: False once the cap is reached; the caller should stop reading.
+        """
+        room = self.max_bytes - self.length
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        end = self.length + len(chunk)
+        # Overwrites the preallocated space, and extends the buffer in place past it
+        self._buffer[self.length : end] = chunk
+        self.length = end
+        return not self.truncated
+
+    def text(self) -> str:
+        """The page decoded with its charset (UTF-8 if none is given), ignoring undecodable bytes."""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors="ignore")
+        with memoryview(self._buffer) as view:
+            return decoder.decode(view[: self.length], final=True)
+
+
+class _Host:
+    """Politeness state of one host."""
+
+    def __init__(self, concurrency: int):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.next_start = 0.0
+        self.users = 0
+
+
+class CrawlEngine:
+    """Async page fetcher with a global connection budget and per-host concurrency and delay limits."""
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        per_host_concurrency: int = PER_HOST_CONCURRENCY,
+        per_host_delay: float = PER_HOST_DELAY,
+        timeout: float = 30,
+        max_page_bytes: int = MAX_PAGE_BYTES,
+        max_html_bytes: int = MAX_HTML_BYTES,
+        headers: Dict[str, str] = None,
+    ):
+        """
+        Create the engine; do so inside the event loop that will use it.
+
+        Args:
+            max_connections (int, optional): Most requests in flight across all hosts; also the connection pool size.
+            per_host_concurrency (int, optional): Most requests in flight to a single host.
+            per_host_delay (float, optional): Least number of seconds between two request starts to the same host.
+            timeout (float, optional): Per-request timeout in seconds.
+            max_page_bytes (int, optional): Pages are cut off after this many bytes.
+            max_html_bytes (int, optional): HTML pages are cut off after this many bytes.
+            headers (Dict[str, str], optional): Request headers; defaults to DEFAULT_HEADERS.
+        """
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_delay = per_host_delay
+        self.max_page_bytes = max_page_bytes
+        self.max_html_bytes = max_html_bytes
+        self.pages = 0
+        self.failures = 0
+        self.truncated = 0
+        self.bytes = 0
+        self.politeness_wait = 0.0
+        self.http = httpx.AsyncClient(
+            headers=headers or DEFAULT_HEADERS,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout),
+            follow_redirects=True,
+        )
+        self._connections = asyncio.Semaphore(max_connections)
+        self._hosts: Dict[str, _Host] = {}
+
+    async def __aenter__(self) -> "CrawlEngine":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the connection pool."""
+        await self.http.aclose()
+
+    async def _enter_host(self, host: str) -> _Host:
+        """Wait until the host allows another request; returns its state, to be released with _leave_host()."""
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _Host(self.per_host_concurrency)
+        state.users += 1
+        await state.semaphore.acquire()
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        start = max(now, state.next_start)
+        state.next_start = start + self.per_host_delay
+        if start > now:
+            self.politeness_wait += start - now
+            await asyncio.sleep(start - now)
+        return state
+
+    def _leave_host(self, host: str, state: _Host):
+        state.semaphore.release()
+        state.users -= 1
+        # Idle hosts are forgotten once their delay has passed, so the table does not grow with every site crawled
+        if not state.users:
+            loop = asyncio.get_running_loop()
+            if state.next_start <= loop.time():
+                self._hosts.pop(host, None)
+            else:
+                loop.call_at(state.next_start, self._forget_host, host, state)
+
+    def _forget_host(self, host: str, state: _Host):
+        # Another request may have started (and pushed next_start out) since this was scheduled
+        if not state.users and self._hosts.get(host) is state and state.next_start <= asyncio.get_running_loop().time():
+            del self._hosts[host]
+
+    async def fetch(self, url: str) -> str:
+        """
+        Fetch a page, politely and within the connection budget.
+
+        Args:
+            url (str): The page URL.
+
+        Returns:
+            str: The page content, decoded leniently and cut off after max_html_bytes (HTML) or max_page_bytes.
+
+        Raises:
+            httpx.HTTPError: If the request failed or returned an error status.
+        """
+        host = urlparse(url).netloc
+        state = await self._enter_host(host)
+        try:
+            async with self._connections:
+                try:
+                    async with self.http.stream("GET", url) as response:
+                        response.raise_for_status()
+                        buffer = PageBuffer(
+                            response.headers.get("Content-Type"), response.headers.get("Content-Length"), self.max_page_bytes, self.max_html_bytes
+                        )
+                        async for chunk in response.aiter_bytes():
+                            if not buffer.write(chunk):
+                                print(f"Page too large, stopping at {buffer.max_bytes // (1024 * 1024)}MB: {url}")
+                                self.truncated += 1
+                                break
+                except httpx.HTTPError:
+                    self.failures += 1
+                    raise
+        finally:
+            self._leave_host(host, state)
+
+        self.pages += 1
+        self.bytes += buffer.length
+        return buffer.text()
+
+    async def crawl_site(
+        self, base_url: str, priority_urls: Sequence[str] = (), max_pages: int = 10, max_queued: int = DEFAULT_MAX_SIZE
+    ) -> AsyncIterator[Tuple[str, ParsedPage]]:
+        """
+        Crawl one site, following links on the same host, best scoring links (imprint, contact, team, ...) first.
+
+        Pages of one site are fetched one after another; concurrency comes from crawling many sites at once.
+
+        Args:
+            base_url (str): The site's start page; links are followed only on its host.
+            priority_urls (Sequence[str], optional): URLs to visit before base_url, in order (e.g. known team pages).
+            max_pages (int, optional): Most pages fetched (including failed ones).
+            max_queued (int, optional): Most links waiting in the site's frontier; see CrawlFrontier.
+
+        Yields:
+            Tuple[str, ParsedPage]: (url, parsed page) of every page fetched successfully, in crawl order.
+        """
+        frontier = CrawlFrontier(max_queued)
+        base_domain = urlparse(base_url).netloc
+        for url in priority_urls:
+            # Priority URLs come from outside (e.g. an AI pick of team pages); only well-formed ones on this host are used
+            try:
+                if urlparse(url).netloc == base_domain:
+                    frontier.seed(url)
+            except ValueError:
+                continue
+        frontier.seed(base_url)
+        page_count = 0
+
+        while frontier and page_count < max_pages:
+            url = frontier.pop()
+            page_count += 1
+
+            try:
+                content = await self.fetch(url)
+                page = parse_page(content)
+            except Exception as e:
+                # A failing page (HTTP error, malformed or unencodable URL, ...) only costs that page
+                print(f"Error processing {url}: {str(e)}")
+                continue
+
+            for href in page.links:
+                try:
+                    full_url = urljoin(url, href)
+                    if urlparse(full_url).netloc == base_domain:
+                        frontier.add(full_url)
+                except ValueError:
+                    # Malformed links (e.g. "http://[::1") are skipped, not fatal for the site
+                    continue
+
+            yield url, page
+
+    def report(self) -> str:
+        """Human readable summary of the crawl so far."""
+        return (
+            f"Crawl engine: {self.pages} pages ({self.bytes / (1024 * 1024):.1f} MB), {self.failures} failed, "
+            f"{self.truncated} cut off at the size limit, {self.politeness_wait:.1f}s of per-host delay"
+        )
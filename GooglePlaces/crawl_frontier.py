@@ -0,0 +1,146 @@
+"""
+Scored crawl frontier for crawling one site.
+
+URLs wait in a heap keyed by a score, so the page most likely to carry contact details is always
+fetched next. Membership is a set lookup, and every operation is O(log n). The score comes from
+multilingual keywords in the URL path (imprint, contact, team, about, ...) minus a penalty for
+path depth and query strings. Links to files that are not pages (images, PDFs, archives) are
+never queued.
+"""
+
+import heapq
+import itertools
+import re
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+# Path keywords and how likely a page named like that is to show an email address
+KEYWORD_WEIGHTS = {
+    # Legal notices carry a contact address by law in much of Europe
+    "impressum": 10,
+    "imprint": 10,
+    "legal-notice": 9,
+    "mentions-legales": 9,
+    "aviso-legal": 9,
+    "note-legali": 9,
+    "colofon": 9,
+    # Contact pages
+    "kontakt": 9,
+    "contact": 9,
+    "contatti": 9,
+    "contacto": 9,
+    "contato": 9,
+    "ansprechpartner": 8,
+    # Team pages
+    "team": 8,
+    "mitarbeiter": 7,
+    "staff": 7,
+    "equipe": 7,
+    "people": 6,
+    # About pages
+    "ueber-uns": 7,
+    "uber-uns": 7,
+    "über-uns": 7,
+    "über": 4,
+    "uber": 4,
+    "about": 7,
+    "a-propos": 7,
+    "chi-siamo": 7,
+    "quienes-somos": 7,
+    # Pages that often name a contact person
+    "datenschutz": 4,
+    "privacy": 4,
+    "karriere": 3,
+    "jobs": 3,
+    "career": 3,
+    "anfrage": 5,
+    "enquiry": 5,
+    "inquiry": 5,
+    "reservierung": 3,
+    "booking": 2,
+    "anreise": 2,
+}
+_KEYWORDS = re.compile("|".join(sorted(map(re.escape, KEYWORD_WEIGHTS), key=len, reverse=True)))
+DEPTH_PENALTY = 1.0
+QUERY_PENALTY = 2.0
+SKIPPED_EXTENSIONS = tuple(".jpg .jpeg .png .gif .bmp .svg .webp .ico .pdf .zip .rar .doc .docx .xls .xlsx .mp3 .mp4 .mov .avi .css .js .xml .ics .vcf".split())
+SKIPPED_PATHS = ("/cdn-cgi/", "/wp-json/", "/wp-content/uploads/")
+# Links scoring at least this are queued even when the frontier is full
+PRIORITY_SCORE = 5.0
+DEFAULT_MAX_SIZE = 100
+
+
+def score_url(url: str) -> Optional[float]:
+    """
+    Score how likely a URL is to lead to contact details; higher is better.
+
+    Args:
+        url (str): An absolute URL.
+
+    Returns:
+        Optional[float]: The score, or None for links that are not worth fetching at all.
+    """
+    parsed = urlsplit(url)
+    path = unquote(parsed.path).lower()
+    if path.endswith(SKIPPED_EXTENSIONS) or any(skipped in path for skipped in SKIPPED_PATHS):
+        return None
+    weight = max((KEYWORD_WEIGHTS[keyword] for keyword in _KEYWORDS.findall(path)), default=0)
+    depth = sum(1 for segment in path.split("/") if segment)
+    return weight - DEPTH_PENALTY * depth - (QUERY_PENALTY if parsed.query else 0.0)
+
+
+def _without_fragment(url: str) -> str:
+    # A fragment points into the same page
+    return url.split("#", 1)[0]
+
+
+class CrawlFrontier:
+    """Max-heap of URLs by score, with set membership; each URL is admitted at most once."""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        Args:
+            max_size (int, optional): Most URLs waiting at once; when full, only links scoring at
+                least PRIORITY_SCORE are still queued.
+        """
+        self.max_size = max_size
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seen = set()
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, url: str) -> bool:
+        return _without_fragment(url) in self._seen
+
+    def seed(self, url: str) -> None:
+        """Queue a URL ahead of everything scored; seeds are fetched in the order given."""
+        url = _without_fragment(url)
+        if url not in self._seen:
+            self._seen.add(url)
+            heapq.heappush(self._heap, (float("-inf"), next(self._order), url))
+
+    def add(self, url: str) -> bool:
+        """
+        Score and queue a URL unless it was queued before, is not a page, or the frontier is full.
+
+        Args:
+            url (str): An absolute URL; its fragment is ignored.
+
+        Returns:
+            bool: Whether the URL was queued.
+        """
+        url = _without_fragment(url)
+        if url in self._seen:
+            return False
+        score = score_url(url)
+        if score is None or (len(self._heap) >= self.max_size and score < PRIORITY_SCORE):
+            return False
+        self._seen.add(url)
+        heapq.heappush(self._heap, (-score, next(self._order), url))
+        return True
+
+    def pop(self) -> str:
+        """Remove and return the best URL; ties go to the URL queued first."""
+        return heapq.heappop(self._heap)[2]
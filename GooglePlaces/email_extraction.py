@@ -0,0 +1,280 @@
+"""
+Email address extraction from crawled pages.
+
+Every pattern is compiled once at import. A page is scanned in a single pass for "@" and its
+obfuscated spellings ("(at)", "[at]", "&#64;", ...), and each hit is expanded backwards into the
+local part and forwards into the domain with bounded patterns. A page with an entity-encoded "@" is
+unescaped once and scanned once more. Work is linear in the page size, and there are no chunk
+boundaries for an address to fall across.
+
+Besides plain and "(at)"/"(dot)" obfuscated addresses, these are decoded (their markers are located
+with str.find, so pages without them cost nothing extra):
+
+- HTML entities around an encoded "@" (e.g. "info&#64;hotel&#46;de"),
+- spaces around a plain "@" (e.g. "E-Mail: info @ hotel.de"), when the address starts a line or follows
+  punctuation rather than a word, so prose like "contact us @ hotel.de" is not read as an address,
+- percent-encoded mailto: links (e.g. "mailto:info%40hotel.de"), and
+- Cloudflare email protection (data-cfemail attributes and /cdn-cgi/l/email-protection# links).
+
+Usage (micro-benchmark on synthetic pages):
+    python email_extraction.py [page size in MB ...]
+"""
+
+import html
+import random
+import re
+import string
+import sys
+import time
+from typing import Dict, Iterator, List, Sequence, Set, Tuple, Union
+from urllib.parse import unquote
+
+# Spellings of "@" that start a candidate address; entity forms are decoded before the address is read
+_AT_PATTERN = re.compile(r"@|\((?:at|@)\)|\[(?:at|@)\]|\{at\}|&#0*64;|&#x0*40;|&commat;", re.IGNORECASE)
+_ENTITY_AT = re.compile(r"&#0*64;|&#x0*40;|&commat;", re.IGNORECASE)
+_LOCAL_CHARS = frozenset(string.ascii_letters + string.digits + "._%+-")
+_DOT = r"(?:\.|\s*(?:\(dot\)|\[dot\]|\{dot\}|\(\.\)|\[\.\])\s*)"
+# The domain right after "@": up to 8 labels and an alphabetic TLD
+_DOMAIN_AFTER = re.compile(r"(?:[A-Za-z0-9-]{1,63}\.){1,8}[A-Za-z]{2,24}(?![A-Za-z0-9-])")
+_DOMAIN_AFTER_SPACED = re.compile(rf"\s*((?:[A-Za-z0-9-]{{1,63}}{_DOT}){{1,8}}[A-Za-z]{{2,24}})(?![A-Za-z0-9-])", re.IGNORECASE)
+_OBFUSCATED_DOT = re.compile(r"\s*(?:\(dot\)|\[dot\]|\{dot\}|\(\.\)|\[\.\])\s*", re.IGNORECASE)
+_HEX = re.compile(r"[\"']?([0-9a-fA-F]{4,})")
+_MAILTO_TARGET = re.compile(r"[^\"'<>\s?]+")
+
+# Most whitespace skipped on either side of a plain "@"
+MAX_AT_SPACING = 3
+EXCLUDED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".svg", ".webp")
+
+
+def decode_cfemail(encoded: str) -> str:
+    """
+    Decode a Cloudflare-protected address: the first byte is the XOR key for the rest.
+
+    Args:
+        encoded (str): The hex string from data-cfemail or an email-protection# link.
+
+    Returns:
+        str: The decoded text, or "" if it is not valid hex.
+    """
+    try:
+        data = bytes.fromhex(encoded)
+    except ValueError:
+        return ""
+    return "".join(chr(byte ^ data[0]) for byte in data[1:])
+
+
+def _local_part(text: str, end: int) -> str:
+    """The local part ending at text[end], or "" if there is none or it is longer than 64 characters."""
+    start = end
+    limit = max(0, end - 65)
+    while start > limit and text[start - 1] in _LOCAL_CHARS:
+        start -= 1
+    if start == limit and start > 0 and text[start - 1] in _LOCAL_CHARS:
+        return ""
+    return text[start:end].lstrip(".")
+
+
+def _skip_space_back(text: str, position: int) -> int:
+    """position moved back over at most MAX_AT_SPACING whitespace characters."""
+    limit = max(0, position - MAX_AT_SPACING)
+    while position > limit and text[position - 1].isspace():
+        position -= 1
+    return position
+
+
+def _starts_entry(text: str, position: int) -> bool:
+    """Whether text[position] starts a line or follows punctuation (e.g. "E-Mail: "), not a word, ignoring spaces in between."""
+    while position and text[position - 1] in " \t\xa0":
+        position -= 1
+    return not position or text[position - 1] == "\n" or not text[position - 1].isalnum()
+
+
+def _skip_space(text: str, position: int) -> int:
+    """position moved forward over at most MAX_AT_SPACING whitespace characters."""
+    limit = min(len(text), position + MAX_AT_SPACING)
+    while position < limit and text[position].isspace():
+        position += 1
+    return position
+
+
+def _find_all(text: str, marker: str) -> Iterator[int]:
+    """Positions right after every occurrence of marker in text."""
+    position = text.find(marker)
+    while position != -1:
+        position += len(marker)
+        yield position
+        position = text.find(marker, position)
+
+
+def _scan(text: str, found: Dict[str, str]) -> None:
+    """Add the addresses around every "@" spelling in text to found (lowercased address -> first spelling)."""
+    unescaped = False
+    for at in _AT_PATTERN.finditer(text):
+        position = at.start()
+        token = at.group()
+        if token == "@":
+            # Most "@" on a page belong to CSS rules, handles or image names; drop those before any pattern runs
+            local_end = _skip_space_back(text, position)
+            if not local_end or text[local_end - 1] not in _LOCAL_CHARS:
+                continue
+            domain_start = _skip_space(text, at.end())
+            domain = _DOMAIN_AFTER.match(text, domain_start)
+            if not domain:
+                continue
+            local, domain = _local_part(text, local_end), domain.group()
+            # A spaced "@" in running text ("contact us @ hotel.de") is prose, not an address
+            if (local_end < position or domain_start > at.end()) and not _starts_entry(text, local_end - len(local)):
+                continue
+        elif _ENTITY_AT.fullmatch(token):
+            # Unescape the whole text once and read every entity-encoded address from that; later hits are covered
+            if not unescaped:
+                unescaped = True
+                _scan(html.unescape(text), found)
+            continue
+        else:
+            # Obfuscated spellings may have spaces around them
+            while position and text[position - 1].isspace():
+                position -= 1
+            domain = _DOMAIN_AFTER_SPACED.match(text, at.end())
+            if not domain:
+                continue
+            local, domain = _local_part(text, position), _OBFUSCATED_DOT.sub(".", domain.group(1))
+
+        email = f"{local}@{domain}"
+        if local and not email.lower().endswith(EXCLUDED_EXTENSIONS):
+            found.setdefault(email.lower(), email)
+
+
+def extract_emails(content: Union[str, bytes]) -> List[str]:
+    """
+    Extract the email addresses from a page.
+
+    Args:
+        content (Union[str, bytes]): The page; bytes are decoded as UTF-8, ignoring errors.
+
+    Returns:
+        List[str]: The unique addresses (case-insensitively), in the order they first appear.
+    """
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="ignore")
+    found: Dict[str, str] = {}
+    _scan(content, found)
+
+    # The decoders look for their markers with str.find, which is much cheaper than another regex pass over the page
+    for marker in ("data-cfemail=", "/cdn-cgi/l/email-protection#"):
+        for position in _find_all(content, marker):
+            encoded = _HEX.match(content, position)
+            if encoded:
+                _scan(decode_cfemail(encoded.group(1)), found)
+    for position in _find_all(content, "mailto:"):
+        target = _MAILTO_TARGET.match(content, position)
+        if target and "%" in target.group():
+            _scan(unquote(html.unescape(target.group())), found)
+
+    return list(found.values())
+
+
+def _encode_cfemail(email: str, key: int = 0x5A) -> str:
+    return f"{key:02x}" + "".join(f"{ord(char) ^ key:02x}" for char in email)
+
+
+def _legacy_extract(text: str, chunk_size: int = 100000) -> List[str]:
+    """The extractor this module replaces: a plain pattern over non-overlapping 100k-character slices."""
+    email_pattern = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
+    valid_emails: Set[str] = set()
+    for i in range(0, len(text), chunk_size):
+        for match in email_pattern.findall(text[i : i + chunk_size]):
+            if not any(match.lower().endswith(ext) for ext in EXCLUDED_EXTENSIONS):
+                valid_emails.add(match)
+    return list(valid_emails)
+
+
+def synthetic_page(size: int, seed: int = 0) -> Tuple[str, List[str]]:
+    """
+    Build an HTML page of about `size` characters with addresses hidden in every supported way.
+
+    Args:
+        size (int): Approximate page size in characters.
+        seed (int, optional): Random seed.
+
+    Returns:
+        Tuple[str, List[str]]: The page, and the addresses planted in it.
+    """
+    rng = random.Random(seed)
+    filler = [
+        "<div class=\"room\"><p>Unser Hotel liegt direkt am See &amp; bietet 42 Zimmer mit Blick auf die Berge.</p></div>\n",
+        "<style>@media (max-width: 600px) { .nav { display: none; } } @font-face { font-family: x; }</style>\n",
+        '<img src="/static/logo@2x.png" alt="Logo"><a href="/zimmer/doppelzimmer.html">Doppelzimmer</a>\n',
+        "<script>var token = \"" + "".join(rng.choice(string.ascii_letters + string.digits + "+/") for _ in range(400)) + "\";</script>\n",
+        "<p>Folgen Sie uns auf Instagram @hotel_am_see &#8211; wir freuen uns auf Sie!</p>\n",
+    ]
+    planted = []
+
+    def plant(index: int) -> str:
+        email = f"kontakt{index}@hotel-{index}.de"
+        planted.append(email)
+        kind = index % 6
+        if kind == 0:
+            return f"<p>E-Mail: {email}</p>\n"
+        if kind == 1:
+            return f"<p>E-Mail: kontakt{index} (at) hotel-{index} (dot) de</p>\n"
+        if kind == 2:
+            return "<p>" + "".join(f"&#{ord(char)};" for char in email) + "</p>\n"
+        if kind == 3:
+            return f'<a href="mailto:kontakt{index}%40hotel-{index}.de">Schreiben Sie uns</a>\n'
+        if kind == 4:
+            return f'<a href="/cdn-cgi/l/email-protection" class="__cf_email__" data-cfemail="{_encode_cfemail(email)}">[email&#160;protected]</a>\n'
+        return f"<p>Reservierung: {email}</p>\n"
+
+    parts, length = [], 0
+    while length < size:
+        part = plant(len(planted)) if rng.random() < 0.01 else rng.choice(filler)
+        parts.append(part)
+        length += len(part)
+    page = "".join(parts)
+
+    # One plain address straddling the 100 000 character slice boundary of the legacy extractor
+    straddling = "grenze@hotel-grenze.de"
+    cut = 100000 - len(straddling) // 2 - 1
+    if len(page) > cut:
+        # Planted between two elements, padded with spaces up to the boundary
+        position = page.rfind(">", 0, cut) + 1
+        page = f"{page[:position]}{' ' * (cut - position)} {straddling} {page[position:]}"
+        planted.append(straddling)
+    return page, planted
+
+
+def benchmark(page_sizes: Sequence[int] = (100_000, 1_000_000, 10_000_000), repeats: int = 3) -> List[Dict[str, float]]:
+    """
+    Compare extract_emails() with the legacy extractor on synthetic pages.
+
+    Args:
+        page_sizes (Sequence[int], optional): Page sizes in characters.
+        repeats (int, optional): Runs per page; the fastest one counts.
+
+    Returns:
+        List[Dict[str, float]]: Per page size and extractor, the throughput in MB/s and the share of
+        planted addresses found.
+    """
+    results = []
+    for size in page_sizes:
+        page, planted = synthetic_page(size)
+        expected = {email.lower() for email in planted}
+        for name, extractor in (("legacy", _legacy_extract), ("engine", extract_emails)):
+            best = float("inf")
+            for _ in range(repeats):
+                started = time.perf_counter()
+                emails = extractor(page)
+                best = min(best, time.perf_counter() - started)
+            recall = len(expected & {email.lower() for email in emails}) / len(expected) if expected else 1.0
+            results.append({"size": size, "extractor": name, "mb_per_second": len(page) / best / 1e6, "recall": recall, "found": len(emails)})
+    return results
+
+
+if __name__ == "__main__":
+    sizes = [int(float(arg) * 1_000_000) for arg in sys.argv[1:]] or (100_000, 1_000_000, 10_000_000)
+    for result in benchmark(sizes):
+        print(
+            f"{result['size'] / 1e6:6.1f} MB page, {result['extractor']:>6}: {result['mb_per_second']:7.1f} MB/s, "
+            f"{result['recall']:.1%} of planted addresses found, {result['found']} addresses returned"
+        )
@@ -1,21 +1,31 @@
-import regex
+import asyncio
+import httpx
 import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict, Optional, Set, Tuple
+from typing import List, Dict, Optional, Tuple
 import csv
 import json
 from pydantic import BaseModel, Field, HttpUrl
-from urllib.parse import urlencode, urljoin, urlparse
+from urllib.parse import urlencode, urlparse
 from tqdm import tqdm
 from config import GOOGLE_API_KEY, OPENAI_API_KEY, MODEL
 from enum import Enum
 from openai import OpenAI
 import time
 import concurrent.futures
-import threading
-import queue
+from crawl_engine import CrawlEngine
+from places_cache import PlacesCache
+from places_client import CONTACT_FIELDS, PlacesClient
+from rate_limiting import QUOTA_ATTEMPTS, AdaptiveConcurrency, backoff_delay, is_quota_error
+from single_flight import AsyncSingleFlight
+from streaming import bounded_as_completed
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+# Hotels resolved on earlier runs (e.g. when re-running a "try again" file) are answered from the local cache
+places_cache = PlacesCache()
+# Duplicate hotels processed at the same time share one crawl of their website
+website_flights = AsyncSingleFlight("Website crawl coalescing")
+# Knowledge Graph calls in flight across the worker threads; lowered while Google reports quota errors
+kg_concurrency = AdaptiveConcurrency(maximum=30)
 
 
 class APIChoice(Enum):
@@ -51,40 +61,6 @@ def get_base_url(url):
     return base_url
 
 
-def extract_emails_from_text(text: str, chunk_size: int = 100000) -> List[str]:
-    # Email pattern that matches most valid email formats
-    email_pattern = regex.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
-
-    # Compile the cleaning patterns
-    clean_start = regex.compile(r"^[^A-Za-z0-9]+")
-    clean_end = regex.compile(r"[^A-Za-z0-9._%+-]+$")
-
-    # Set of excluded extensions
-    excluded_extensions = {".png", ".jpg", ".jpeg", ".gif", ".bmp"}
-
-    valid_emails: Set[str] = set()
-
-    # Process text in chunks
-    for i in range(0, len(text), chunk_size):
-        chunk = text[i : i + chunk_size]
-
-        # Extract all matches based on the pattern
-        matches = email_pattern.findall(chunk)
-
-        for match in matches:
-            # Clean any leading/trailing non-email characters
-            cleaned = clean_start.sub("", match)
-            cleaned = clean_end.sub("", cleaned)
-
-            # Validate cleaned email against the email pattern
-            if email_pattern.match(cleaned):
-                # Extra check to exclude common non-email patterns
-                if not any(cleaned.lower().endswith(ext) for ext in excluded_extensions):
-                    valid_emails.add(cleaned)
-
-    return list(valid_emails)
-
-
 def ai_extract_email(text: str, max_length: int = 10000) -> Optional[str]:
     # Truncate the text to the maximum length specified
     if len(text) > max_length:
@@ -122,72 +98,24 @@ def ai_extract_email(text: str, max_length: int = 10000) -> Optional[str]:
     return ai_response.get("email"), ai_response.get("room_number"), ai_response.get("how_sustainable")
 
 
-def extract_emails_from_website(base_url: str, max_pages: int = 10) -> Tuple[List[str], str, str, str]:
+async def extract_emails_from_website(crawler: CrawlEngine, base_url: str, max_pages: int = 10) -> Tuple[List[str], str, str, str]:
     try:
         print(f"Extracting email from website: {base_url}")
 
-        visited = set()
-        to_visit = [base_url]
         all_emails = set()
         page_count = 0
         ai_email = None
         room_number = None
         explanation = None
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
-            "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        }
-
-        website_base = get_base_url(base_url)
-        base_domain = urlparse(base_url).netloc
-
-        while to_visit and page_count < max_pages:
-            url = to_visit.pop(0)
-            if url in visited:
-                continue
-
-            try:
-                page_count += 1
-                response = requests.get(url, headers=headers, timeout=30, stream=True)
-                response.raise_for_status()  # Raise an exception for bad status codes
-
-                content = ""
-                for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB chunks
-                    content += chunk.decode("utf-8", errors="ignore")
-                    if len(content) > 10 * 1024 * 1024:  # Stop after 10MB
-                        print(f"Page too large, stopping at 10MB: {url}")
-                        break
-
-                soup = BeautifulSoup(content, "html.parser")
-
-                if url == base_url:
-                    ai_email, room_number, explanation = ai_extract_email(content)
-
-                page_emails = extract_emails_from_text(content)
-                all_emails.update(page_emails)
-
-                for link in tqdm(soup.find_all("a", href=True), desc=f"Processing links for {url}", leave=False):
-                    href = link["href"]
-                    if not href.startswith(("http://", "https://")):
-                        full_url = urljoin(website_base, href)
-                    else:
-                        full_url = href
-
-                    if urlparse(full_url).netloc == base_domain:
-                        if full_url not in visited and full_url not in to_visit:
-                            if any(term in href.lower() for term in ["about", "contact", "über", "kontakt", "uber"]):
-                                to_visit.insert(0, full_url)  # Prioritize these pages
-                            elif len(to_visit) < max_pages * 2:  # Limit size of to_visit
-                                to_visit.append(full_url)
-
-                visited.add(url)
-                time.sleep(0.5)  # Increased delay for rate limiting
-            except requests.RequestException as e:
-                print(f"Error processing {url}: {str(e)}")
-            except Exception as e:
-                print(f"Unexpected error processing {url}: {str(e)}")
+
+        async for url, page in crawler.crawl_site(base_url, max_pages=max_pages):
+            page_count += 1
+            if url == base_url:
+                # The OpenAI call blocks, so it runs on the loop's worker threads
+                ai_email, room_number, explanation = await asyncio.get_running_loop().run_in_executor(None, ai_extract_email, page.text)
+
+            page_emails = page.emails()
+            all_emails.update(page_emails)
 
         print(f"Found {len(all_emails)} email(s) from {page_count} pages")
         return list(all_emails), ai_email, room_number, explanation
@@ -206,8 +134,20 @@ def query_knowledge_graph(query: str) -> KnowledgeGraphResponse:
         "prefix": True,
     }
     url: str = service_url + "?" + urlencode(params)
-    response: requests.Response = requests.get(url)
-    return KnowledgeGraphResponse(**json.loads(response.text))
+    # Throttled calls are retried with jittered backoff instead of losing the row
+    for attempt in range(QUOTA_ATTEMPTS):
+        with kg_concurrency:
+            response: requests.Response = requests.get(url, timeout=30)
+        payload = json.loads(response.text)
+        if not is_quota_error(response.status_code, payload):
+            kg_concurrency.on_success()
+            break
+        kg_concurrency.on_throttle()
+        if attempt + 1 < QUOTA_ATTEMPTS:
+            time.sleep(backoff_delay(attempt))
+    else:
+        print(f"[ALERT] Knowledge Graph quota still exceeded after {QUOTA_ATTEMPTS} attempts for: {query}")
+    return KnowledgeGraphResponse(**payload)
 
 
 def extract_hotel_info_kg(result: KnowledgeGraphResponse) -> Optional[HotelInfo]:
@@ -223,57 +163,29 @@ def extract_hotel_info_kg(result: KnowledgeGraphResponse) -> Optional[HotelInfo]
     return None
 
 
-def get_place_id(query: str) -> Optional[str]:
-    base_url: str = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
-    params: Dict[str, str] = {"input": query, "inputtype": "textquery", "key": GOOGLE_API_KEY}
-    response: requests.Response = requests.get(base_url, params=params)
-    result = response.json()
-    if result.get("status") == "OK" and result.get("candidates"):
-        return result["candidates"][0]["place_id"]
-    return None
-
-
-def get_place_details(place_id: str) -> Dict:
-    base_url: str = "https://maps.googleapis.com/maps/api/place/details/json"
-    params: Dict[str, str] = {
-        "place_id": place_id,
-        "fields": "name,website,formatted_address,formatted_phone_number,international_phone_number,geometry",
-        "key": GOOGLE_API_KEY,
-    }
-    response: requests.Response = requests.get(base_url, params=params)
-    return response.json()
-
-
-def extract_hotel_info_places(place_details: Dict) -> Optional[HotelInfo]:
-    if "result" in place_details:
-        result = place_details["result"]
-
+async def extract_hotel_info_places(crawler: CrawlEngine, place: Optional[Dict]) -> Optional[HotelInfo]:
+    if place:
         email = None
         ai_email_inspection = None
         room_number = None
         explanation = None
 
-        # Try to find email in adr_address
-        if "adr_address" in result:
-            email = [extract_emails_from_text(result["adr_address"])]
-
-        # If no email found and website is available, try to extract from website
-        if not email and "website" in result:
-            email, ai_email_inspection, room_number, explanation = extract_emails_from_website(result["website"])
+        # If a website is available, try to extract an email from it
+        if "websiteUri" in place:
+            website = place["websiteUri"]
+            email, ai_email_inspection, room_number, explanation = await website_flights.do(
+                website.rstrip("/").lower(), extract_emails_from_website, crawler, website
+            )
 
         return HotelInfo(
-            name=result.get("name", ""),
-            website=result.get("website"),
-            url=result.get("url"),
-            formatted_address=result.get("formatted_address"),
-            adr_address=result.get("adr_address"),
-            formatted_phone_number=result.get("formatted_phone_number"),
-            international_phone_number=result.get("international_phone_number"),
+            name=place.get("displayName", {}).get("text", ""),
+            website=place.get("websiteUri"),
+            formatted_address=place.get("formattedAddress"),
+            formatted_phone_number=place.get("nationalPhoneNumber"),
+            international_phone_number=place.get("internationalPhoneNumber"),
             email=email,
-            latitude=result.get("geometry", {}).get("location", {}).get("lat"),
-            longitude=result.get("geometry", {}).get("location", {}).get("lng"),
-            plus_code=result.get("plus_code"),
-            types=result.get("types"),
+            latitude=place.get("location", {}).get("latitude"),
+            longitude=place.get("location", {}).get("longitude"),
             ai_email_inspection=ai_email_inspection,
             room_number=room_number,
             explanation=explanation,
@@ -281,37 +193,83 @@ def extract_hotel_info_places(place_details: Dict) -> Optional[HotelInfo]:
     return None
 
 
-def process_hotel(row: Dict[str, str], api_choice: APIChoice) -> Dict[str, str]:
+def build_query(row: Dict[str, str]) -> str:
     hotel_name: str = row["HotelName"]
     address: str = row.get("address", "")
 
     # Construct query: "{hotelName} {address}" or "{hotelName} Germany" if no address
-    query = f"{hotel_name} {address}" if address else f"{hotel_name} Germany"
+    return f"{hotel_name} {address}" if address else f"{hotel_name} Germany"
+
+
+async def lookup_place(places_client: PlacesClient, query: str) -> Optional[Dict]:
+    """Look up one query; a failed lookup comes back as None."""
+    try:
+        return await places_client.search_text(query, CONTACT_FIELDS)
+    except httpx.HTTPError as e:
+        print(f"Places request failed for {query}: {e}")
+        return None
+    except Exception as e:
+        print(f"Places lookup failed for {query}: {e}")
+        return None
+
+
+async def process_hotel(crawler: CrawlEngine, row: Dict[str, str], api_choice: APIChoice, place: Optional[Dict] = None) -> Dict[str, str]:
+    hotel_name: str = row["HotelName"]
+    query = build_query(row)
 
     print(f"processing: {hotel_name}")
     print(f"using query: {query}")
 
     hotel_info = None
 
-    if api_choice == APIChoice.KNOWLEDGE_GRAPH:
-        result: KnowledgeGraphResponse = query_knowledge_graph(query)
-        hotel_info: Optional[HotelInfo] = extract_hotel_info_kg(result)
-    elif api_choice == APIChoice.PLACES:
-        place_id = get_place_id(query)
-        if place_id:
-            place_details = get_place_details(place_id)
-            hotel_info = extract_hotel_info_places(place_details)
-    else:
+    if api_choice not in (APIChoice.KNOWLEDGE_GRAPH, APIChoice.PLACES):
         raise ValueError("Invalid API choice. Choose from KNOWLEDGE_GRAPH and PLACES")
 
+    try:
+        if api_choice == APIChoice.KNOWLEDGE_GRAPH:
+            # Knowledge Graph calls are blocking and run on the loop's worker threads
+            result: KnowledgeGraphResponse = await asyncio.get_running_loop().run_in_executor(None, query_knowledge_graph, query)
+            hotel_info: Optional[HotelInfo] = extract_hotel_info_kg(result)
+        else:
+            # The place was looked up beforehand on the async Places client
+            hotel_info = await extract_hotel_info_places(crawler, place)
+    except Exception as e:
+        # One failing hotel must not stop the run; its row is written unenriched
+        print(f"Error processing {hotel_name}: {e}")
+
     if hotel_info is not None:
         row.update(hotel_info.dict(exclude_unset=True))
 
     return row
 
 
-def process_hotels_multithreaded(input_file: str, output_file: str, api_choice: APIChoice, max_workers: int = 20) -> None:
-    with open(input_file, "r", newline="") as infile:
+async def process_rows(
+    rows, writer: csv.DictWriter, outfile, api_choice: APIChoice, max_workers: int, max_concurrency: int, max_sites: int
+) -> None:
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=max_workers))
+    async with PlacesClient(GOOGLE_API_KEY, max_concurrency=max_concurrency, cache=places_cache) as places_client, CrawlEngine() as crawler:
+
+        async def process_row(row: Dict[str, str]) -> Dict[str, str]:
+            place = await lookup_place(places_client, build_query(row)) if api_choice == APIChoice.PLACES else None
+            return await process_hotel(crawler, row, api_choice, place)
+
+        # Places lookups and website crawls of up to max_sites hotels interleave on the event loop
+        results = bounded_as_completed(process_row, rows, max_in_flight=max_sites)
+        with tqdm(desc="Processing hotels", unit="hotel") as progress:
+            async for row in results:
+                writer.writerow(row)
+                outfile.flush()  # Ensure data is written to disk
+                progress.update()
+        if api_choice == APIChoice.PLACES:
+            print(places_client.report())
+            print(crawler.report())
+
+
+def process_hotels(
+    input_file: str, output_file: str, api_choice: APIChoice, max_workers: int = 20, max_concurrency: int = 100, max_sites: int = 500
+) -> None:
+    with open(input_file, "r", newline="") as infile, open(output_file, "w", newline="") as outfile:
         reader = csv.DictReader(infile)
         fieldnames: List[str] = reader.fieldnames + [
             "name",
@@ -331,56 +289,37 @@ def process_hotels_multithreaded(input_file: str, output_file: str, api_choice:
             "explanation",
         ]
 
-        total_rows = sum(1 for row in csv.DictReader(open(input_file)))
-        infile.seek(0)
-        next(reader)  # Skip the header row
-
-        result_queue = queue.Queue()
-        csv_lock = threading.Lock()
-
-        def writer_thread():
-            with open(output_file, "w", newline="") as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-                writer.writeheader()
-
-                while True:
-                    result = result_queue.get()
-                    if result is None:
-                        break
-                    with csv_lock:
-                        writer.writerow(result)
-                        outfile.flush()  # Ensure data is written to disk
-                    result_queue.task_done()
-
-        writer = threading.Thread(target=writer_thread)
-        writer.start()
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for row in reader:
-                future = executor.submit(process_hotel, row, api_choice)
-                future.add_done_callback(lambda f: result_queue.put(f.result()))
-                futures.append(future)
-
-            for future in tqdm(concurrent.futures.as_completed(futures), total=total_rows, desc="Processing hotels", unit="hotel"):
-                pass  # Progress bar
-
-        # Signal the writer thread to finish
-        result_queue.put(None)
-        writer.join()
+        # Rows are streamed from the file and written as they complete, so memory stays flat however large the input is
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+        writer.writeheader()
+        asyncio.run(process_rows(reader, writer, outfile, api_choice, max_workers, max_concurrency, max_sites))
 
+    print(places_cache.report())
+    print(website_flights.report())
+    if api_choice == APIChoice.KNOWLEDGE_GRAPH:
+        print(kg_concurrency.report())
     print(f"Processing complete. Enriched data saved to {output_file}")
 
 
-def enrich_hotel_data(input_file: str, output_file: str, api_choice: APIChoice = APIChoice.PLACES, max_workers: int = 20) -> None:
+def enrich_hotel_data(
+    input_file: str,
+    output_file: str,
+    api_choice: APIChoice = APIChoice.PLACES,
+    max_workers: int = 20,
+    max_concurrency: int = 100,
+    max_sites: int = 500,
+) -> None:
     """
     Main function to enrich hotel data from an input CSV file and save to an output CSV file.
 
     :param input_file: Path to the input CSV file
     :param output_file: Path to the output CSV file where enriched data will be saved
     :param api_choice: Choose between KNOWLEDGE_GRAPH, PLACES, and OSM API
+    :param max_workers: Threads for the blocking calls (Knowledge Graph lookups and OpenAI email inspection)
+    :param max_concurrency: Places requests in flight at once
+    :param max_sites: Hotels processed at once; their websites are crawled concurrently, politely per host
     """
-    process_hotels_multithreaded(input_file, output_file, api_choice, max_workers)
+    process_hotels(input_file, output_file, api_choice, max_workers, max_concurrency, max_sites)
     print(f"Processing complete using {api_choice.value}. Enriched data saved to {output_file}")
 
 
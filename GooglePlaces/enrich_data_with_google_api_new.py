@@ -1,7 +1,7 @@
-import regex
+import asyncio
+import httpx
 import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict, Optional, Set, Tuple
+from typing import List, Dict, Optional, Tuple
 import csv
 import json
 from pydantic import BaseModel, Field, HttpUrl
@@ -11,11 +11,16 @@ from config import GOOGLE_API_KEY, OPENAI_API_KEY, MODEL
 from enum import Enum
 from openai import OpenAI
 import time
-import concurrent.futures
-import threading
-import queue
+from crawl_engine import PageBuffer
+from crawl_frontier import CrawlFrontier
+from page_parser import parse_page
+from places_cache import PlacesCache
+from places_client import CONTACT_FIELDS, PlacesClient
+from streaming import bounded_as_completed
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+# Hotels resolved on earlier runs (e.g. when re-running a "try again" file) are answered from the local cache
+places_cache = PlacesCache()
 
 
 class HotelInfo(BaseModel):
@@ -38,26 +43,6 @@ def get_base_url(url):
     return base_url
 
 
-def extract_emails_from_text(text: str, chunk_size: int = 100000) -> List[str]:
-    email_pattern = regex.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
-    clean_start = regex.compile(r"^[^A-Za-z0-9]+")
-    clean_end = regex.compile(r"[^A-Za-z0-9._%+-]+$")
-    excluded_extensions = {".png", ".jpg", ".jpeg", ".gif", ".bmp"}
-    valid_emails: Set[str] = set()
-
-    for i in range(0, len(text), chunk_size):
-        chunk = text[i : i + chunk_size]
-        matches = email_pattern.findall(chunk)
-        for match in matches:
-            cleaned = clean_start.sub("", match)
-            cleaned = clean_end.sub("", cleaned)
-            if email_pattern.match(cleaned):
-                if not any(cleaned.lower().endswith(ext) for ext in excluded_extensions):
-                    valid_emails.add(cleaned)
-
-    return list(valid_emails)
-
-
 def ai_extract_email(text: str, max_length: int = 10000) -> Optional[str]:
     if len(text) > max_length:
         text = text[:max_length] + "..."
@@ -98,8 +83,8 @@ def extract_emails_from_website(base_url: str, max_pages: int = 10) -> Tuple[Lis
     try:
         print(f"Extracting email from website: {base_url}")
 
-        visited = set()
-        to_visit = [base_url]
+        frontier = CrawlFrontier()
+        frontier.seed(base_url)
         all_emails = set()
         page_count = 0
         ai_email = None
@@ -115,46 +100,38 @@ def extract_emails_from_website(base_url: str, max_pages: int = 10) -> Tuple[Lis
         website_base = get_base_url(base_url)
         base_domain = urlparse(base_url).netloc
 
-        while to_visit and page_count < max_pages:
-            url = to_visit.pop(0)
-            if url in visited:
-                continue
+        while frontier and page_count < max_pages:
+            url = frontier.pop()
 
             try:
                 page_count += 1
                 response = requests.get(url, headers=headers, timeout=30, stream=True)
                 response.raise_for_status()
 
-                content = ""
-                for chunk in response.iter_content(chunk_size=1024 * 1024):
-                    content += chunk.decode("utf-8", errors="ignore")
-                    if len(content) > 10 * 1024 * 1024:
-                        print(f"Page too large, stopping at 10MB: {url}")
+                buffer = PageBuffer(response.headers.get("Content-Type"), response.headers.get("Content-Length"))
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if not buffer.write(chunk):
+                        print(f"Page too large, stopping at {buffer.max_bytes // (1024 * 1024)}MB: {url}")
                         break
+                content = buffer.text()
 
-                soup = BeautifulSoup(content, "html.parser")
+                page = parse_page(content)
 
                 if url == base_url:
-                    ai_email, room_number, explanation = ai_extract_email(content)
+                    ai_email, room_number, explanation = ai_extract_email(page.text)
 
-                page_emails = extract_emails_from_text(content)
+                page_emails = page.emails()
                 all_emails.update(page_emails)
 
-                for link in tqdm(soup.find_all("a", href=True), desc=f"Processing links for {url}", leave=False):
-                    href = link["href"]
+                for href in tqdm(page.links, desc=f"Processing links for {url}", leave=False):
                     if not href.startswith(("http://", "https://")):
                         full_url = urljoin(website_base, href)
                     else:
                         full_url = href
 
                     if urlparse(full_url).netloc == base_domain:
-                        if full_url not in visited and full_url not in to_visit:
-                            if any(term in href.lower() for term in ["about", "contact", "über", "kontakt", "uber"]):
-                                to_visit.insert(0, full_url)
-                            elif len(to_visit) < max_pages * 2:
-                                to_visit.append(full_url)
+                        frontier.add(full_url)
 
-                visited.add(url)
                 time.sleep(0.5)
             except requests.RequestException as e:
                 print(f"Error processing {url}: {str(e)}")
@@ -168,19 +145,10 @@ def extract_emails_from_website(base_url: str, max_pages: int = 10) -> Tuple[Lis
         return [], None, None, None
 
 
-def query_places_api(query: str) -> Optional[HotelInfo]:
-    base_url: str = "https://places.googleapis.com/v1/places:searchText"
-    headers = {
-        "Content-Type": "application/json",
-        "X-Goog-Api-Key": GOOGLE_API_KEY,
-        "X-Goog-FieldMask": "places.displayName,places.formattedAddress,places.websiteUri,places.internationalPhoneNumber,places.nationalPhoneNumber,places.location",  # Added field
-    }
-    data = json.dumps({"textQuery": query})
-    response: requests.Response = requests.post(base_url, headers=headers, data=data)
-    result = response.json()
+async def query_places_api(places_client: PlacesClient, query: str) -> Optional[HotelInfo]:
+    place = await places_client.search_text(query, CONTACT_FIELDS)
 
-    if result.get("places"):
-        place = result["places"][0]
+    if place:
         email = None
         ai_email_inspection = None
         room_number = None
@@ -205,7 +173,7 @@ def query_places_api(query: str) -> Optional[HotelInfo]:
     return None
 
 
-def process_hotel(row: Dict[str, str]) -> Dict[str, str]:
+async def process_hotel(places_client: PlacesClient, row: Dict[str, str]) -> Dict[str, str]:
     hotel_name: str = row["HotelName"]
     query = f"{hotel_name} deutschland"
 
@@ -214,7 +182,13 @@ def process_hotel(row: Dict[str, str]) -> Dict[str, str]:
 
     hotel_info = None
 
-    hotel_info = query_places_api(query)
+    try:
+        hotel_info = await query_places_api(places_client, query)
+    except httpx.HTTPError as e:
+        print(f"Places request failed for {hotel_name}: {e}")
+    except Exception as e:
+        # One failing hotel must not stop the run; its row is written unenriched
+        print(f"Error processing {hotel_name}: {e}")
 
     if hotel_info is not None:
         row.update(hotel_info.dict(exclude_unset=True))
@@ -222,8 +196,20 @@ def process_hotel(row: Dict[str, str]) -> Dict[str, str]:
     return row
 
 
-def process_hotels_multithreaded(input_file: str, output_file: str, max_workers: int = 20) -> None:
-    with open(input_file, "r", newline="") as infile:
+async def process_rows(rows, writer: csv.DictWriter, outfile, max_concurrency: int) -> None:
+    async with PlacesClient(GOOGLE_API_KEY, max_concurrency=max_concurrency, cache=places_cache) as places_client:
+        # Rows are read lazily with a bounded window, so memory stays flat however large the input is
+        results = bounded_as_completed(lambda row: process_hotel(places_client, row), rows, max_in_flight=2 * max_concurrency)
+        with tqdm(desc="Processing hotels", unit="hotel") as progress:
+            async for row in results:
+                writer.writerow(row)
+                outfile.flush()
+                progress.update()
+        print(places_client.report())
+
+
+def process_hotels(input_file: str, output_file: str, max_concurrency: int = 100) -> None:
+    with open(input_file, "r", newline="") as infile, open(output_file, "w", newline="") as outfile:
         reader = csv.DictReader(infile)
         fieldnames: List[str] = reader.fieldnames + [
             "name",
@@ -239,48 +225,17 @@ def process_hotels_multithreaded(input_file: str, output_file: str, max_workers:
             "explanation",
         ]
 
-        total_rows = sum(1 for row in csv.DictReader(open(input_file)))
-        infile.seek(0)
-        next(reader)
-
-        result_queue = queue.Queue()
-        csv_lock = threading.Lock()
-
-        def writer_thread():
-            with open(output_file, "w", newline="") as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-                writer.writeheader()
-
-                while True:
-                    result = result_queue.get()
-                    if result is None:
-                        break
-                    with csv_lock:
-                        writer.writerow(result)
-                        outfile.flush()
-                    result_queue.task_done()
-
-        writer = threading.Thread(target=writer_thread)
-        writer.start()
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            for row in reader:
-                future = executor.submit(process_hotel, row)
-                future.add_done_callback(lambda f: result_queue.put(f.result()))
-                futures.append(future)
-
-            for future in tqdm(concurrent.futures.as_completed(futures), total=total_rows, desc="Processing hotels", unit="hotel"):
-                pass
-
-        result_queue.put(None)
-        writer.join()
+        # All lookups run on one event loop; results are written as they complete
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames)
+        writer.writeheader()
+        asyncio.run(process_rows(reader, writer, outfile, max_concurrency))
 
+    print(places_cache.report())
     print(f"Processing complete. Enriched data saved to {output_file}")
 
 
-def enrich_hotel_data(input_file: str, output_file: str, max_workers: int = 20) -> None:
-    process_hotels_multithreaded(input_file, output_file, max_workers)
+def enrich_hotel_data(input_file: str, output_file: str, max_concurrency: int = 100) -> None:
+    process_hotels(input_file, output_file, max_concurrency)
     print(f"Processing complete. Enriched data saved to {output_file}")
 
 
@@ -288,5 +243,5 @@ if __name__ == "__main__":
     enrich_hotel_data(
         "GooglePlaces/Hotel_Names_That_Did_Not_Work.csv",
         "GooglePlaces/enriched_hotel_names_try_again-09-02-2024.csv",
-        max_workers=20,
+        max_concurrency=100,
     )
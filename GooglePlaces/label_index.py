@@ -0,0 +1,419 @@
+"""
+Nearest-neighbour label index over previously classified addresses.
+
+Addresses labelled by earlier runs are embedded and stored in a faiss inner-product index, with
+their labels in a JSONL sidecar file. Both files are written together by save(), each through a
+temporary file. A new address whose nearest labelled neighbours agree with enough confidence takes
+their label straight from the index; only low-confidence addresses still go to the LLM, and their
+answers are added back so the index grows with every run.
+
+The index is seeded from the output files of earlier runs with seed_index() (or the seed command
+below). Output files without an address column (e.g. location_selector's) are joined with their
+input file on LocationID.
+
+Usage:
+    python label_index.py seed <index path> <labelled.csv> <label column> [input.csv with the addresses]
+    python label_index.py benchmark <labelled.csv> <label column> [address column]
+"""
+
+import csv
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from address_normalization import address_key, canonical_address
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = 512
+DEFAULT_NEIGHBOURS = 5
+# Share of the neighbours' similarity that must vote for the winning label
+DEFAULT_CONFIDENCE = 0.8
+# Neighbours less similar than this do not vote at all
+DEFAULT_MIN_SIMILARITY = 0.8
+# Addresses embedded and added per step when seeding, which bounds the embeddings held in memory
+SEED_CHUNK_SIZE = 10_000
+
+
+class LabelIndex:
+    """faiss index of labelled address embeddings with a JSONL label sidecar."""
+
+    def __init__(
+        self,
+        client,
+        path: str,
+        labels: Optional[Sequence[str]] = None,
+        embedding_model: str = EMBEDDING_MODEL,
+        neighbours: int = DEFAULT_NEIGHBOURS,
+        confidence_threshold: float = DEFAULT_CONFIDENCE,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+    ):
+        """
+        Open (or start) an index. The files are <path>.faiss and <path>.labels.jsonl.
+
+        Args:
+            client: An OpenAI client used for the embedding calls.
+            path (str): Path prefix of the index files.
+            labels (Optional[Sequence[str]], optional): The valid labels; anything else is never added.
+            embedding_model (str, optional): The embedding model. An index only serves the model it was built with.
+            neighbours (int, optional): Number of nearest neighbours that vote.
+            confidence_threshold (float, optional): Minimum vote share for the index to answer.
+            min_similarity (float, optional): Minimum cosine similarity of a voting neighbour.
+        """
+        self.client = client
+        self.path = path
+        self.labels = set(labels) if labels is not None else None
+        self.embedding_model = embedding_model
+        self.neighbours = neighbours
+        self.confidence_threshold = confidence_threshold
+        self.min_similarity = min_similarity
+        self.hits = 0
+        self.misses = 0
+        self.added = 0
+        self._lock = threading.Lock()
+        self._index: Optional[faiss.Index] = None
+        self._entry_labels: List[str] = []
+        self._entry_keys: List[str] = []
+        self._keys = set()
+        # Embeddings computed for lookups, reused when the same addresses are added afterwards; cleared by add() and save()
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._load()
+
+    @property
+    def index_path(self) -> str:
+        return f"{self.path}.faiss"
+
+    @property
+    def labels_path(self) -> str:
+        return f"{self.path}.labels.jsonl"
+
+    def __len__(self) -> int:
+        return len(self._entry_labels)
+
+    def _load(self) -> None:
+        if not (os.path.exists(self.index_path) and os.path.exists(self.labels_path)):
+            return
+        with open(self.labels_path, encoding="utf-8") as labels_file:
+            header = json.loads(labels_file.readline())
+            if header.get("embedding_model") != self.embedding_model:
+                raise ValueError(f"{self.path} was built with {header.get('embedding_model')}, not {self.embedding_model}")
+            for line in labels_file:
+                entry = json.loads(line)
+                self._entry_labels.append(entry["label"])
+                self._entry_keys.append(entry["key"])
+        self._keys.update(self._entry_keys)
+        self._index = faiss.read_index(self.index_path)
+        if self._index.ntotal > len(self._entry_labels):
+            # save() was interrupted after writing the index but before the sidecar; drop the vectors without labels
+            self._index.remove_ids(np.arange(len(self._entry_labels), self._index.ntotal, dtype=np.int64))
+        if self._index.ntotal != len(self._entry_labels):
+            raise ValueError(f"{self.index_path} has {self._index.ntotal} vectors but {len(self._entry_labels)} labels")
+
+    def embed(self, addresses: Sequence[str]) -> np.ndarray:
+        """
+        Embed addresses as L2-normalized float32 vectors, so inner product is cosine similarity.
+
+        Args:
+            addresses (Sequence[str]): The addresses to embed.
+
+        Returns:
+            np.ndarray: One row per address.
+        """
+        texts = {address_key(address): canonical_address(address) for address in addresses}
+        keys = [address_key(address) for address in addresses]
+        missing = [key for key in texts if key not in self._embeddings]
+        for start in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+            chunk = missing[start : start + EMBEDDING_BATCH_SIZE]
+            response = self.client.embeddings.create(model=self.embedding_model, input=[texts[key] or key or " " for key in chunk])
+            vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            self._embeddings.update(zip(chunk, vectors))
+        if not keys:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([self._embeddings[key] for key in keys])
+
+    def vote(self, similarities: np.ndarray, neighbour_ids: np.ndarray) -> Tuple[Optional[str], float]:
+        """
+        Weighted vote of one query's neighbours.
+
+        Args:
+            similarities (np.ndarray): Cosine similarity of each neighbour.
+            neighbour_ids (np.ndarray): Index position of each neighbour (-1 for empty slots).
+
+        Returns:
+            Tuple[Optional[str], float]: The winning label and its share of the total similarity.
+        """
+        weights: Dict[str, float] = defaultdict(float)
+        total = 0.0
+        for similarity, neighbour_id in zip(similarities, neighbour_ids):
+            if neighbour_id < 0:
+                continue
+            total += max(float(similarity), 0.0)
+            if similarity >= self.min_similarity:
+                weights[self._entry_labels[neighbour_id]] += float(similarity)
+        if not weights or total <= 0:
+            return None, 0.0
+        label = max(weights, key=weights.get)
+        return label, weights[label] / total
+
+    def predict_many(self, addresses: Sequence[str]) -> List[Tuple[Optional[str], float]]:
+        """
+        Look up the label and confidence of every address.
+
+        Args:
+            addresses (Sequence[str]): The addresses to label.
+
+        Returns:
+            List[Tuple[Optional[str], float]]: (label, confidence) per address; the label is None
+            when the confidence is below the threshold.
+        """
+        if not addresses or self._index is None or self._index.ntotal == 0:
+            self.misses += len(addresses)
+            return [(None, 0.0)] * len(addresses)
+
+        vectors = self.embed(addresses)
+        with self._lock:
+            similarities, neighbour_ids = self._index.search(vectors, min(self.neighbours, self._index.ntotal))
+
+        predictions = []
+        for row_similarities, row_ids in zip(similarities, neighbour_ids):
+            label, confidence = self.vote(row_similarities, row_ids)
+            if label is None or confidence < self.confidence_threshold:
+                self.misses += 1
+                predictions.append((None, confidence))
+            else:
+                self.hits += 1
+                predictions.append((label, confidence))
+        return predictions
+
+    def add(self, addresses: Iterable[str], labels: Iterable[Optional[str]]) -> int:
+        """
+        Add labelled addresses to the index, skipping ones it already holds and invalid labels.
+
+        The entries are kept in memory until save().
+
+        Args:
+            addresses (Iterable[str]): The addresses.
+            labels (Iterable[Optional[str]]): Their labels.
+
+        Returns:
+            int: The number of entries added.
+        """
+        new_entries: Dict[str, Tuple[str, str]] = {}
+        for address, label in zip(addresses, labels):
+            key = address_key(address)
+            if not key or label is None or (self.labels is not None and label not in self.labels):
+                continue
+            if key not in self._keys and key not in new_entries:
+                new_entries[key] = (address, label)
+        if not new_entries:
+            return 0
+
+        vectors = self.embed([address for address, _ in new_entries.values()])
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(vectors.shape[1])
+            self._index.add(vectors)
+            self._entry_labels.extend(label for _, label in new_entries.values())
+            self._entry_keys.extend(new_entries)
+            self._keys.update(new_entries)
+            self.added += len(new_entries)
+        # Each vector is 6 KB; lookups are followed by one add(), so nothing is kept for later
+        self._embeddings.clear()
+        return len(new_entries)
+
+    def save(self) -> None:
+        """
+        Write the faiss index and its label sidecar.
+
+        Each file is written to a temporary file and moved into place, so an interrupted save never
+        leaves a half-written file. The index goes first: if the sidecar is not replaced, the next
+        load drops the vectors it has no labels for.
+        """
+        self._embeddings.clear()
+        with self._lock:
+            if self._index is None:
+                return
+            faiss.write_index(self._index, f"{self.index_path}.tmp")
+            os.replace(f"{self.index_path}.tmp", self.index_path)
+            with open(f"{self.labels_path}.tmp", "w", encoding="utf-8") as labels_file:
+                labels_file.write(json.dumps({"embedding_model": self.embedding_model}) + "\n")
+                for key, label in zip(self._entry_keys, self._entry_labels):
+                    labels_file.write(json.dumps({"key": key, "label": label}) + "\n")
+            os.replace(f"{self.labels_path}.tmp", self.labels_path)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        """Human readable summary of how many LLM calls the index saved."""
+        return (
+            f"Label index: {self.hits} answered, {self.misses} sent to the model "
+            f"({self.hit_rate:.1%} calls saved), {self.added} entries added, {len(self)} total"
+        )
+
+
+def split_by_index(label_index: LabelIndex, location_ids: List[str], addresses: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Answer what the index can and return the LocationIDs that still need the model.
+
+    Args:
+        label_index (LabelIndex): The index to consult.
+        location_ids (List[str]): A LocationID for each address.
+        addresses (List[str]): The addresses.
+
+    Returns:
+        Tuple[Dict[str, str], List[str]]: LocationID -> label for the confident answers, and the
+        LocationIDs left for the model.
+    """
+    answered: Dict[str, str] = {}
+    remaining: List[str] = []
+    for location_id, (label, _) in zip(location_ids, label_index.predict_many(addresses)):
+        if label is None:
+            remaining.append(location_id)
+        else:
+            answered[location_id] = label
+    return answered, remaining
+
+
+def load_labelled_csv(
+    csv_path: str, label_column: str, address_column: str = "FullPostalAddress", input_path: Optional[str] = None, id_column: str = "LocationID"
+) -> Tuple[List[str], List[str]]:
+    """
+    Read the addresses and labels of a classified output file.
+
+    Args:
+        csv_path (str): Path of the CSV file.
+        label_column (str): Column holding the label (e.g. "Category" or "Classification").
+        address_column (str, optional): Column holding the address.
+        input_path (Optional[str], optional): The input file the output was made from; when given,
+            each row's address is taken from the input row with the same id_column value.
+        id_column (str, optional): Column joining the output file with input_path.
+
+    Returns:
+        Tuple[List[str], List[str]]: The addresses and their labels.
+    """
+    addresses_by_id: Dict[str, str] = {}
+    if input_path is not None:
+        with open(input_path, newline="", encoding="utf-8-sig") as input_file:
+            addresses_by_id = {row.get(id_column): row.get(address_column) for row in csv.DictReader(input_file)}
+
+    addresses, labels = [], []
+    with open(csv_path, newline="", encoding="utf-8-sig") as csv_file:
+        for row in csv.DictReader(csv_file):
+            address = addresses_by_id.get(row.get(id_column)) if input_path is not None else row.get(address_column)
+            if address and row.get(label_column):
+                addresses.append(address)
+                labels.append(row[label_column])
+    return addresses, labels
+
+
+def seed_index(label_index: LabelIndex, addresses: Sequence[str], labels: Sequence[str], chunk_size: int = SEED_CHUNK_SIZE) -> int:
+    """
+    Add the labelled addresses of earlier runs to an index and save it.
+
+    Addresses are embedded and added chunk by chunk, so memory stays bounded however many there are.
+    Addresses the index already holds are skipped, so seeding again after a new run only embeds the new ones.
+
+    Args:
+        label_index (LabelIndex): The index to seed.
+        addresses (Sequence[str]): The addresses, e.g. from load_labelled_csv().
+        labels (Sequence[str]): Their labels.
+        chunk_size (int, optional): Addresses embedded per step.
+
+    Returns:
+        int: The number of entries added.
+    """
+    added = 0
+    for start in range(0, len(addresses), chunk_size):
+        added += label_index.add(addresses[start : start + chunk_size], labels[start : start + chunk_size])
+        print(f"Seeded {added} entries from {min(start + chunk_size, len(addresses))}/{len(addresses)} labelled rows")
+    label_index.save()
+    return added
+
+
+def benchmark(
+    client,
+    addresses: List[str],
+    labels: List[str],
+    holdout: float = 0.2,
+    thresholds: Sequence[float] = (0.6, 0.7, 0.8, 0.9, 1.0),
+    neighbours: int = DEFAULT_NEIGHBOURS,
+    min_similarity: float = DEFAULT_MIN_SIMILARITY,
+) -> List[Dict[str, float]]:
+    """
+    Measure agreement with the LLM labels against calls saved, for several confidence thresholds.
+
+    The index is built from the first (1 - holdout) share of the unique addresses and queried with
+    the rest, whose LLM labels serve as the reference.
+
+    Args:
+        client: An OpenAI client used for the embedding calls.
+        addresses (List[str]): Labelled addresses.
+        labels (List[str]): Their LLM labels.
+        holdout (float, optional): Share of unique addresses held out for evaluation.
+        thresholds (Sequence[float], optional): Confidence thresholds to evaluate.
+        neighbours (int, optional): Number of voting neighbours.
+        min_similarity (float, optional): Minimum similarity of a voting neighbour.
+
+    Returns:
+        List[Dict[str, float]]: Per threshold, the share of calls saved and the agreement of the
+        index answers with the LLM labels.
+    """
+    unique = list({address_key(address): (address, label) for address, label in zip(addresses, labels)}.values())
+    split = int(len(unique) * (1 - holdout))
+    train, test = unique[:split], unique[split:]
+    if not train or not test:
+        raise ValueError("Need labelled addresses on both sides of the holdout split")
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        # A zero threshold makes the index return every vote, so each threshold can be applied below
+        label_index = LabelIndex(
+            client, path=os.path.join(index_dir, "benchmark"), neighbours=neighbours, confidence_threshold=0.0, min_similarity=min_similarity
+        )
+        label_index.add([address for address, _ in train], [label for _, label in train])
+        votes = label_index.predict_many([address for address, _ in test])
+
+    results = []
+    for threshold in thresholds:
+        answered = [(vote_label, reference) for (vote_label, confidence), (_, reference) in zip(votes, test) if vote_label and confidence >= threshold]
+        agreed = sum(vote_label == reference for vote_label, reference in answered)
+        results.append(
+            {
+                "threshold": threshold,
+                "calls_saved": len(answered) / len(test),
+                "agreement": agreed / len(answered) if answered else 1.0,
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    from openai import OpenAI
+    from config import OPENAI_API_KEY
+
+    if len(sys.argv) < 4 or sys.argv[1] not in ("seed", "benchmark") or (sys.argv[1] == "seed" and len(sys.argv) < 5):
+        sys.exit(__doc__)
+    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    if sys.argv[1] == "seed":
+        index_path, csv_path, label_column = sys.argv[2:5]
+        input_path = sys.argv[5] if len(sys.argv) > 5 else None
+        seed_addresses, seed_labels = load_labelled_csv(csv_path, label_column, input_path=input_path)
+        seeded = LabelIndex(openai_client, path=index_path)
+        seed_index(seeded, seed_addresses, seed_labels)
+        print(seeded.report())
+    else:
+        csv_path, label_column = sys.argv[2], sys.argv[3]
+        address_column = sys.argv[4] if len(sys.argv) > 4 else "FullPostalAddress"
+        benchmark_addresses, benchmark_labels = load_labelled_csv(csv_path, label_column, address_column)
+        print(f"Benchmarking on {len(benchmark_addresses)} labelled rows from {csv_path}")
+        for result in benchmark(openai_client, benchmark_addresses, benchmark_labels):
+            print(f"threshold {result['threshold']:.2f}: {result['calls_saved']:.1%} calls saved, {result['agreement']:.1%} agreement with the LLM")
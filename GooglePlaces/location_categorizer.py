@@ -6,8 +6,21 @@ from openai import OpenAI
 from config import OPENAI_API_KEY, MODEL
 from tqdm import tqdm
 import concurrent.futures
+from classification_cache import ClassificationCache
+from address_normalization import AddressGroups
+from bulk_jobs import DEFAULT_BASE_URL, BulkJobClient, load_answer, run_bulk_job
+from label_index import LabelIndex, load_labelled_csv, seed_index, split_by_index
+
+# Bump whenever the prompt or EXAMPLES change so stale cached answers are not reused.
+PROMPT_VERSION = "location_categorizer:v1"
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+classification_cache = ClassificationCache(model=MODEL, prompt_version=PROMPT_VERSION)
+
+CATEGORIES = ["Retail Store", "Office", "Warehouse", "Manufacturing Facility", "Distribution Center", "Other"]
+
+# Path prefix of the embedding index of previously categorized addresses
+LABEL_INDEX_PATH = "category_label_index"
 
 EXAMPLES = """
 Example 1:
@@ -57,23 +70,32 @@ Output:
 """
 
 
-def categorize_address(address: str) -> str:
+GUIDELINES = """Guidelines:
+    - Use the following categories only:
+      (1) Retail Store - For shopping centers, malls, outlets, and standalone stores
+      (2) Office - For corporate offices, business centers, and professional spaces
+      (3) Warehouse - For storage facilities and warehouses
+      (4) Manufacturing Facility - For factories and production facilities
+      (5) Distribution Center - For logistics and distribution facilities
+      (6) Other - For virtual offices, PO boxes, or addresses that don't fit other categories
+    
+    VERY IMPORTANT:
+    - DO NOT MAKE UP A CATEGORY. YOU CAN ONLY SELECT FROM THE PROVIDED CATEGORIES.
+    - Look for keywords like "Suite", "Mall", "Industrial", "Factory", etc.
+    - Consider the location context and address format"""
+
+
+def build_category_request(address: str) -> Dict:
     """
-    Categorize an address using the OpenAI API.
+    Build the chat completion request that categorizes a single address.
+
+    Shared by the synchronous path and the bulk-job mode, which writes the same request to a job file.
 
     Args:
         address (str): The full postal address to categorize.
 
     Returns:
-        str: The category assigned to the address.
-
-    Categories:
-        1. Retail Store
-        2. Office
-        3. Warehouse
-        4. Manufacturing Facility
-        5. Distribution Center
-        6. Other
+        Dict: The chat completion request body.
     """
     prompt = f"""
     Given the following examples of addresses and their categories:
@@ -90,35 +112,108 @@ def categorize_address(address: str) -> str:
         "category": "(the most appropriate category for this address)"
     }}
     
-    Guidelines:
-    - Use the following categories only:
-      (1) Retail Store - For shopping centers, malls, outlets, and standalone stores
-      (2) Office - For corporate offices, business centers, and professional spaces
-      (3) Warehouse - For storage facilities and warehouses
-      (4) Manufacturing Facility - For factories and production facilities
-      (5) Distribution Center - For logistics and distribution facilities
-      (6) Other - For virtual offices, PO boxes, or addresses that don't fit other categories
-    
-    VERY IMPORTANT:
-    - DO NOT MAKE UP A CATEGORY. YOU CAN ONLY SELECT FROM THE PROVIDED CATEGORIES.
-    - Look for keywords like "Suite", "Mall", "Industrial", "Factory", etc.
-    - Consider the location context and address format
+    {GUIDELINES}
     """
 
-    completion = client.chat.completions.create(
-        model=MODEL,
-        messages=[
+    return {
+        "model": MODEL,
+        "messages": [
             {
                 "role": "system",
                 "content": "You are an expert at analyzing addresses and determining their facility type. You return only JSON format.",
             },
             {"role": "user", "content": prompt},
         ],
-        response_format={"type": "json_object"},
-    )
+        "response_format": {"type": "json_object"},
+    }
+
+
+def categorize_address(address: str) -> str:
+    """
+    Categorize an address using the OpenAI API.
+
+    Answers are served from the persistent classification cache when the address was categorized before.
+
+    Args:
+        address (str): The full postal address to categorize.
+
+    Returns:
+        str: The category assigned to the address.
+
+    Categories:
+        1. Retail Store
+        2. Office
+        3. Warehouse
+        4. Manufacturing Facility
+        5. Distribution Center
+        6. Other
+    """
+    cached_category = classification_cache.get(address)
+    if cached_category is not None:
+        return cached_category
+
+    completion = client.chat.completions.create(**build_category_request(address))
 
     ai_response = json.loads(completion.choices[0].message.content)
-    return ai_response.get("category")
+    category = ai_response.get("category")
+    classification_cache.set(address, category)
+    return category
+
+
+def categorize_unique_addresses_bulk(
+    location_ids: List[str], addresses: List[str], job_path: str, base_url: str = DEFAULT_BASE_URL, poll_interval: float = 60, num_threads: int = 20
+) -> List[str]:
+    """
+    Categorize unique addresses with an asynchronous bulk job instead of synchronous calls.
+
+    Addresses missing from the cache are written to JSONL job files keyed by LocationID, submitted
+    to the batch endpoint and merged back once the jobs complete. Answers that are missing or not in
+    CATEGORIES are resubmitted once as a follow-up job; whatever is still missing after that is
+    categorized synchronously on a thread pool.
+
+    Args:
+        location_ids (List[str]): A LocationID for each address, used as the custom_id of its request.
+        addresses (List[str]): The unique addresses to categorize.
+        job_path (str): Where to write the JSONL job files.
+        base_url (str, optional): Base URL of the batch API (or of a local stand-in).
+        poll_interval (float, optional): Seconds between job status polls.
+        num_threads (int, optional): Threads for the synchronous fallback.
+
+    Returns:
+        List[str]: The category of every address, aligned with addresses.
+    """
+    categories: Dict[str, str] = {}
+    pending: Dict[str, str] = {}
+    for location_id, address in zip(location_ids, addresses):
+        category = classification_cache.get(address)
+        if category is None:
+            pending[location_id] = address
+        else:
+            categories[location_id] = category
+
+    bulk_client = BulkJobClient(OPENAI_API_KEY, base_url=base_url)
+    request_bodies = ((location_id, build_category_request(address)) for location_id, address in pending.items())
+    answers = run_bulk_job(
+        bulk_client, request_bodies, job_path, poll_interval=poll_interval, accept=lambda content: load_answer(content).get("category") in CATEGORIES
+    )
+
+    retries = []
+    for location_id, address in pending.items():
+        category = load_answer(answers.get(location_id)).get("category")
+        if category in CATEGORIES:
+            categories[location_id] = category
+            classification_cache.set(address, category)
+        else:
+            retries.append(location_id)
+
+    if retries:
+        print(f"Categorizing {len(retries)} addresses without a usable bulk answer synchronously")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            retried = executor.map(categorize_address, [pending[location_id] for location_id in retries])
+            for location_id, category in zip(retries, tqdm(retried, total=len(retries), desc="Retrying locations", unit="location")):
+                categories[location_id] = category
+
+    return [categories.get(location_id) for location_id in location_ids]
 
 
 def process_location(row: Dict[str, str]) -> Dict[str, str]:
@@ -136,23 +231,94 @@ def process_location(row: Dict[str, str]) -> Dict[str, str]:
     return {"LocationID": row.get("LocationID", "Unknown"), "FullPostalAddress": address, "Category": category}
 
 
-def process_csv(input_file_path: str, output_file_path: str, num_threads: int = 20):
+def process_csv(
+    input_file_path: str,
+    output_file_path: str,
+    num_threads: int = 20,
+    bulk: bool = False,
+    bulk_base_url: str = DEFAULT_BASE_URL,
+    poll_interval: float = 60,
+    use_label_index: bool = False,
+    label_index_path: str = LABEL_INDEX_PATH,
+):
     """
     Process the input CSV file, categorize locations, and write results to the output CSV file.
 
+    Rows are grouped by canonical address first, so each unique address is categorized once and
+    the result is shared by every row with that address.
+
     Args:
         input_file_path (str): Path to the input CSV file.
         output_file_path (str): Path to the output CSV file.
         num_threads (int, optional): Number of threads for parallel processing. Defaults to 20.
+        bulk (bool, optional): Submit the addresses as one asynchronous bulk job instead of making
+            synchronous calls. Meant for large overnight runs. Defaults to False.
+        bulk_base_url (str, optional): Base URL of the batch API; point it at bulk_jobs_stub_server for testing.
+        poll_interval (float, optional): Seconds between bulk job status polls.
+        use_label_index (bool, optional): Take the category of addresses whose nearest previously labelled
+            neighbours agree from the embedding index, and add this run's answers to it. Defaults to False.
+        label_index_path (str, optional): Path prefix of the label index files.
     """
     # Read all rows from the input CSV file
     with open(input_file_path, newline="", encoding="utf-8") as input_csvfile:
         reader = csv.DictReader(input_csvfile)
         rows = list(reader)
 
-    # Process locations in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        results = list(tqdm(iterable=executor.map(process_location, rows), total=len(rows), desc="Processing locations", unit="location"))
+    # Collapse duplicate addresses so each one is categorized only once
+    address_groups = AddressGroups(row.get("FullPostalAddress", "N/A") for row in rows)
+    unique_addresses = address_groups.unique_addresses()
+
+    # Key every unique address by the LocationID of the first row that has it
+    location_ids = address_groups.group_ids([row.get("LocationID") for row in rows])
+
+    index_answers: Dict[str, str] = {}
+    if use_label_index:
+        # Only addresses the cache cannot answer are looked up in the index
+        label_index = LabelIndex(client, path=label_index_path, labels=CATEGORIES)
+        pending = {
+            location_id: address
+            for location_id, address in zip(location_ids, unique_addresses)
+            if address not in classification_cache
+        }
+        index_answers, _ = split_by_index(label_index, list(pending), list(pending.values()))
+    model_ids = [location_id for location_id in location_ids if location_id not in index_answers]
+    model_addresses = [address for location_id, address in zip(location_ids, unique_addresses) if location_id not in index_answers]
+
+    if bulk:
+        model_categories = categorize_unique_addresses_bulk(
+            model_ids,
+            model_addresses,
+            job_path=f"{output_file_path}.bulk_job.jsonl",
+            base_url=bulk_base_url,
+            poll_interval=poll_interval,
+            num_threads=num_threads,
+        )
+    else:
+        # Process unique addresses in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            model_categories = list(
+                tqdm(
+                    iterable=executor.map(categorize_address, model_addresses),
+                    total=len(model_addresses),
+                    desc="Processing locations",
+                    unit="location",
+                )
+            )
+
+    categorized = dict(zip(model_ids, model_categories))
+    categorized.update(index_answers)
+    unique_categories = [categorized[location_id] for location_id in location_ids]
+    if use_label_index:
+        # Grow the index with this run's answers so the next run can reuse them
+        label_index.add(model_addresses, model_categories)
+        label_index.save()
+        print(label_index.report())
+
+    categories = address_groups.fan_out(unique_categories)
+    results = [
+        {"LocationID": row.get("LocationID", "Unknown"), "FullPostalAddress": row.get("FullPostalAddress", "N/A"), "Category": category}
+        for row, category in zip(rows, categories)
+    ]
 
     # Write results to the output CSV file
     with open(output_file_path, "w", newline="", encoding="utf-8") as output_csvfile:
@@ -161,9 +327,30 @@ def process_csv(input_file_path: str, output_file_path: str, num_threads: int =
         writer.writeheader()
         writer.writerows(results)
 
+    print(address_groups.report())
+    print(classification_cache.report())
     print(f"Processing complete. Results written to {output_file_path}")
 
 
+
+def seed_label_index(output_file_path: str, label_index_path: str = LABEL_INDEX_PATH) -> int:
+    """
+    Seed the label index with the categories of an earlier run.
+
+    Args:
+        output_file_path (str): Output CSV of the earlier run.
+        label_index_path (str, optional): Path prefix of the label index files.
+
+    Returns:
+        int: The number of entries added to the index.
+    """
+    addresses, labels = load_labelled_csv(output_file_path, "Category")
+    label_index = LabelIndex(client, path=label_index_path, labels=CATEGORIES)
+    added = seed_index(label_index, addresses, labels)
+    print(label_index.report())
+    return added
+
+
 if __name__ == "__main__":
     input_csv_path = "data/location_information_10_16_2024.csv"
     output_csv_path = "data/categorized_locations.csv"
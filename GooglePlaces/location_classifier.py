@@ -0,0 +1,381 @@
+"""
+This module assigns both the region (location_selector) and the facility type (location_categorizer)
+of every location in a single pass, with one LLM call per address or per batch of addresses.
+Each label is validated against its own category set and both are written to one output file.
+"""
+
+import csv
+import json
+import time
+from typing import Dict, List, Optional
+from openai import OpenAI
+from config import OPENAI_API_KEY, MODEL
+from tqdm import tqdm
+import concurrent.futures
+from classification_cache import ClassificationCache
+from address_normalization import AddressGroups
+from location_selector import BATCH_MAX_ATTEMPTS, BATCH_TOKEN_BUDGET, CLASSIFICATIONS, build_batches, classify_location, region_resolver
+from location_selector import GUIDELINES as REGION_GUIDELINES
+from location_categorizer import CATEGORIES, categorize_address
+from location_categorizer import GUIDELINES as CATEGORY_GUIDELINES
+
+# Bump whenever the prompt or EXAMPLES change so stale cached answers are not reused.
+PROMPT_VERSION = "location_classifier:v1"
+
+client = OpenAI(api_key=OPENAI_API_KEY)
+classification_cache = ClassificationCache(model=MODEL, prompt_version=PROMPT_VERSION)
+
+# The labels of a profile and the values each one may take
+LABELS = {"classification": CLASSIFICATIONS, "category": CATEGORIES}
+
+SYSTEM_PROMPT = (
+    "You are an expert at analyzing location information and determining both the region and the facility type of an address. "
+    "You return only JSON format."
+)
+
+EXAMPLES = """
+Example 1:
+Input:
+FullPostalAddress: 152 The Arches Circle Suite 912, Deer Park, NY 11729
+
+Output:
+{
+    "classification": "United States",
+    "category": "Retail Store"
+}
+
+Example 2:
+Input:
+FullPostalAddress: 456 Yonge Street, Toronto, ON M4Y 1X9, Canada
+
+Output:
+{
+    "classification": "North America",
+    "category": "Office"
+}
+
+Example 3:
+Input:
+FullPostalAddress: Crocs Industrial(ShenZhen) CO., LTD Village, Longgang District, Shenzhen City
+
+Output:
+{
+    "classification": "APAC",
+    "category": "Manufacturing Facility"
+}
+
+Example 4:
+Input:
+FullPostalAddress: WebEx (AWS) Virtual Office (VO), ., . .
+
+Output:
+{
+    "classification": "Virtual",
+    "category": "Other"
+}
+"""
+
+INSTRUCTIONS = f"""Determine two labels for every address:
+    - "classification": the region of the address.
+    {REGION_GUIDELINES}
+
+    - "category": the facility type of the address.
+    {CATEGORY_GUIDELINES}"""
+
+
+def invalid_labels(profile: Dict) -> List[str]:
+    """
+    List the labels of a profile that are missing or not in their category set.
+
+    Args:
+        profile (Dict): A model answer with "classification" and "category" keys.
+
+    Returns:
+        List[str]: The names of the labels that cannot be used.
+    """
+    if not isinstance(profile, dict):
+        return list(LABELS)
+    return [label for label, allowed in LABELS.items() if profile.get(label) not in allowed]
+
+
+def build_profile_request(full_address: str) -> Dict:
+    """
+    Build the chat completion request that labels a single address.
+
+    Args:
+        full_address (str): The full postal address of the location.
+
+    Returns:
+        Dict: The chat completion request body.
+    """
+    prompt = f"""
+    Given the following examples of location information and their labels:
+
+    {EXAMPLES}
+
+    Now, analyze the following address:
+
+    Input:
+    FullPostalAddress: {full_address}
+
+    Please respond in the following format:
+    {{
+        "classification": "(the most appropriate region for this location)",
+        "category": "(the most appropriate facility type for this location)"
+    }}
+
+    {INSTRUCTIONS}
+    """
+
+    return {
+        "model": MODEL,
+        "messages": [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+        "response_format": {"type": "json_object"},
+    }
+
+
+def classify_profile(full_address: str) -> Dict[str, Optional[str]]:
+    """
+    Label a single address with its region and facility type in one call.
+
+    A label that comes back invalid is re-requested from its dedicated classifier, so only that
+    label costs a second call.
+
+    Args:
+        full_address (str): The full postal address of the location.
+
+    Returns:
+        Dict[str, Optional[str]]: The "classification" and "category" of the location.
+    """
+    completion = client.chat.completions.create(**build_profile_request(full_address))
+    try:
+        ai_response = json.loads(completion.choices[0].message.content)
+    except json.JSONDecodeError:
+        ai_response = {}
+
+    profile = {label: ai_response.get(label) if isinstance(ai_response, dict) else None for label in LABELS}
+    bad_labels = invalid_labels(profile)
+    if "classification" in bad_labels:
+        profile["classification"] = classify_location(full_address)
+    if "category" in bad_labels:
+        profile["category"] = categorize_address(full_address)
+    return profile
+
+
+def request_batch_profiles(addresses: Dict[str, str]) -> Dict[str, Dict]:
+    """
+    Send one JSON-mode request labelling several addresses keyed by LocationID.
+
+    Args:
+        addresses (Dict[str, str]): Mapping of LocationID to full postal address.
+
+    Returns:
+        Dict[str, Dict]: The raw LocationID -> {"classification", "category"} mapping returned by the model.
+    """
+    address_lines = "\n".join(f"    {location_id}: {full_address}" for location_id, full_address in addresses.items())
+    prompt = f"""
+    Given the following examples of location information and their labels:
+
+    {EXAMPLES}
+
+    Now, analyze each of the following addresses. Every line has the format "LocationID: FullPostalAddress".
+
+{address_lines}
+
+    Please respond with the labels of every LocationID in the following format:
+    {{
+        "locations": {{
+            "(LocationID)": {{
+                "classification": "(the most appropriate region for this location)",
+                "category": "(the most appropriate facility type for this location)"
+            }}
+        }}
+    }}
+
+    Use the LocationIDs exactly as given and answer for every one of them.
+
+    {INSTRUCTIONS}
+    """
+
+    completion = client.chat.completions.create(
+        model=MODEL,
+        messages=[{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+        response_format={"type": "json_object"},
+    )
+
+    try:
+        ai_response = json.loads(completion.choices[0].message.content)
+    except json.JSONDecodeError:
+        return {}
+    locations = ai_response.get("locations", {}) if isinstance(ai_response, dict) else {}
+    return locations if isinstance(locations, dict) else {}
+
+
+def classify_profiles_batch(addresses: Dict[str, str], max_attempts: int = BATCH_MAX_ATTEMPTS) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Label a batch of addresses, retrying only the LocationIDs whose answer was missing or invalid.
+
+    Addresses still unresolved after max_attempts are labelled one at a time.
+
+    Args:
+        addresses (Dict[str, str]): Mapping of LocationID to full postal address.
+        max_attempts (int, optional): Number of batched attempts before falling back to single requests.
+
+    Returns:
+        Dict[str, Dict[str, Optional[str]]]: Mapping of LocationID to its labels.
+    """
+    results: Dict[str, Dict[str, Optional[str]]] = {}
+    pending = dict(addresses)
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(2**attempt)
+        answers = request_batch_profiles(pending)
+        for location_id, profile in answers.items():
+            if location_id in pending and not invalid_labels(profile):
+                results[location_id] = {label: profile[label] for label in LABELS}
+                del pending[location_id]
+
+    for location_id, full_address in pending.items():
+        results[location_id] = classify_profile(full_address)
+    return results
+
+
+def apply_rules(full_address: str, profile: Dict[str, Optional[str]]) -> Dict[str, Optional[str]]:
+    """Let the offline rule engine's region take precedence over the model's, as in location_selector."""
+    region = region_resolver.resolve(full_address)
+    return {**profile, "classification": region} if region is not None else profile
+
+
+def resolve_profile(full_address: str) -> Dict[str, Optional[str]]:
+    """
+    Label an address, calling the model only when the cache cannot answer.
+
+    Args:
+        full_address (str): The full postal address of the location.
+
+    Returns:
+        Dict[str, Optional[str]]: The "classification" and "category" of the location.
+    """
+    profile = classification_cache.get(full_address)
+    if profile is None:
+        profile = classify_profile(full_address)
+        classification_cache.set(full_address, profile)
+    return apply_rules(full_address, profile)
+
+
+def classify_unique_profiles_batched(
+    location_ids: List[str], addresses: List[str], num_threads: int, batch_size: int, batch_token_budget: int
+) -> List[Dict[str, Optional[str]]]:
+    """
+    Label unique addresses with ID-keyed multi-row requests.
+
+    Args:
+        location_ids (List[str]): A LocationID for each address, used as the key in the batch.
+        addresses (List[str]): The unique addresses to label.
+        num_threads (int): Number of batches to send in parallel.
+        batch_size (int): Maximum number of addresses per request.
+        batch_token_budget (int): Maximum tokens of address lines per request.
+
+    Returns:
+        List[Dict[str, Optional[str]]]: The labels of every address, aligned with addresses.
+    """
+    profiles: Dict[str, Dict[str, Optional[str]]] = {}
+    pending: Dict[str, str] = {}
+    for location_id, full_address in zip(location_ids, addresses):
+        profile = classification_cache.get(full_address)
+        if profile is None:
+            pending[location_id] = full_address
+        else:
+            profiles[location_id] = profile
+
+    batches = build_batches(pending, batch_size=batch_size, token_budget=batch_token_budget)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for batch, batch_results in zip(
+            batches, tqdm(iterable=executor.map(classify_profiles_batch, batches), total=len(batches), desc="Processing batches", unit="batch")
+        ):
+            for location_id, profile in batch_results.items():
+                classification_cache.set(batch[location_id], profile)
+            profiles.update(batch_results)
+
+    return [apply_rules(full_address, profiles[location_id]) for location_id, full_address in zip(location_ids, addresses)]
+
+
+def process_csv(
+    input_file_path: str,
+    output_file_path: str,
+    num_threads: int = 20,
+    batch_size: int = 1,
+    batch_token_budget: int = BATCH_TOKEN_BUDGET,
+):
+    """
+    Process the input CSV file, label every location with its region and facility type, and write
+    both labels to the output CSV file.
+
+    Rows are grouped by canonical address first, so each unique address is labelled once and
+    the result is shared by every row with that address.
+
+    Args:
+        input_file_path (str): Path to the input CSV file.
+        output_file_path (str): Path to the output CSV file.
+        num_threads (int, optional): Number of threads to use for parallel processing. Defaults to 20.
+        batch_size (int, optional): Addresses per request. Values above 1 enable the batched mode,
+            where the few-shot examples are sent once per batch. Defaults to 1.
+        batch_token_budget (int, optional): Token budget for the address lines of one batch.
+    """
+    # Read all rows from the input CSV file (utf-8-sig drops the byte order mark from the LocationID header)
+    with open(input_file_path, newline="", encoding="utf-8-sig") as input_csvfile:
+        reader = csv.DictReader(input_csvfile)
+        rows = list(reader)
+
+    # Collapse duplicate addresses so each one is labelled only once
+    address_groups = AddressGroups(row.get("FullPostalAddress", "N/A") for row in rows)
+    unique_addresses = address_groups.unique_addresses()
+
+    if batch_size > 1:
+        # Key every unique address by the LocationID of the first row that has it
+        location_ids = address_groups.group_ids([row.get("LocationID") for row in rows])
+        unique_profiles = classify_unique_profiles_batched(
+            location_ids, unique_addresses, num_threads=num_threads, batch_size=batch_size, batch_token_budget=batch_token_budget
+        )
+    else:
+        # Process unique addresses in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            unique_profiles = list(
+                tqdm(
+                    iterable=executor.map(resolve_profile, unique_addresses),
+                    total=len(unique_addresses),
+                    desc="Processing locations",
+                    unit="location",
+                )
+            )
+
+    profiles = address_groups.fan_out(unique_profiles)
+    results = [
+        {
+            "LocationID": row.get("LocationID", "Unknown"),
+            "FullPostalAddress": row.get("FullPostalAddress", "N/A"),
+            "Classification": profile["classification"],
+            "Category": profile["category"],
+        }
+        for row, profile in zip(rows, profiles)
+    ]
+
+    # Write results to the output CSV file
+    with open(output_file_path, "w", newline="", encoding="utf-8") as output_csvfile:
+        fieldnames = ["LocationID", "FullPostalAddress", "Classification", "Category"]
+        writer = csv.DictWriter(output_csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(results)
+
+    print(address_groups.report())
+    print(region_resolver.report())
+    print(classification_cache.report())
+    print(f"Processing complete. Results written to {output_file_path}")
+
+
+if __name__ == "__main__":
+    input_csv_file_path = "GooglePlaces/data/location_information_10_16_2024.csv"
+    output_csv_file_path = "GooglePlaces/data/location_information_10_16_2024_profiled.csv"
+    process_csv(input_file_path=input_csv_file_path, output_file_path=output_csv_file_path)
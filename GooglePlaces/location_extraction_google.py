@@ -1,12 +1,19 @@
+import asyncio
 import csv
-import requests
-from typing import Dict, Optional, List
+import httpx
+from typing import List, Optional
 from pydantic import BaseModel
 from tqdm import tqdm
-import concurrent.futures
 from config import GOOGLE_API_KEY
+from address_normalization import AddressGroups
+from places_cache import PlacesCache
+from places_client import ADDRESS_FIELDS, PlacesClient
 
-MAX_WORKERS = 10
+# Lookups in flight at once on the event loop
+MAX_CONCURRENCY = 100
+
+# Addresses resolved on earlier runs are answered from the local cache
+places_cache = PlacesCache()
 
 
 class AddressInfo(BaseModel):
@@ -15,72 +22,43 @@ class AddressInfo(BaseModel):
     formatted_address: Optional[str] = None
 
 
-def get_place_id(query: str) -> Optional[str]:
-    """
-    Retrieve the place ID for a given address query using Google Places API.
-
-    Args:
-        query (str): The address to search for.
-
-    Returns:
-        Optional[str]: The place ID if found, None otherwise.
-    """
-    base_url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
-    params = {"input": query, "inputtype": "textquery", "key": GOOGLE_API_KEY}
-    response = requests.get(base_url, params=params)
-    result = response.json()
-    if result.get("status") == "OK" and result.get("candidates"):
-        return result["candidates"][0]["place_id"]
-    return None
-
-
-def get_place_details(place_id: str) -> Dict:
+async def get_formatted_address(places_client: PlacesClient, address: str) -> Optional[str]:
     """
-    Retrieve place details for a given place ID using Google Places API.
+    Look up Google's formatted address for an address query.
 
     Args:
-        place_id (str): The place ID to look up.
+        places_client (PlacesClient): The client to look the address up with.
+        address (str): The address to search for.
 
     Returns:
-        Dict: A dictionary containing place details.
+        Optional[str]: Google's formatted address if found, None otherwise.
     """
-    base_url = "https://maps.googleapis.com/maps/api/place/details/json"
-    params = {"place_id": place_id, "fields": "formatted_address", "key": GOOGLE_API_KEY}
-    response = requests.get(base_url, params=params)
-    return response.json()
+    if not address:
+        return None
+    try:
+        place = await places_client.search_text(address, ADDRESS_FIELDS)
+    except httpx.HTTPError as e:
+        print(f"Places request failed for {address}: {e}")
+        return None
+    return place.get("formattedAddress") if place else None
 
 
-def process_address(row: Dict[str, str]) -> Dict[str, str]:
+async def get_formatted_addresses(addresses: List[str]) -> List[Optional[str]]:
     """
-    Process a single address row, enriching it with Google's formatted address.
+    Look up many addresses concurrently on one event loop.
 
     Args:
-        row (Dict[str, str]): A dictionary representing a row from the input CSV.
+        addresses (List[str]): The addresses to search for.
 
     Returns:
-        Dict[str, str]: The input row enriched with Google's formatted address.
+        List[Optional[str]]: Google's formatted address of each address, in input order.
     """
-    query = f"{row['FullPostalAddress']}"
-    place_id = get_place_id(query)
-    if place_id:
-        place_details = get_place_details(place_id)
-        if "result" in place_details:
-            formatted_address = place_details["result"].get("formatted_address")
-            row["GoogleFormattedAddress"] = formatted_address
-    return row
-
-
-def process_batch(batch: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    """
-    Process a batch of address rows.
-
-    Args:
-        batch (List[Dict[str, str]]): A list of rows to process.
-
-    Returns:
-        List[Dict[str, str]]: A list of processed rows.
-    """
-    return [process_address(row) for row in batch]
+    async with PlacesClient(GOOGLE_API_KEY, max_concurrency=MAX_CONCURRENCY, cache=places_cache) as places_client:
+        tasks = [asyncio.create_task(get_formatted_address(places_client, address)) for address in addresses]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing addresses"):
+            await task
+        print(places_client.report())
+    return [task.result() for task in tasks]
 
 
 def enrich_address_data(input_file: str, output_file: str) -> None:
@@ -88,6 +66,8 @@ def enrich_address_data(input_file: str, output_file: str) -> None:
     Enrich address data from an input CSV file with Google's formatted addresses
     and write the results to an output CSV file.
 
+    Rows are grouped by canonical address first, so each unique address is looked up once.
+
     Args:
         input_file (str): Path to the input CSV file.
         output_file (str): Path to the output CSV file.
@@ -99,20 +79,21 @@ def enrich_address_data(input_file: str, output_file: str) -> None:
         writer = csv.DictWriter(outfile, fieldnames=fieldnames)
         writer.writeheader()
 
-        # Read all rows and prepare batches for parallel processing
+        # Read all rows and collapse duplicate addresses
         all_rows = list(reader)
-        total_rows = len(all_rows)
-        batch_size = 10
-        batches = [all_rows[i : i + batch_size] for i in range(0, total_rows, batch_size)]
+        address_groups = AddressGroups(row["FullPostalAddress"] for row in all_rows)
+        unique_addresses = address_groups.unique_addresses()
 
-        # Process batches in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            futures = [executor.submit(process_batch, batch) for batch in batches]
+        # Look up unique addresses concurrently
+        unique_formatted_addresses = asyncio.run(get_formatted_addresses(unique_addresses))
 
-            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), desc="Processing batches"):
-                for enriched_row in future.result():
-                    writer.writerow(enriched_row)
+        for row, formatted_address in zip(all_rows, address_groups.fan_out(unique_formatted_addresses)):
+            if formatted_address:
+                row["GoogleFormattedAddress"] = formatted_address
+            writer.writerow(row)
 
+    print(address_groups.report())
+    print(places_cache.report())
     print(f"Processing complete. Enriched data saved to {output_file}")
 
 
@@ -1,17 +1,47 @@
 """
 This module classifies locations based on postal address information using OpenAI's GPT model.
 It processes a CSV file containing location data and outputs a new CSV file with classifications.
+Addresses that the offline rule engine in region_rules can resolve are classified without an API call,
+and model answers are kept in a persistent cache so re-runs only pay for new addresses.
 """
 
 import csv
 import json
-from typing import Dict
+import time
+from typing import Dict, List, Optional, Tuple
 from openai import OpenAI
 from config import OPENAI_API_KEY, MODEL
 from tqdm import tqdm
 import concurrent.futures
+from region_rules import RegionResolver, resolve_region
+from classification_cache import ClassificationCache
+from address_normalization import AddressGroups
+from token_budget import count_tokens
+from bulk_jobs import DEFAULT_BASE_URL, BulkJobClient, load_answer, run_bulk_job
+from label_index import LabelIndex, load_labelled_csv, seed_index, split_by_index
+from region_geometry import RegionPolygons
+
+# Bump whenever the prompt or EXAMPLES change so stale cached answers are not reused.
+PROMPT_VERSION = "location_selector:v1"
 
 client = OpenAI(api_key=OPENAI_API_KEY)
+region_resolver = RegionResolver()
+region_polygons = RegionPolygons()
+classification_cache = ClassificationCache(model=MODEL, prompt_version=PROMPT_VERSION)
+
+CLASSIFICATIONS = ["United States", "North America", "Central America", "South America", "EMEA", "APAC", "Virtual"]
+
+# Defaults for the batched mode: at most this many addresses, and this many address tokens, per request
+BATCH_SIZE = 50
+BATCH_TOKEN_BUDGET = 2000
+BATCH_MAX_ATTEMPTS = 3
+
+# Path prefix of the embedding index of previously classified addresses
+LABEL_INDEX_PATH = "region_label_index"
+
+# Coordinate columns written by the Places enrichment scripts
+LATITUDE_COLUMNS = ("latitude", "Latitude", "lat")
+LONGITUDE_COLUMNS = ("longitude", "Longitude", "lng")
 
 EXAMPLES = """
 Example 1:
@@ -61,6 +91,69 @@ Output:
 """
 
 
+GUIDELINES = """Guidelines:
+    - Use the following classification categories:
+      (1) United States
+      (2) North America (excluding the United States)
+      (3) Central America
+      (4) South America
+      (5) EMEA (Europe, Middle East, and Africa)
+      (6) APAC (Asia-Pacific)
+      (7) Virtual
+    - If the location is in the United States, classify it as "United States"
+    - For Canada and Mexico, use "North America"
+    - Use "EMEA" for locations in Europe, the Middle East, and Africa
+    - Use "APAC" for locations in Asia and Oceania
+    - If the address indicates a remote or virtual location, classify it as "Virtual"
+    - If the location information is unclear or insufficient, use your best judgment based on available data
+
+    VERY IMPORTANT:
+    - DO NOT MAKE UP A CLASSIFICATION. YOU CAN ONLY SELECT FROM THE PROVIDED CATEGORIES."""
+
+
+def build_classification_request(full_address: str) -> Dict:
+    """
+    Build the chat completion request that classifies a single address.
+
+    Shared by the synchronous path and the bulk-job mode, which writes the same request to a job file.
+
+    Args:
+        full_address (str): The full postal address of the location.
+
+    Returns:
+        Dict: The chat completion request body.
+    """
+    prompt = f"""
+    Given the following examples of location information and their classifications:
+
+    {EXAMPLES}
+
+    Now, analyze the following address:
+
+    Input:
+    FullPostalAddress: {full_address}
+
+    Please respond with the classification in the following format:
+    {{
+        "classification": "(the most appropriate classification for this location)"
+    }}
+    
+    {GUIDELINES}
+    """
+
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are an expert at analyzing location information and determining the most appropriate classification. You return only JSON format.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        "response_format": {"type": "json_object"},
+    }
+
+
 def classify_location(full_address: str) -> str:
     """
     Classify a location based on its full postal address.
@@ -80,39 +173,71 @@ def classify_location(full_address: str) -> str:
         6. APAC (Asia-Pacific)
         7. Virtual
     """
+    completion = client.chat.completions.create(**build_classification_request(full_address))
+
+    ai_response = json.loads(completion.choices[0].message.content)
+    return ai_response.get("classification")
+
+
+def build_batches(
+    addresses: Dict[str, str], batch_size: int = BATCH_SIZE, token_budget: int = BATCH_TOKEN_BUDGET
+) -> List[Dict[str, str]]:
+    """
+    Pack addresses into batches bounded by both a row count and a token budget.
+
+    Args:
+        addresses (Dict[str, str]): Mapping of LocationID to full postal address.
+        batch_size (int, optional): Maximum number of addresses per batch.
+        token_budget (int, optional): Maximum tokens of address lines per batch.
+
+    Returns:
+        List[Dict[str, str]]: The batches, each a mapping of LocationID to address.
+    """
+    batches = []
+    batch: Dict[str, str] = {}
+    batch_tokens = 0
+    for location_id, full_address in addresses.items():
+        line_tokens = count_tokens(f"{location_id}: {full_address}", MODEL)
+        if batch and (len(batch) >= batch_size or batch_tokens + line_tokens > token_budget):
+            batches.append(batch)
+            batch, batch_tokens = {}, 0
+        batch[location_id] = full_address
+        batch_tokens += line_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def request_batch_classifications(addresses: Dict[str, str]) -> Dict[str, str]:
+    """
+    Send one JSON-mode request classifying several addresses keyed by LocationID.
+
+    Args:
+        addresses (Dict[str, str]): Mapping of LocationID to full postal address.
+
+    Returns:
+        Dict[str, str]: The raw LocationID -> classification mapping returned by the model.
+    """
+    address_lines = "\n".join(f"    {location_id}: {full_address}" for location_id, full_address in addresses.items())
     prompt = f"""
     Given the following examples of location information and their classifications:
 
     {EXAMPLES}
 
-    Now, analyze the following address:
+    Now, analyze each of the following addresses. Every line has the format "LocationID: FullPostalAddress".
 
-    Input:
-    FullPostalAddress: {full_address}
+{address_lines}
 
-    Please respond with the classification in the following format:
+    Please respond with the classification of every LocationID in the following format:
     {{
-        "classification": "(the most appropriate classification for this location)"
+        "classifications": {{
+            "(LocationID)": "(the most appropriate classification for this location)"
+        }}
     }}
-    
-    Guidelines:
-    - Use the following classification categories:
-      (1) United States
-      (2) North America (excluding the United States)
-      (3) Central America
-      (4) South America
-      (5) EMEA (Europe, Middle East, and Africa)
-      (6) APAC (Asia-Pacific)
-      (7) Virtual
-    - If the location is in the United States, classify it as "United States"
-    - For Canada and Mexico, use "North America"
-    - Use "EMEA" for locations in Europe, the Middle East, and Africa
-    - Use "APAC" for locations in Asia and Oceania
-    - If the address indicates a remote or virtual location, classify it as "Virtual"
-    - If the location information is unclear or insufficient, use your best judgment based on available data
 
-    VERY IMPORTANT:
-    - DO NOT MAKE UP A CLASSIFICATION. YOU CAN ONLY SELECT FROM THE PROVIDED CATEGORIES.
+    Use the LocationIDs exactly as given and answer for every one of them.
+
+    {GUIDELINES}
     """
 
     completion = client.chat.completions.create(
@@ -127,8 +252,66 @@ def classify_location(full_address: str) -> str:
         response_format={"type": "json_object"},
     )
 
-    ai_response = json.loads(completion.choices[0].message.content)
-    return ai_response.get("classification")
+    try:
+        ai_response = json.loads(completion.choices[0].message.content)
+    except json.JSONDecodeError:
+        return {}
+    classifications = ai_response.get("classifications", {})
+    return classifications if isinstance(classifications, dict) else {}
+
+
+def classify_locations_batch(addresses: Dict[str, str], max_attempts: int = BATCH_MAX_ATTEMPTS) -> Dict[str, Optional[str]]:
+    """
+    Classify a batch of addresses, retrying only the LocationIDs that came back missing or invalid.
+
+    Answers are validated against the LocationIDs that were sent and against CLASSIFICATIONS.
+    Addresses still unresolved after max_attempts are classified one at a time.
+
+    Args:
+        addresses (Dict[str, str]): Mapping of LocationID to full postal address.
+        max_attempts (int, optional): Number of batched attempts before falling back to single requests.
+
+    Returns:
+        Dict[str, Optional[str]]: Mapping of LocationID to classification.
+    """
+    results: Dict[str, Optional[str]] = {}
+    pending = dict(addresses)
+    for attempt in range(max_attempts):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(2**attempt)
+        answers = request_batch_classifications(pending)
+        for location_id, classification in answers.items():
+            if location_id in pending and classification in CLASSIFICATIONS:
+                results[location_id] = classification
+                del pending[location_id]
+
+    for location_id, full_address in pending.items():
+        results[location_id] = classify_location(full_address)
+    return results
+
+
+def resolve_classification(full_address: str) -> str:
+    """
+    Classify an address, calling the model only when necessary.
+
+    The offline rule engine is tried first, then the classification cache; only addresses neither
+    can answer are sent to the model.
+
+    Args:
+        full_address (str): The full postal address of the location.
+
+    Returns:
+        str: The classification of the location.
+    """
+    classification = region_resolver.resolve(full_address)
+    if classification is None:
+        classification = classification_cache.get(full_address)
+    if classification is None:
+        classification = classify_location(full_address)
+        classification_cache.set(full_address, classification)
+    return classification
 
 
 def process_location(row: Dict[str, str]) -> Dict[str, str]:
@@ -142,27 +325,260 @@ def process_location(row: Dict[str, str]) -> Dict[str, str]:
         Dict[str, str]: A dictionary with LocationID and Classification.
     """
     full_address = row.get("FullPostalAddress", "N/A")
-    classification = classify_location(full_address)
+    classification = resolve_classification(full_address)
     return {"LocationID": row.get("\ufeffLocationID", "Unknown"), "Classification": classification}
 
 
-def process_csv(input_file_path: str, output_file_path: str, num_threads: int = 20):
+def resolve_offline(location_ids: List[str], addresses: List[str]) -> Tuple[Dict[str, Optional[str]], Dict[str, str]]:
+    """
+    Classify what the rule engine and the cache can answer and collect the rest for the model.
+
+    Args:
+        location_ids (List[str]): A LocationID for each address.
+        addresses (List[str]): The unique addresses to classify.
+
+    Returns:
+        Tuple[Dict[str, Optional[str]], Dict[str, str]]: LocationID -> classification for the resolved
+        addresses, and LocationID -> address for the ones that still need the model.
+    """
+    classifications: Dict[str, Optional[str]] = {}
+    pending: Dict[str, str] = {}
+    for location_id, full_address in zip(location_ids, addresses):
+        classification = region_resolver.resolve(full_address)
+        if classification is None:
+            classification = classification_cache.get(full_address)
+        if classification is None:
+            pending[location_id] = full_address
+        else:
+            classifications[location_id] = classification
+    return classifications, pending
+
+
+def classify_by_coordinates(rows: List[Dict[str, str]], row_indices: List[int], addresses: List[str]) -> List[Optional[str]]:
+    """
+    Classify addresses from the coordinates of their rows, when the input file has been geocoded.
+
+    Addresses the rule engine can resolve from their text are left to it, so coordinates only decide
+    the ones it cannot.
+
+    Args:
+        rows (List[Dict[str, str]]): The input rows.
+        row_indices (List[int]): The row whose coordinates represent each address.
+        addresses (List[str]): The addresses, aligned with row_indices.
+
+    Returns:
+        List[Optional[str]]: The region of every address, or None where it has to be classified otherwise.
+    """
+    columns = rows[0].keys() if rows else ()
+    latitude_column = next((column for column in LATITUDE_COLUMNS if column in columns), None)
+    longitude_column = next((column for column in LONGITUDE_COLUMNS if column in columns), None)
+    if latitude_column is None or longitude_column is None:
+        return [None] * len(addresses)
+
+    def coordinate(value: Optional[str]) -> float:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float("nan")
+
+    undecided = [row_index for row_index, full_address in zip(row_indices, addresses) if resolve_region(full_address) is None]
+    regions = region_polygons.classify(
+        [coordinate(rows[row_index].get(latitude_column)) for row_index in undecided],
+        [coordinate(rows[row_index].get(longitude_column)) for row_index in undecided],
+    )
+    regions_by_row = dict(zip(undecided, regions))
+    return [regions_by_row.get(row_index) for row_index in row_indices]
+
+
+def classify_unique_addresses_batched(
+    location_ids: List[str], addresses: List[str], num_threads: int, batch_size: int, batch_token_budget: int
+) -> List[str]:
+    """
+    Classify unique addresses with ID-keyed multi-row requests.
+
+    The rule engine and the cache are consulted first; the remaining addresses are packed into
+    batches so the few-shot examples are sent once per batch instead of once per address.
+
+    Args:
+        location_ids (List[str]): A LocationID for each address, used as the key in the batch.
+        addresses (List[str]): The unique addresses to classify.
+        num_threads (int): Number of batches to send in parallel.
+        batch_size (int): Maximum number of addresses per request.
+        batch_token_budget (int): Maximum tokens of address lines per request.
+
+    Returns:
+        List[str]: The classification of every address, aligned with addresses.
+    """
+    classifications, pending = resolve_offline(location_ids, addresses)
+
+    batches = build_batches(pending, batch_size=batch_size, token_budget=batch_token_budget)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+        for batch, batch_results in zip(
+            batches, tqdm(iterable=executor.map(classify_locations_batch, batches), total=len(batches), desc="Processing batches", unit="batch")
+        ):
+            for location_id, classification in batch_results.items():
+                classification_cache.set(batch[location_id], classification)
+            classifications.update(batch_results)
+
+    return [classifications.get(location_id) for location_id in location_ids]
+
+
+def classify_unique_addresses_bulk(
+    location_ids: List[str], addresses: List[str], job_path: str, base_url: str = DEFAULT_BASE_URL, poll_interval: float = 60, num_threads: int = 20
+) -> List[str]:
+    """
+    Classify unique addresses with an asynchronous bulk job instead of synchronous calls.
+
+    Addresses the rule engine or the cache cannot answer are written to JSONL job files keyed by
+    LocationID, submitted to the batch endpoint and merged back once the jobs complete. Answers that
+    are missing or not in CLASSIFICATIONS are resubmitted once as a follow-up job; whatever is still
+    missing after that is classified synchronously on a thread pool.
+
+    Args:
+        location_ids (List[str]): A LocationID for each address, used as the custom_id of its request.
+        addresses (List[str]): The unique addresses to classify.
+        job_path (str): Where to write the JSONL job files.
+        base_url (str, optional): Base URL of the batch API (or of a local stand-in).
+        poll_interval (float, optional): Seconds between job status polls.
+        num_threads (int, optional): Threads for the synchronous fallback.
+
+    Returns:
+        List[str]: The classification of every address, aligned with addresses.
+    """
+    classifications, pending = resolve_offline(location_ids, addresses)
+
+    bulk_client = BulkJobClient(OPENAI_API_KEY, base_url=base_url)
+    request_bodies = ((location_id, build_classification_request(full_address)) for location_id, full_address in pending.items())
+    answers = run_bulk_job(
+        bulk_client, request_bodies, job_path, poll_interval=poll_interval, accept=lambda content: load_answer(content).get("classification") in CLASSIFICATIONS
+    )
+
+    retries = []
+    for location_id, full_address in pending.items():
+        classification = load_answer(answers.get(location_id)).get("classification")
+        if classification in CLASSIFICATIONS:
+            classifications[location_id] = classification
+            classification_cache.set(full_address, classification)
+        else:
+            retries.append(location_id)
+
+    if retries:
+        print(f"Classifying {len(retries)} addresses without a usable bulk answer synchronously")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            retried = executor.map(classify_location, [pending[location_id] for location_id in retries])
+            for location_id, classification in zip(retries, tqdm(retried, total=len(retries), desc="Retrying locations", unit="location")):
+                classifications[location_id] = classification
+                classification_cache.set(pending[location_id], classification)
+
+    return [classifications.get(location_id) for location_id in location_ids]
+
+
+def process_csv(
+    input_file_path: str,
+    output_file_path: str,
+    num_threads: int = 20,
+    batch_size: int = 1,
+    batch_token_budget: int = BATCH_TOKEN_BUDGET,
+    bulk: bool = False,
+    bulk_base_url: str = DEFAULT_BASE_URL,
+    poll_interval: float = 60,
+    use_label_index: bool = False,
+    label_index_path: str = LABEL_INDEX_PATH,
+):
     """
     Process the input CSV file, classify locations, and write results to the output CSV file.
 
+    Rows are grouped by canonical address first, so each unique address is classified once and
+    the result is shared by every row with that address. When the file has latitude/longitude
+    columns (e.g. from google_location_enhancement), geocoded addresses are classified from their
+    coordinates offline.
+
     Args:
         input_file_path (str): Path to the input CSV file.
         output_file_path (str): Path to the output CSV file.
         num_threads (int, optional): Number of threads to use for parallel processing. Defaults to 20.
+        batch_size (int, optional): Addresses per request. Values above 1 enable the batched mode,
+            where the few-shot examples are sent once per batch. Defaults to 1.
+        batch_token_budget (int, optional): Token budget for the address lines of one batch.
+        bulk (bool, optional): Submit the addresses as one asynchronous bulk job instead of making
+            synchronous calls. Meant for large overnight runs. Defaults to False.
+        bulk_base_url (str, optional): Base URL of the batch API; point it at bulk_jobs_stub_server for testing.
+        poll_interval (float, optional): Seconds between bulk job status polls.
+        use_label_index (bool, optional): Take the label of addresses whose nearest previously labelled
+            neighbours agree from the embedding index, and add this run's answers to it. Defaults to False.
+        label_index_path (str, optional): Path prefix of the label index files.
     """
     # Read all rows from the input CSV file
     with open(input_file_path, newline="", encoding="utf-8") as input_csvfile:
         reader = csv.DictReader(input_csvfile)
         rows = list(reader)
 
-    # Process locations in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-        results = list(tqdm(iterable=executor.map(process_location, rows), total=len(rows), desc="Processing locations", unit="location"))
+    # Collapse duplicate addresses so each one is classified only once
+    address_groups = AddressGroups(row.get("FullPostalAddress", "N/A") for row in rows)
+    unique_addresses = address_groups.unique_addresses()
+
+    # Key every unique address by the LocationID of the first row that has it
+    location_ids = address_groups.group_ids([row.get("\ufeffLocationID") for row in rows])
+
+    # Geocoded rows are classified from their coordinates without an LLM call
+    answered: Dict[str, str] = {
+        location_id: region
+        for location_id, region in zip(location_ids, classify_by_coordinates(rows, address_groups.first_row_indices(), unique_addresses))
+        if region is not None
+    }
+
+    if use_label_index:
+        # Only addresses the rules and the cache cannot answer are looked up in the index
+        label_index = LabelIndex(client, path=label_index_path, labels=CLASSIFICATIONS)
+        pending = {
+            location_id: full_address
+            for location_id, full_address in zip(location_ids, unique_addresses)
+            if location_id not in answered and resolve_region(full_address) is None and full_address not in classification_cache
+        }
+        index_answers, _ = split_by_index(label_index, list(pending), list(pending.values()))
+        answered.update(index_answers)
+    model_ids = [location_id for location_id in location_ids if location_id not in answered]
+    model_addresses = [full_address for location_id, full_address in zip(location_ids, unique_addresses) if location_id not in answered]
+
+    if bulk:
+        model_classifications = classify_unique_addresses_bulk(
+            model_ids,
+            model_addresses,
+            job_path=f"{output_file_path}.bulk_job.jsonl",
+            base_url=bulk_base_url,
+            poll_interval=poll_interval,
+            num_threads=num_threads,
+        )
+    elif batch_size > 1:
+        model_classifications = classify_unique_addresses_batched(
+            model_ids, model_addresses, num_threads=num_threads, batch_size=batch_size, batch_token_budget=batch_token_budget
+        )
+    else:
+        # Process unique addresses in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            model_classifications = list(
+                tqdm(
+                    iterable=executor.map(resolve_classification, model_addresses),
+                    total=len(model_addresses),
+                    desc="Processing locations",
+                    unit="location",
+                )
+            )
+
+    classified = dict(zip(model_ids, model_classifications))
+    classified.update(answered)
+    unique_classifications = [classified[location_id] for location_id in location_ids]
+    if use_label_index:
+        # Grow the index with this run's answers so the next run can reuse them
+        label_index.add(model_addresses, model_classifications)
+        label_index.save()
+        print(label_index.report())
+
+    classifications = address_groups.fan_out(unique_classifications)
+    results = [
+        {"LocationID": row.get("\ufeffLocationID", "Unknown"), "Classification": classification}
+        for row, classification in zip(rows, classifications)
+    ]
 
     # Write results to the output CSV file
     with open(output_file_path, "w", newline="", encoding="utf-8") as output_csvfile:
@@ -171,9 +587,35 @@ def process_csv(input_file_path: str, output_file_path: str, num_threads: int =
         writer.writeheader()
         writer.writerows(results)
 
+    print(address_groups.report())
+    print(region_resolver.report())
+    print(region_polygons.report())
+    print(classification_cache.report())
     print(f"Processing complete. Results written to {output_file_path}")
 
 
+
+def seed_label_index(output_file_path: str, input_file_path: str, label_index_path: str = LABEL_INDEX_PATH) -> int:
+    """
+    Seed the label index with the classifications of an earlier run.
+
+    The output file holds only LocationIDs, so the addresses are taken from the run's input file.
+
+    Args:
+        output_file_path (str): Output CSV of the earlier run.
+        input_file_path (str): The input CSV that run classified.
+        label_index_path (str, optional): Path prefix of the label index files.
+
+    Returns:
+        int: The number of entries added to the index.
+    """
+    addresses, labels = load_labelled_csv(output_file_path, "Classification", input_path=input_file_path)
+    label_index = LabelIndex(client, path=label_index_path, labels=CLASSIFICATIONS)
+    added = seed_index(label_index, addresses, labels)
+    print(label_index.report())
+    return added
+
+
 if __name__ == "__main__":
     input_csv_file_path = "GooglePlaces/data/location_information_10_16_2024.csv"
     output_csv_file_path = "GooglePlaces/data/location_information_10_16_2024_classified.csv"
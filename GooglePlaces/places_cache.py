@@ -0,0 +1,232 @@
+"""
+Persistent on-disk cache for Google Places lookups.
+
+Two kinds of entries are stored in SQLite:
+
+- normalized text query -> place ID (or "no match", kept for a shorter negative TTL), and
+- place ID + field -> field value, each with its own TTL so stable fields such as coordinates are
+  kept for long while phone numbers, websites and ratings are refreshed sooner.
+
+A lookup for a field mask is a hit when every field in it is fresh; when only some are stale the
+client refreshes just those fields by place ID instead of repeating the text search.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from classification_cache import normalize_cache_key
+
+DEFAULT_CACHE_PATH = "places_cache.sqlite"
+DAY = 24 * 60 * 60
+
+# How long each place field stays fresh, in days
+FIELD_TTL_DAYS = {
+    "id": 365,
+    "location": 365,
+    "formattedAddress": 180,
+    "displayName": 90,
+    "types": 90,
+    "websiteUri": 30,
+    "internationalPhoneNumber": 30,
+    "nationalPhoneNumber": 30,
+    "rating": 7,
+    "userRatingCount": 7,
+}
+DEFAULT_FIELD_TTL_DAYS = 30
+# Queries that matched nothing are retried after this many days
+NEGATIVE_TTL_DAYS = 7
+# Query to place ID mappings rarely change
+QUERY_TTL_DAYS = 180
+
+
+class PlacesCache:
+    """SQLite backed cache of query -> place ID and place ID + field -> value, with hit/miss counters."""
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        field_ttl_days: Optional[Dict[str, float]] = None,
+        default_field_ttl_days: float = DEFAULT_FIELD_TTL_DAYS,
+        negative_ttl_days: float = NEGATIVE_TTL_DAYS,
+        query_ttl_days: float = QUERY_TTL_DAYS,
+    ):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path (str, optional): Path to the SQLite file. Defaults to DEFAULT_CACHE_PATH.
+            field_ttl_days (Optional[Dict[str, float]], optional): Per-field TTLs; defaults to FIELD_TTL_DAYS.
+            default_field_ttl_days (float, optional): TTL of fields missing from field_ttl_days.
+            negative_ttl_days (float, optional): How long a query that matched nothing is remembered.
+            query_ttl_days (float, optional): How long a query's place ID is trusted.
+        """
+        self.path = path
+        self.field_ttl_days = dict(FIELD_TTL_DAYS if field_ttl_days is None else field_ttl_days)
+        self.default_field_ttl_days = default_field_ttl_days
+        self.negative_ttl_seconds = negative_ttl_days * DAY
+        self.query_ttl_seconds = query_ttl_days * DAY
+        self.hits = 0
+        self.negative_hits = 0
+        self.refreshes = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS queries (
+                key TEXT PRIMARY KEY,
+                place_id TEXT,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS place_fields (
+                place_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (place_id, field)
+            )
+            """
+        )
+        self._connection.commit()
+        self.evict()
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        return hashlib.sha256(normalize_cache_key(query).encode("utf-8")).hexdigest()
+
+    def field_ttl_seconds(self, field: str) -> float:
+        """The TTL of a place field, in seconds."""
+        return self.field_ttl_days.get(field, self.default_field_ttl_days) * DAY
+
+    def lookup_query(self, query: str) -> Tuple[bool, Optional[str]]:
+        """
+        Look up the place a text query resolved to.
+
+        Args:
+            query (str): The text query.
+
+        Returns:
+            Tuple[bool, Optional[str]]: Whether a fresh entry exists, and its place ID (None if the
+            query matched nothing).
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT place_id, created_at FROM queries WHERE key = ?", (self._query_key(query),)).fetchone()
+        if row is None:
+            return False, None
+        place_id, created_at = row
+        ttl = self.query_ttl_seconds if place_id is not None else self.negative_ttl_seconds
+        if time.time() - created_at > ttl:
+            return False, None
+        return True, place_id
+
+    def lookup_fields(self, place_id: str, fields: Sequence[str]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Look up the cached fields of a place.
+
+        Args:
+            place_id (str): The place ID.
+            fields (Sequence[str]): The fields wanted.
+
+        Returns:
+            Tuple[Dict[str, Any], List[str]]: The place built from the fresh fields (fields the place
+            does not have are left out), and the fields that are missing or stale.
+        """
+        placeholders = ",".join("?" * len(fields))
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT field, value, fetched_at FROM place_fields WHERE place_id = ? AND field IN ({placeholders})", (place_id, *fields)
+            ).fetchall()
+        now = time.time()
+        fresh = {field: json.loads(value) for field, value, fetched_at in rows if now - fetched_at <= self.field_ttl_seconds(field)}
+        place = {"id": place_id}
+        place.update({field: value for field, value in fresh.items() if value is not None})
+        return place, [field for field in fields if field not in fresh]
+
+    def store(self, query: Optional[str], place: Optional[Dict], fields: Sequence[str]) -> None:
+        """
+        Store a lookup result.
+
+        Args:
+            query (Optional[str]): The text query, or None when the place was fetched by ID.
+            place (Optional[Dict]): The place returned (it must include "id"), or None if nothing matched.
+            fields (Sequence[str]): The fields that were requested; requested fields the place does
+                not have are cached as absent.
+        """
+        now = time.time()
+        place_id = place.get("id") if place else None
+        with self._lock:
+            if query is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO queries (key, place_id, created_at) VALUES (?, ?, ?)", (self._query_key(query), place_id, now)
+                )
+            if place_id is not None:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO place_fields (place_id, field, value, fetched_at) VALUES (?, ?, ?, ?)",
+                    [(place_id, field, json.dumps(place.get(field)), now) for field in fields],
+                )
+            self._connection.commit()
+
+    def count(self, outcome: str) -> None:
+        """Count a lookup outcome: "hit", "negative_hit", "refresh" (stale fields refetched by ID) or "miss"."""
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "negative_hit":
+                self.negative_hits += 1
+            elif outcome == "refresh":
+                self.refreshes += 1
+            else:
+                self.misses += 1
+
+    def evict(self) -> int:
+        """
+        Remove expired query and field entries.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        now = time.time()
+        with self._lock:
+            removed = self._connection.execute(
+                "DELETE FROM queries WHERE (place_id IS NOT NULL AND created_at < ?) OR (place_id IS NULL AND created_at < ?)",
+                (now - self.query_ttl_seconds, now - self.negative_ttl_seconds),
+            ).rowcount
+            for field, ttl_days in self.field_ttl_days.items():
+                removed += self._connection.execute(
+                    "DELETE FROM place_fields WHERE field = ? AND fetched_at < ?", (field, now - ttl_days * DAY)
+                ).rowcount
+            placeholders = ",".join("?" * len(self.field_ttl_days))
+            removed += self._connection.execute(
+                f"DELETE FROM place_fields WHERE field NOT IN ({placeholders}) AND fetched_at < ?",
+                (*self.field_ttl_days, now - self.default_field_ttl_days * DAY),
+            ).rowcount
+            self._connection.commit()
+        return removed
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered without a text search request."""
+        total = self.hits + self.negative_hits + self.refreshes + self.misses
+        return (self.hits + self.negative_hits) / total if total else 0.0
+
+    def report(self) -> str:
+        """Human readable summary of the cache's hit/miss counters."""
+        return (
+            f"Places cache: {self.hits} hits, {self.negative_hits} cached no-matches, {self.refreshes} stale-field refreshes, "
+            f"{self.misses} misses ({self.hit_rate:.1%} hit rate)"
+        )
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        with self._lock:
+            self._connection.close()
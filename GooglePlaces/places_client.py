@@ -0,0 +1,214 @@
+"""
+Shared asyncio client for Google Places lookups.
+
+Every lookup is a single Text Search (New) request that returns the requested fields directly, instead
+of the legacy Find Place request followed by a Place Details request. Callers pass the field mask
+for their use case; Places bills each request at the SKU of the most expensive field it asks for, so
+the masks below only name the fields their callers actually read.
+
+Requests run on one thread over a single keep-alive httpx connection pool, with an AIMD limit on
+how many are in flight and an optional rate limiter pacing them. Quota errors shrink the limit and
+are retried with jittered backoff, so throttled rows are not lost. Identical lookups that overlap in
+time share one request. With a PlacesCache attached, repeated queries are answered locally and only
+stale fields are refetched, by place ID.
+
+Usage:
+    async with PlacesClient(GOOGLE_API_KEY, max_concurrency=200) as places_client:
+        place = await places_client.search_text("1 Main St, Boston", ADDRESS_FIELDS)
+"""
+
+import asyncio
+from typing import Dict, Optional, Sequence
+
+import httpx
+
+from classification_cache import normalize_cache_key
+from rate_limiting import QUOTA_ATTEMPTS, AdaptiveConcurrency, backoff_delay, is_quota_error
+from single_flight import AsyncSingleFlight
+
+SEARCH_TEXT_URL = "https://places.googleapis.com/v1/places:searchText"
+PLACE_DETAILS_URL = "https://places.googleapis.com/v1/places/{place_id}"
+
+# Address normalization only needs Google's formatted address
+ADDRESS_FIELDS = ("formattedAddress",)
+# Geocoding and enrichment of location rows
+GEOCODE_FIELDS = ("id", "formattedAddress", "types", "rating", "userRatingCount", "location")
+# Contact details of a business (hotel enrichment)
+CONTACT_FIELDS = ("displayName", "formattedAddress", "websiteUri", "internationalPhoneNumber", "nationalPhoneNumber", "location")
+
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+def field_mask(fields: Sequence[str]) -> str:
+    """
+    Build the X-Goog-FieldMask header value for Text Search.
+
+    Args:
+        fields (Sequence[str]): Place fields, e.g. ("formattedAddress", "location").
+
+    Returns:
+        str: The mask, e.g. "places.formattedAddress,places.location".
+    """
+    return ",".join(f"places.{field}" for field in fields)
+
+
+def _json_or_none(response: httpx.Response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+class PlacesClient:
+    """Async Text Search client with adaptive concurrency, optionally paced by a rate limiter and backed by a cache."""
+
+    def __init__(
+        self,
+        api_key: str,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        rate_limiter=None,
+        timeout: float = 30,
+        cache=None,
+    ):
+        """
+        Create the client; do so inside the event loop that will use it.
+
+        Args:
+            api_key (str): Google API key with the Places API (New) enabled.
+            max_concurrency (int, optional): Most requests in flight at once; also the connection pool size.
+                The limit starts here and is lowered while Google reports quota errors.
+            rate_limiter (optional): Object with an async acquire_async() method awaited before every request, e.g. a TokenBucket.
+            timeout (float, optional): Per-request timeout in seconds.
+            cache (optional): PlacesCache consulted before, and filled after, every lookup.
+        """
+        self.api_key = api_key
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.requests = 0
+        self.found = 0
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=httpx.Timeout(timeout),
+        )
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.throttled = 0
+        self.flights = AsyncSingleFlight("Places in-flight coalescing")
+
+    async def __aenter__(self) -> "PlacesClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the connection pool."""
+        await self.http.aclose()
+
+    async def _send(self, method: str, url: str, fields: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying quota errors with jittered backoff; the last response is returned either way."""
+        headers = {"X-Goog-Api-Key": self.api_key, "X-Goog-FieldMask": fields}
+        for attempt in range(QUOTA_ATTEMPTS):
+            async with self.concurrency:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire_async()
+                response = await self.http.request(method, url, headers=headers, **kwargs)
+            self.requests += 1
+            # New Places endpoints report quota errors as HTTP errors, so successful bodies need no parsing here
+            if not is_quota_error(response.status_code, _json_or_none(response) if response.is_error else None):
+                self.concurrency.on_success()
+                return response
+            self.throttled += 1
+            self.concurrency.on_throttle()
+            if attempt + 1 < QUOTA_ATTEMPTS:
+                await asyncio.sleep(backoff_delay(attempt))
+        return response
+
+    async def search_text(self, query: str, fields: Sequence[str]) -> Optional[Dict]:
+        """
+        Look up the best matching place for a text query.
+
+        Args:
+            query (str): Free-text query, e.g. an address or "name address".
+            fields (Sequence[str]): The place fields to return.
+
+        Returns:
+            Optional[Dict]: The first place with the requested fields, or None if nothing matched.
+
+        Raises:
+            httpx.HTTPError: If the request failed or was rejected.
+        """
+        # Duplicate queries running at the same time (e.g. duplicate rows in a file) wait for the first one
+        return await self.flights.do((normalize_cache_key(query), tuple(fields)), self._search_text, query, fields)
+
+    async def _search_text(self, query: str, fields: Sequence[str]) -> Optional[Dict]:
+        if self.cache is not None:
+            place = await self._search_cached(query, fields)
+            if place is not False:
+                return place
+            # The place ID is what later lookups are keyed by; asking for it does not change the SKU
+            fields = list(dict.fromkeys(["id", *fields]))
+
+        response = await self._send("POST", SEARCH_TEXT_URL, field_mask(fields), json={"textQuery": query, "pageSize": 1})
+        response.raise_for_status()
+
+        places = response.json().get("places") or []
+        place = places[0] if places else None
+        if self.cache is not None:
+            self.cache.count("miss")
+            self.cache.store(query, place, fields)
+        if place is None:
+            return None
+        self.found += 1
+        return place
+
+    async def _search_cached(self, query: str, fields: Sequence[str]):
+        """Answer a search from the cache, refreshing stale fields by place ID; False if the search has to be sent."""
+        known, place_id = self.cache.lookup_query(query)
+        if not known:
+            return False
+        if place_id is None:
+            self.cache.count("negative_hit")
+            return None
+
+        place, stale = self.cache.lookup_fields(place_id, fields)
+        if stale:
+            refreshed = await self.get_place(place_id, stale)
+            if refreshed is None:
+                return False
+            self.cache.count("refresh")
+            place.update(refreshed)
+        else:
+            self.cache.count("hit")
+        self.found += 1
+        return place
+
+    async def get_place(self, place_id: str, fields: Sequence[str]) -> Optional[Dict]:
+        """
+        Fetch fields of a known place by its ID.
+
+        Args:
+            place_id (str): The place ID.
+            fields (Sequence[str]): The place fields to return.
+
+        Returns:
+            Optional[Dict]: The place with the requested fields, or None if the ID is no longer valid.
+
+        Raises:
+            httpx.HTTPError: If the request failed or was rejected.
+        """
+        response = await self._send("GET", PLACE_DETAILS_URL.format(place_id=place_id), ",".join(fields))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        place = response.json()
+        place.setdefault("id", place_id)
+        if self.cache is not None:
+            self.cache.store(None, place, fields)
+        return place
+
+    def report(self) -> str:
+        """Human readable summary of the lookups so far."""
+        return (
+            f"Places: {self.requests} requests, {self.found} matched, {self.flights.shared} duplicate lookups coalesced, "
+            f"{self.throttled} quota errors retried\n{self.concurrency.report()}"
+        )
@@ -0,0 +1,224 @@
+"""
+Client-side request pacing for quota-limited APIs.
+
+A TokenBucket shared by all worker threads (or asyncio tasks) caps the request rate at a
+configurable QPS while still allowing short bursts, so a pool of workers can run right up to a quota
+instead of sleeping a fixed delay after every call.
+
+Quota errors (HTTP 429, RESOURCE_EXHAUSTED, OVER_QUERY_LIMIT) are recognised by is_quota_error();
+an AdaptiveConcurrency limit backs off multiplicatively when they come back and grows additively
+while calls succeed (AIMD), and throttled calls are retried after backoff_delay().
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Optional
+
+# Quota errors are retried this many times before the call is given up
+QUOTA_ATTEMPTS = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+QUOTA_STATUSES = {"OVER_QUERY_LIMIT", "RESOURCE_EXHAUSTED"}
+
+
+def is_quota_error(status_code: int, payload: Any = None) -> bool:
+    """
+    Whether a Google API response says the quota or rate limit was exceeded.
+
+    Args:
+        status_code (int): The HTTP status code.
+        payload (Any, optional): The decoded JSON body, if any. Legacy endpoints report
+            {"status": "OVER_QUERY_LIMIT"} with HTTP 200; newer ones {"error": {"status": "RESOURCE_EXHAUSTED"}}.
+
+    Returns:
+        bool: True for a quota error.
+    """
+    if status_code == 429:
+        return True
+    if not isinstance(payload, dict):
+        return False
+    error = payload.get("error")
+    if isinstance(error, dict) and (error.get("status") in QUOTA_STATUSES or error.get("code") == 429):
+        return True
+    return payload.get("status") in QUOTA_STATUSES
+
+
+def backoff_delay(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for the given (0-based) retry attempt."""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class TokenBucket:
+    """Thread-safe token bucket: refills at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate (float): Sustained requests per second.
+            capacity (Optional[float], optional): Largest burst; defaults to one second's worth of tokens.
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.acquired = 0
+        self.waited = 0.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Take tokens now, going into debt if the bucket is short.
+
+        Args:
+            tokens (float, optional): Tokens to take.
+
+        Returns:
+            float: Seconds the caller has to wait before its request is within the rate.
+        """
+        if tokens > self.capacity:
+            raise ValueError(f"cannot take {tokens} tokens from a bucket of capacity {self.capacity}")
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+            self.acquired += 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += delay
+            return delay
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Block until tokens are available and take them.
+
+        Waiting happens outside the lock, and callers are served in the order they reserved.
+
+        Args:
+            tokens (float, optional): Tokens to take.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """
+        Like acquire(), but waits on the event loop instead of blocking the thread.
+
+        Args:
+            tokens (float, optional): Tokens to take.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def report(self) -> str:
+        """Human readable summary of the pacing so far."""
+        average_wait = self.waited / self.acquired if self.acquired else 0.0
+        return f"Rate limiter: {self.acquired} requests at up to {self.rate:g}/s, {self.waited:.1f}s spent waiting ({average_wait:.3f}s per request)"
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit for threads (``with limit:``) or for the tasks of one event loop (``async with limit:``).
+
+    Every quota error halves the limit, at most once per cooldown so one burst of rejected calls
+    counts as a single signal; every `limit` successes raise it by one. Callers wait while the
+    number of calls in flight is at the limit.
+    """
+
+    def __init__(self, maximum: int, initial: Optional[int] = None, minimum: int = 1, decrease_factor: float = 0.5, cooldown: float = 1.0):
+        """
+        Args:
+            maximum (int): Upper bound of the limit.
+            initial (Optional[int], optional): Starting limit; defaults to the maximum.
+            minimum (int, optional): Lower bound of the limit.
+            decrease_factor (float, optional): Factor the limit is multiplied by on a quota error.
+            cooldown (float, optional): Seconds after a decrease during which further quota errors do not decrease again.
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(initial if initial is not None else maximum)
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.lowest = self.limit
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def on_success(self):
+        """Record a successful call: additive increase."""
+        with self._condition:
+            self.successes += 1
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+        self._wake_async()
+
+    def on_throttle(self):
+        """Record a quota error: multiplicative decrease."""
+        with self._condition:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self.lowest = min(self.lowest, self.limit)
+                self._last_decrease = now
+
+    def _has_room(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def __enter__(self):
+        with self._condition:
+            self._condition.wait_for(self._has_room)
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+        self._wake_async()
+
+    async def __aenter__(self):
+        while not self._has_room():
+            waiter = asyncio.get_running_loop().create_future()
+            self._async_waiters.append(waiter)
+            await waiter
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        with self._condition:
+            self.in_flight -= 1
+        self._wake_async()
+
+    def _wake_async(self):
+        # Waiting tasks recheck the limit; only called from the event loop's own thread
+        waiters, self._async_waiters = self._async_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def report(self) -> str:
+        """Human readable summary of the adjustments so far."""
+        return (
+            f"Adaptive concurrency: {self.successes} successful calls, {self.throttles} quota errors, "
+            f"limit now {int(self.limit)} (lowest {int(self.lowest)}, maximum {self.maximum})"
+        )
+
@@ -0,0 +1,360 @@
+"""
+Offline region classifier for geocoded coordinates.
+
+Labels latitude/longitude pairs with the same regions as location_selector by testing them against
+bundled coarse region boundaries (a bounding-box prefilter followed by a vectorized NumPy ray-casting
+point-in-polygon test), so whole columns of coordinates are classified in one call without an LLM.
+
+The bundled boundaries are deliberately coarse: land borders follow the real ones to within a few
+kilometres, coastlines are pushed out to sea, and territories whose region is ambiguous (Greenland,
+the Caribbean, Central Asia, overseas territories, ...) are left uncovered. Points inside a region but
+within border_margin degrees of its boundary are left unresolved rather than guessed. Finer data, e.g.
+country boundaries from Natural Earth, can be loaded from GeoJSON with RegionPolygons.from_geojson.
+"""
+
+import json
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from region_rules import APAC, CENTRAL_AMERICA, EMEA, NORTH_AMERICA, SOUTH_AMERICA, UNITED_STATES, resolve_country
+
+Point = Tuple[float, float]  # (longitude, latitude)
+Ring = List[Point]
+
+DEFAULT_BORDER_MARGIN = 0.1
+# Points are tested against this many polygon edges at a time, bounding the size of the work arrays
+CHUNK_SIZE = 4096
+
+# Shared land borders, so neighbouring regions use exactly the same edges
+US_CANADA_BORDER: Ring = [  # west -> east
+    (-123.3, 48.3), (-123.05, 49.0), (-95.15, 49.0), (-95.15, 49.38), (-94.6, 48.7), (-93.0, 48.6), (-91.4, 48.05),
+    (-89.6, 48.0), (-88.4, 48.3), (-84.9, 46.9), (-84.4, 46.5), (-83.6, 46.1), (-82.4, 45.3), (-82.4, 43.0), (-82.5, 42.6),
+    (-83.1, 42.3), (-83.1, 42.05), (-82.7, 41.7), (-81.0, 42.2), (-79.15, 42.75), (-79.05, 43.1), (-79.2, 43.45), (-76.5, 43.6),
+    (-76.3, 44.1), (-75.8, 44.4), (-74.75, 45.0), (-71.5, 45.0), (-71.1, 45.3), (-70.7, 45.4), (-70.0, 46.7), (-69.2, 47.45),
+    (-68.3, 47.35), (-67.8, 47.07), (-67.8, 45.7), (-67.4, 45.15), (-66.9, 44.6),
+]
+US_MEXICO_BORDER: Ring = [  # west -> east
+    (-117.12, 32.53), (-114.72, 32.72), (-114.8, 32.5), (-111.07, 31.33), (-108.2, 31.33), (-108.2, 31.78), (-106.5, 31.75),
+    (-105.5, 30.8), (-104.7, 30.1), (-104.4, 29.6), (-103.3, 29.0), (-102.4, 29.8), (-101.4, 29.77), (-100.3, 28.2),
+    (-99.5, 27.5), (-99.1, 26.5), (-98.3, 26.1), (-97.5, 25.85), (-97.15, 25.95),
+]
+ALASKA_CANADA_BORDER: Ring = [  # north -> south
+    (-141.0, 69.65), (-141.0, 60.3), (-139.1, 60.35), (-137.5, 59.2), (-135.5, 59.8), (-133.4, 58.4), (-131.8, 56.6),
+    (-130.0, 55.9), (-130.0, 55.3), (-130.6, 54.7), (-132.5, 54.55), (-134.0, 54.4),
+]
+MEXICO_GUATEMALA_BELIZE_BORDER: Ring = [  # Pacific -> Caribbean
+    (-92.25, 14.5), (-92.07, 15.07), (-92.2, 15.26), (-91.73, 16.07), (-90.44, 16.07), (-90.4, 16.4), (-91.44, 17.25),
+    (-90.98, 17.25), (-90.98, 17.82), (-89.15, 17.82), (-89.15, 17.95), (-88.3, 18.48), (-87.8, 18.2),
+]
+PANAMA_COLOMBIA_BORDER: Ring = [(-77.37, 8.67), (-77.2, 7.9), (-77.9, 7.2), (-78.2, 7.0)]  # Caribbean -> Pacific
+RUSSIA_CHINA_MONGOLIA_BORDER: Ring = [  # Sea of Japan -> Altai
+    (130.7, 42.3), (130.6, 42.6), (131.3, 43.2), (131.0, 44.0), (131.2, 44.9), (133.5, 45.0), (134.7, 48.3), (132.5, 47.7),
+    (131.0, 47.8), (129.5, 49.4), (127.5, 49.9), (127.0, 50.5), (125.5, 53.0), (123.5, 53.5), (121.5, 53.3), (120.0, 51.6),
+    (119.0, 50.3), (117.9, 49.6), (116.5, 49.8), (114.0, 50.2), (111.0, 49.4), (108.5, 49.3), (106.5, 50.3), (102.0, 51.5),
+    (98.0, 51.5), (95.0, 50.0), (92.0, 50.7), (89.5, 49.9), (87.8, 49.2), (87.3, 49.1),
+]
+IRAN_PAKISTAN_BORDER: Ring = [(60.87, 29.86), (61.5, 29.0), (62.8, 28.3), (62.8, 27.2), (63.3, 26.7), (61.8, 26.2), (61.6, 25.2), (61.5, 24.0)]
+
+UNITED_STATES_RINGS: List[List[Ring]] = [
+    # Contiguous states
+    [
+        [(-125.5, 48.3)]
+        + US_CANADA_BORDER
+        + [
+            (-67.3, 44.0), (-69.5, 43.3), (-69.5, 42.0), (-69.5, 41.0), (-72.0, 40.4), (-73.9, 40.2), (-74.3, 38.7), (-74.8, 37.5),
+            (-75.0, 35.2), (-76.3, 34.4), (-77.7, 33.6), (-79.5, 32.5), (-80.5, 31.5), (-80.9, 30.5), (-80.0, 28.5), (-79.7, 27.0),
+            (-79.8, 25.5), (-80.2, 24.6), (-81.8, 24.3), (-82.3, 24.4), (-82.8, 26.5), (-83.2, 28.0), (-83.5, 29.3), (-85.5, 29.3),
+            (-88.8, 29.0), (-89.4, 28.6), (-90.5, 28.7), (-92.5, 29.2), (-94.0, 29.3), (-95.0, 28.8), (-96.8, 27.0), (-97.0, 26.0),
+        ]
+        + US_MEXICO_BORDER[::-1]
+        + [
+            (-117.5, 32.4), (-119.5, 32.7), (-121.2, 34.4), (-122.3, 36.3), (-123.6, 38.5), (-124.3, 39.8), (-125.0, 40.4),
+            (-125.0, 43.0), (-124.7, 46.0), (-125.0, 47.5),
+        ]
+    ],
+    # Alaska
+    [
+        [(-141.0, 70.5)]
+        + ALASKA_CANADA_BORDER
+        + [
+            (-137.0, 56.5), (-140.0, 59.0), (-146.0, 59.3), (-154.5, 56.0), (-160.0, 54.5), (-166.0, 53.3), (-172.0, 52.0),
+            (-180.0, 51.0), (-180.0, 53.5), (-174.0, 60.5), (-172.5, 63.3), (-171.5, 64.2), (-169.0, 65.5), (-168.9, 66.5),
+            (-168.9, 69.0), (-166.5, 69.5), (-156.0, 71.8),
+        ]
+    ],
+    # Western Aleutians, across the antimeridian
+    [[(172.0, 51.0), (180.0, 51.0), (180.0, 53.5), (172.0, 53.5)]],
+    # Hawaii
+    [[(-161.0, 18.5), (-154.5, 18.5), (-154.5, 22.5), (-161.0, 22.5)]],
+]
+
+NORTH_AMERICA_RINGS: List[List[Ring]] = [
+    # Canada, without Saint Pierre and Miquelon
+    [
+        [(-125.5, 48.3)]
+        + US_CANADA_BORDER
+        + [
+            (-66.4, 43.0), (-60.0, 43.5), (-59.0, 45.5), (-52.0, 46.5), (-52.0, 52.0), (-55.0, 54.0), (-61.5, 60.5), (-57.0, 64.0),
+            (-58.0, 67.0), (-65.0, 73.0), (-73.8, 78.0), (-68.5, 80.0), (-61.5, 82.3), (-60.0, 84.0), (-141.0, 84.0),
+        ]
+        + ALASKA_CANADA_BORDER
+        + [(-133.8, 53.5), (-132.0, 51.5), (-129.5, 50.8), (-126.5, 48.9)],
+        [(-56.5, 46.7), (-56.1, 46.7), (-56.1, 47.2), (-56.5, 47.2)],
+    ],
+    # Mexico
+    [
+        US_MEXICO_BORDER
+        + [
+            (-96.9, 25.95), (-97.1, 24.5), (-97.3, 22.5), (-96.8, 21.5), (-96.0, 20.5), (-95.5, 19.5), (-94.0, 18.5), (-91.5, 19.5),
+            (-90.5, 21.8), (-86.5, 21.8), (-86.5, 20.0),
+        ]
+        + MEXICO_GUATEMALA_BELIZE_BORDER[::-1]
+        + [
+            (-93.5, 15.2), (-95.0, 15.6), (-96.5, 15.3), (-98.0, 15.9), (-100.0, 16.6), (-102.5, 17.4), (-104.5, 18.6), (-105.8, 19.5),
+            (-105.8, 21.5), (-106.8, 23.0), (-109.5, 22.6), (-110.5, 22.5), (-112.5, 24.0), (-114.8, 26.5), (-115.8, 28.0),
+            (-116.6, 30.0), (-117.0, 31.0), (-117.5, 32.4),
+        ]
+    ],
+]
+
+CENTRAL_AMERICA_RINGS: List[List[Ring]] = [
+    [
+        [(-92.4, 14.2)]
+        + MEXICO_GUATEMALA_BELIZE_BORDER
+        + [(-87.2, 17.5), (-87.2, 16.5), (-85.5, 16.5), (-83.0, 15.5), (-83.0, 14.5), (-82.7, 12.0), (-83.2, 10.9), (-82.5, 9.5), (-81.5, 9.3), (-79.5, 9.7)]
+        + PANAMA_COLOMBIA_BORDER
+        + [(-80.0, 7.2), (-82.5, 7.6), (-84.0, 8.0), (-86.2, 9.9), (-86.2, 11.0), (-87.8, 13.0), (-89.5, 13.3), (-91.5, 13.7)]
+    ],
+]
+
+SOUTH_AMERICA_RINGS: List[List[Ring]] = [
+    # Mainland, without French Guiana
+    [
+        PANAMA_COLOMBIA_BORDER[::-1]
+        + [
+            (-76.2, 9.8), (-75.8, 11.0), (-74.0, 11.6), (-72.0, 12.5), (-70.0, 12.32), (-69.0, 11.85), (-68.0, 11.6), (-64.0, 11.0),
+            (-62.05, 10.7), (-62.05, 9.95), (-61.0, 9.8), (-60.0, 8.6), (-57.5, 7.0), (-54.0, 6.2), (-54.0, 5.7), (-54.2, 3.5),
+            (-54.0, 2.2), (-52.9, 2.2), (-51.9, 3.9), (-51.6, 4.3), (-51.2, 4.5), (-49.5, 2.0), (-48.0, 0.0), (-44.0, -1.5),
+            (-38.5, -3.0), (-34.5, -6.0), (-34.5, -8.0), (-37.0, -12.0), (-38.5, -16.0), (-39.0, -18.0), (-39.5, -20.0),
+            (-41.5, -23.3), (-47.5, -25.5), (-48.0, -28.0), (-50.0, -31.0), (-52.5, -34.0), (-54.5, -35.3), (-56.5, -36.0),
+            (-56.5, -37.5), (-57.0, -38.5), (-61.0, -39.3), (-62.0, -41.0), (-63.0, -42.8), (-65.0, -45.0), (-68.0, -50.5),
+            (-68.0, -52.5), (-64.5, -54.8), (-66.5, -55.5), (-68.0, -56.0), (-72.0, -55.5), (-75.5, -52.0), (-76.0, -47.0),
+            (-74.8, -43.0), (-74.2, -40.0), (-73.8, -37.0), (-72.2, -33.0), (-72.0, -29.0), (-71.0, -24.0), (-70.8, -18.3),
+            (-75.0, -16.0), (-76.5, -14.0), (-78.0, -11.0), (-79.5, -8.0), (-81.6, -4.7), (-81.3, -2.2), (-80.5, 0.5), (-80.0, 1.5),
+            (-78.8, 2.5), (-77.8, 4.0), (-77.8, 6.0),
+        ]
+    ],
+    # Galapagos
+    [[(-92.2, -1.6), (-89.0, -1.6), (-89.0, 0.8), (-92.2, 0.8)]],
+]
+
+EMEA_RINGS: List[List[Ring]] = [
+    # Europe, Africa, the Middle East and Russia, without Kazakhstan and Central Asia
+    [
+        [(-32.0, -40.0), (-32.0, 64.0), (-26.0, 67.5), (-10.0, 72.0), (-5.0, 75.0), (0.0, 85.0), (180.0, 85.0), (180.0, 60.0),
+         (172.0, 56.0), (168.5, 54.2), (157.0, 50.5), (150.0, 47.0), (146.0, 46.5), (141.9, 45.75), (139.5, 45.2), (131.0, 42.0)]
+        + RUSSIA_CHINA_MONGOLIA_BORDER
+        + [
+            (86.6, 49.7), (85.0, 50.0), (83.5, 51.0), (81.5, 50.8), (80.0, 50.8), (79.0, 52.5), (77.9, 53.3), (76.5, 54.1),
+            (73.5, 54.0), (71.0, 54.2), (69.0, 55.4), (65.0, 54.6), (61.3, 54.0), (61.0, 52.5), (60.0, 51.9), (58.5, 50.9),
+            (55.0, 50.6), (53.5, 51.5), (52.0, 51.9), (50.8, 51.6), (48.5, 50.5), (47.5, 50.4), (46.6, 48.5), (47.0, 47.8),
+            (48.8, 46.0), (50.5, 44.0), (51.5, 41.0), (52.5, 39.0), (53.9, 37.3), (54.7, 37.45), (57.0, 38.2), (59.5, 37.5),
+            (60.5, 36.6), (61.2, 36.6), (61.2, 35.6), (60.6, 33.5), (60.9, 31.5), (61.8, 31.3),
+        ]
+        + IRAN_PAKISTAN_BORDER
+        + [(65.0, 10.0), (65.0, -40.0)]
+    ],
+    # Chukotka, across the antimeridian
+    [[(-180.0, 62.0), (-172.4, 64.0), (-169.5, 65.7), (-169.0, 66.5), (-169.0, 72.0), (-180.0, 72.0)]],
+]
+
+APAC_RINGS: List[List[Ring]] = [
+    # Asia and Oceania, without Guam and the Northern Mariana Islands
+    [
+        IRAN_PAKISTAN_BORDER[::-1]
+        + [
+            (62.5, 29.4), (64.0, 29.5), (66.3, 29.9), (66.5, 31.0), (68.0, 31.7), (69.3, 31.9), (69.5, 33.0), (70.0, 33.7),
+            (71.1, 34.0), (71.6, 35.0), (71.4, 36.0), (73.0, 36.9), (74.5, 37.0), (74.9, 37.2), (75.0, 38.5), (73.7, 39.5),
+            (74.0, 40.0), (76.5, 40.4), (78.0, 41.0), (80.2, 42.0), (80.2, 42.2), (80.5, 44.9), (82.5, 45.3), (83.0, 47.2),
+            (85.5, 47.1),
+        ]
+        + RUSSIA_CHINA_MONGOLIA_BORDER[::-1]
+        + [
+            (131.0, 41.9), (139.0, 44.3), (140.5, 45.5), (141.9, 45.55), (145.0, 44.3), (146.0, 43.3), (147.0, 40.0), (150.0, 25.0),
+            (160.0, 20.0), (172.0, 15.0), (172.0, 5.0), (180.0, -10.0), (180.0, -53.0), (165.0, -53.0), (110.0, -45.0),
+            (90.0, -15.0), (80.0, -5.0), (70.0, -1.5), (65.0, 10.0),
+        ],
+        [(144.4, 13.0), (146.2, 13.0), (146.2, 20.7), (144.4, 20.7)],
+    ],
+    # Fiji, Tonga and Samoa east of the antimeridian
+    [[(-180.0, -23.0), (-171.5, -23.0), (-171.5, -12.5), (-180.0, -12.5)]],
+]
+
+REGION_RINGS: Dict[str, List[List[Ring]]] = {
+    UNITED_STATES: UNITED_STATES_RINGS,
+    NORTH_AMERICA: NORTH_AMERICA_RINGS,
+    CENTRAL_AMERICA: CENTRAL_AMERICA_RINGS,
+    SOUTH_AMERICA: SOUTH_AMERICA_RINGS,
+    EMEA: EMEA_RINGS,
+    APAC: APAC_RINGS,
+}
+
+
+def _edges(rings: Sequence[Ring]) -> np.ndarray:
+    """Stack the closed edges of all rings of a polygon as rows of (x1, y1, x2, y2)."""
+    edges = []
+    for ring in rings:
+        vertices = np.asarray(ring, dtype=np.float64)
+        edges.append(np.hstack([vertices, np.roll(vertices, -1, axis=0)]))
+    return np.vstack(edges)
+
+
+def points_in_polygon(longitudes: np.ndarray, latitudes: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Even-odd ray-casting test of many points against one polygon (holes included).
+
+    Args:
+        longitudes (np.ndarray): Point x coordinates.
+        latitudes (np.ndarray): Point y coordinates.
+        edges (np.ndarray): Polygon edges as rows of (x1, y1, x2, y2).
+
+    Returns:
+        np.ndarray: Boolean mask of the points inside the polygon.
+    """
+    x1, y1, x2, y2 = (edges[:, column] for column in range(4))
+    px, py = longitudes[:, None], latitudes[:, None]
+    straddles = (y1 > py) != (y2 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    crossings = straddles & (px < crossing_x)
+    return (np.count_nonzero(crossings, axis=1) % 2) == 1
+
+
+def distance_to_edges(longitudes: np.ndarray, latitudes: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """
+    Planar distance (in degrees) from each point to the closest polygon edge.
+
+    Args:
+        longitudes (np.ndarray): Point x coordinates.
+        latitudes (np.ndarray): Point y coordinates.
+        edges (np.ndarray): Polygon edges as rows of (x1, y1, x2, y2).
+
+    Returns:
+        np.ndarray: The distance of every point.
+    """
+    x1, y1, x2, y2 = (edges[:, column] for column in range(4))
+    dx, dy = x2 - x1, y2 - y1
+    length_squared = np.where(dx * dx + dy * dy == 0, 1.0, dx * dx + dy * dy)
+    px, py = longitudes[:, None], latitudes[:, None]
+    t = np.clip(((px - x1) * dx + (py - y1) * dy) / length_squared, 0.0, 1.0)
+    return np.hypot(px - (x1 + t * dx), py - (y1 + t * dy)).min(axis=1)
+
+
+class RegionPolygons:
+    """Vectorized point-in-region classifier with hit/miss counters."""
+
+    def __init__(self, region_rings: Optional[Dict[str, List[List[Ring]]]] = None, border_margin: float = DEFAULT_BORDER_MARGIN):
+        """
+        Prepare the polygons for testing.
+
+        Args:
+            region_rings (Optional[Dict[str, List[List[Ring]]]], optional): Region -> polygons, each a list
+                of (longitude, latitude) rings: the outer boundary followed by any holes. Defaults to the
+                bundled REGION_RINGS.
+            border_margin (float, optional): Points closer than this (in degrees) to the boundary of their
+                region are left unresolved. Use 0 for exact boundary data.
+        """
+        self.border_margin = border_margin
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._polygons: List[Tuple[str, np.ndarray, np.ndarray]] = []
+        for region, polygons in (region_rings or REGION_RINGS).items():
+            for rings in polygons:
+                outer = np.asarray(rings[0], dtype=np.float64)
+                bbox = np.concatenate([outer.min(axis=0), outer.max(axis=0)])
+                self._polygons.append((region, bbox, _edges(rings)))
+
+    @classmethod
+    def from_geojson(cls, path: str, region_property: Optional[str] = None, border_margin: float = 0.0) -> "RegionPolygons":
+        """
+        Load boundaries from a GeoJSON FeatureCollection of Polygon / MultiPolygon features.
+
+        Args:
+            path (str): Path to the GeoJSON file.
+            region_property (Optional[str], optional): Feature property holding the region label. If omitted,
+                the country name in the "ADMIN", "NAME" or "name" property is mapped through region_rules.
+            border_margin (float, optional): See __init__.
+
+        Returns:
+            RegionPolygons: The classifier. Features without a known region are skipped.
+        """
+        with open(path, encoding="utf-8") as geojson_file:
+            features = json.load(geojson_file)["features"]
+
+        region_rings: Dict[str, List[List[Ring]]] = {}
+        for feature in features:
+            properties = feature.get("properties") or {}
+            if region_property:
+                region = properties.get(region_property)
+            else:
+                country = next((properties[key] for key in ("ADMIN", "NAME", "name") if properties.get(key)), "")
+                region = resolve_country(country)
+            geometry = feature.get("geometry") or {}
+            if region is None or geometry.get("type") not in ("Polygon", "MultiPolygon"):
+                continue
+            polygons = [geometry["coordinates"]] if geometry["type"] == "Polygon" else geometry["coordinates"]
+            for polygon in polygons:
+                region_rings.setdefault(region, []).append([[tuple(point[:2]) for point in ring] for ring in polygon])
+        return cls(region_rings, border_margin=border_margin)
+
+    def classify(self, latitudes: Iterable, longitudes: Iterable) -> List[Optional[str]]:
+        """
+        Classify a column of coordinates.
+
+        Args:
+            latitudes (Iterable): Latitudes (None / NaN for rows without coordinates).
+            longitudes (Iterable): Longitudes, aligned with latitudes.
+
+        Returns:
+            List[Optional[str]]: The region of every point, or None when it is missing, outside the bundled
+            regions or too close to a boundary.
+        """
+        latitudes = np.asarray(list(latitudes), dtype=np.float64)
+        longitudes = np.asarray(list(longitudes), dtype=np.float64)
+        regions = np.full(len(latitudes), None, dtype=object)
+        unresolved = np.isfinite(latitudes) & np.isfinite(longitudes) & (np.abs(latitudes) <= 90) & (np.abs(longitudes) <= 180)
+
+        for region, (min_x, min_y, max_x, max_y), edges in self._polygons:
+            candidates = np.flatnonzero(
+                unresolved & (longitudes >= min_x) & (longitudes <= max_x) & (latitudes >= min_y) & (latitudes <= max_y)
+            )
+            for start in range(0, len(candidates), CHUNK_SIZE):
+                chunk = candidates[start : start + CHUNK_SIZE]
+                inside = chunk[points_in_polygon(longitudes[chunk], latitudes[chunk], edges)]
+                if not len(inside):
+                    continue
+                # Points are inside at most one region, so they are settled even when too close to call
+                unresolved[inside] = False
+                if self.border_margin > 0:
+                    inside = inside[distance_to_edges(longitudes[inside], latitudes[inside], edges) >= self.border_margin]
+                regions[inside] = region
+
+        labels = regions.tolist()
+        resolved = sum(label is not None for label in labels)
+        with self._lock:
+            self.hits += resolved
+            self.misses += len(labels) - resolved
+        return labels
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        """Human readable summary of how many coordinates were classified."""
+        total = self.hits + self.misses
+        return f"Coordinate classifier resolved {self.hits}/{total} locations ({self.hit_rate:.1%}) without an LLM call"
@@ -0,0 +1,524 @@
+"""
+Deterministic region pre-classifier for postal addresses.
+
+Resolves the region of an address from a built-in gazetteer of country names, ISO codes,
+US state / Canadian province abbreviations and postal-code formats, so that only the
+ambiguous addresses have to be sent to the LLM. The categories match the ones used by
+location_selector.classify_location.
+"""
+
+import re
+import threading
+from typing import Dict, Optional
+
+UNITED_STATES = "United States"
+NORTH_AMERICA = "North America"
+CENTRAL_AMERICA = "Central America"
+SOUTH_AMERICA = "South America"
+EMEA = "EMEA"
+APAC = "APAC"
+VIRTUAL = "Virtual"
+
+# Country name -> region. Names are stored normalized (lowercase, no punctuation).
+COUNTRY_REGIONS: Dict[str, str] = {
+    # United States
+    "united states": UNITED_STATES,
+    "united states of america": UNITED_STATES,
+    "usa": UNITED_STATES,
+    "us": UNITED_STATES,
+    "u s": UNITED_STATES,
+    "u s a": UNITED_STATES,
+    # North America (excluding the United States)
+    "canada": NORTH_AMERICA,
+    "mexico": NORTH_AMERICA,
+    "méxico": NORTH_AMERICA,
+    # Central America
+    "belize": CENTRAL_AMERICA,
+    "costa rica": CENTRAL_AMERICA,
+    "el salvador": CENTRAL_AMERICA,
+    "guatemala": CENTRAL_AMERICA,
+    "honduras": CENTRAL_AMERICA,
+    "nicaragua": CENTRAL_AMERICA,
+    "panama": CENTRAL_AMERICA,
+    "panamá": CENTRAL_AMERICA,
+    # South America
+    "argentina": SOUTH_AMERICA,
+    "bolivia": SOUTH_AMERICA,
+    "brazil": SOUTH_AMERICA,
+    "brasil": SOUTH_AMERICA,
+    "chile": SOUTH_AMERICA,
+    "colombia": SOUTH_AMERICA,
+    "ecuador": SOUTH_AMERICA,
+    "guyana": SOUTH_AMERICA,
+    "paraguay": SOUTH_AMERICA,
+    "peru": SOUTH_AMERICA,
+    "perú": SOUTH_AMERICA,
+    "suriname": SOUTH_AMERICA,
+    "uruguay": SOUTH_AMERICA,
+    "venezuela": SOUTH_AMERICA,
+    # EMEA - Europe
+    "albania": EMEA,
+    "andorra": EMEA,
+    "austria": EMEA,
+    "österreich": EMEA,
+    "belarus": EMEA,
+    "belgium": EMEA,
+    "belgique": EMEA,
+    "belgië": EMEA,
+    "bosnia and herzegovina": EMEA,
+    "bulgaria": EMEA,
+    "croatia": EMEA,
+    "cyprus": EMEA,
+    "czech republic": EMEA,
+    "czechia": EMEA,
+    "denmark": EMEA,
+    "danmark": EMEA,
+    "england": EMEA,
+    "estonia": EMEA,
+    "finland": EMEA,
+    "france": EMEA,
+    "germany": EMEA,
+    "deutschland": EMEA,
+    "greece": EMEA,
+    "hungary": EMEA,
+    "iceland": EMEA,
+    "ireland": EMEA,
+    "italy": EMEA,
+    "italia": EMEA,
+    "kosovo": EMEA,
+    "latvia": EMEA,
+    "liechtenstein": EMEA,
+    "lithuania": EMEA,
+    "luxembourg": EMEA,
+    "malta": EMEA,
+    "moldova": EMEA,
+    "monaco": EMEA,
+    "montenegro": EMEA,
+    "netherlands": EMEA,
+    "the netherlands": EMEA,
+    "nederland": EMEA,
+    "north macedonia": EMEA,
+    "northern ireland": EMEA,
+    "norway": EMEA,
+    "norge": EMEA,
+    "poland": EMEA,
+    "polska": EMEA,
+    "portugal": EMEA,
+    "romania": EMEA,
+    "russia": EMEA,
+    "russian federation": EMEA,
+    "san marino": EMEA,
+    "scotland": EMEA,
+    "serbia": EMEA,
+    "slovakia": EMEA,
+    "slovenia": EMEA,
+    "spain": EMEA,
+    "españa": EMEA,
+    "sweden": EMEA,
+    "sverige": EMEA,
+    "switzerland": EMEA,
+    "schweiz": EMEA,
+    "suisse": EMEA,
+    "ukraine": EMEA,
+    "united kingdom": EMEA,
+    "great britain": EMEA,
+    "uk": EMEA,
+    "u k": EMEA,
+    "wales": EMEA,
+    # EMEA - Middle East
+    "bahrain": EMEA,
+    "iran": EMEA,
+    "iraq": EMEA,
+    "israel": EMEA,
+    "jordan": EMEA,
+    "kuwait": EMEA,
+    "lebanon": EMEA,
+    "oman": EMEA,
+    "qatar": EMEA,
+    "saudi arabia": EMEA,
+    "syria": EMEA,
+    "turkey": EMEA,
+    "türkiye": EMEA,
+    "turkiye": EMEA,
+    "uae": EMEA,
+    "united arab emirates": EMEA,
+    "yemen": EMEA,
+    # EMEA - Africa
+    "algeria": EMEA,
+    "angola": EMEA,
+    "botswana": EMEA,
+    "cameroon": EMEA,
+    "egypt": EMEA,
+    "ethiopia": EMEA,
+    "ghana": EMEA,
+    "ivory coast": EMEA,
+    "côte d'ivoire": EMEA,
+    "kenya": EMEA,
+    "madagascar": EMEA,
+    "mauritius": EMEA,
+    "morocco": EMEA,
+    "mozambique": EMEA,
+    "namibia": EMEA,
+    "nigeria": EMEA,
+    "rwanda": EMEA,
+    "senegal": EMEA,
+    "south africa": EMEA,
+    "tanzania": EMEA,
+    "tunisia": EMEA,
+    "uganda": EMEA,
+    "zambia": EMEA,
+    "zimbabwe": EMEA,
+    # APAC
+    "australia": APAC,
+    "bangladesh": APAC,
+    "cambodia": APAC,
+    "china": APAC,
+    "people's republic of china": APAC,
+    "prc": APAC,
+    "fiji": APAC,
+    "hong kong": APAC,
+    "hong kong sar": APAC,
+    "india": APAC,
+    "indonesia": APAC,
+    "japan": APAC,
+    "korea": APAC,
+    "south korea": APAC,
+    "republic of korea": APAC,
+    "laos": APAC,
+    "macau": APAC,
+    "macao": APAC,
+    "malaysia": APAC,
+    "maldives": APAC,
+    "mongolia": APAC,
+    "myanmar": APAC,
+    "nepal": APAC,
+    "new zealand": APAC,
+    "pakistan": APAC,
+    "papua new guinea": APAC,
+    "philippines": APAC,
+    "singapore": APAC,
+    "sri lanka": APAC,
+    "taiwan": APAC,
+    "thailand": APAC,
+    "vietnam": APAC,
+    "viet nam": APAC,
+}
+
+# ISO 3166-1 alpha-3 codes are unambiguous, so they are accepted as a trailing component on their own.
+ISO3_REGIONS: Dict[str, str] = {
+    "usa": UNITED_STATES,
+    "can": NORTH_AMERICA,
+    "mex": NORTH_AMERICA,
+    "blz": CENTRAL_AMERICA,
+    "cri": CENTRAL_AMERICA,
+    "slv": CENTRAL_AMERICA,
+    "gtm": CENTRAL_AMERICA,
+    "hnd": CENTRAL_AMERICA,
+    "nic": CENTRAL_AMERICA,
+    "pan": CENTRAL_AMERICA,
+    "arg": SOUTH_AMERICA,
+    "bol": SOUTH_AMERICA,
+    "bra": SOUTH_AMERICA,
+    "chl": SOUTH_AMERICA,
+    "col": SOUTH_AMERICA,
+    "ecu": SOUTH_AMERICA,
+    "per": SOUTH_AMERICA,
+    "pry": SOUTH_AMERICA,
+    "ury": SOUTH_AMERICA,
+    "ven": SOUTH_AMERICA,
+    "aut": EMEA,
+    "bel": EMEA,
+    "che": EMEA,
+    "cze": EMEA,
+    "deu": EMEA,
+    "dnk": EMEA,
+    "esp": EMEA,
+    "fin": EMEA,
+    "fra": EMEA,
+    "gbr": EMEA,
+    "grc": EMEA,
+    "hun": EMEA,
+    "irl": EMEA,
+    "isr": EMEA,
+    "ita": EMEA,
+    "nld": EMEA,
+    "nor": EMEA,
+    "pol": EMEA,
+    "prt": EMEA,
+    "rou": EMEA,
+    "sau": EMEA,
+    "swe": EMEA,
+    "tur": EMEA,
+    "are": EMEA,
+    "zaf": EMEA,
+    "aus": APAC,
+    "chn": APAC,
+    "hkg": APAC,
+    "idn": APAC,
+    "ind": APAC,
+    "jpn": APAC,
+    "kor": APAC,
+    "mys": APAC,
+    "nzl": APAC,
+    "phl": APAC,
+    "sgp": APAC,
+    "tha": APAC,
+    "twn": APAC,
+    "vnm": APAC,
+}
+
+# ISO 3166-1 alpha-2 codes. Codes that collide with a US state or Canadian province abbreviation
+# (e.g. "CA", "DE", "IN", "PE") are deliberately left out - those are only resolved together with a postal code.
+ISO2_REGIONS: Dict[str, str] = {
+    "mx": NORTH_AMERICA,
+    "bz": CENTRAL_AMERICA,
+    "cr": CENTRAL_AMERICA,
+    "sv": CENTRAL_AMERICA,
+    "gt": CENTRAL_AMERICA,
+    "hn": CENTRAL_AMERICA,
+    "ni": CENTRAL_AMERICA,
+    "br": SOUTH_AMERICA,
+    "cl": SOUTH_AMERICA,
+    "ec": SOUTH_AMERICA,
+    "py": SOUTH_AMERICA,
+    "uy": SOUTH_AMERICA,
+    "ve": SOUTH_AMERICA,
+    "at": EMEA,
+    "be": EMEA,
+    "ch": EMEA,
+    "cz": EMEA,
+    "dk": EMEA,
+    "es": EMEA,
+    "fi": EMEA,
+    "fr": EMEA,
+    "gb": EMEA,
+    "gr": EMEA,
+    "hu": EMEA,
+    "ie": EMEA,
+    "it": EMEA,
+    "pl": EMEA,
+    "pt": EMEA,
+    "ro": EMEA,
+    "se": EMEA,
+    "tr": EMEA,
+    "ae": EMEA,
+    "za": EMEA,
+    "au": APAC,
+    "cn": APAC,
+    "hk": APAC,
+    "jp": APAC,
+    "kr": APAC,
+    "nz": APAC,
+    "ph": APAC,
+    "sg": APAC,
+    "th": APAC,
+    "tw": APAC,
+    "vn": APAC,
+}
+
+US_STATES: Dict[str, str] = {
+    "al": "alabama",
+    "ak": "alaska",
+    "az": "arizona",
+    "ar": "arkansas",
+    "ca": "california",
+    "co": "colorado",
+    "ct": "connecticut",
+    "de": "delaware",
+    "dc": "district of columbia",
+    "fl": "florida",
+    "ga": "georgia",
+    "hi": "hawaii",
+    "id": "idaho",
+    "il": "illinois",
+    "in": "indiana",
+    "ia": "iowa",
+    "ks": "kansas",
+    "ky": "kentucky",
+    "la": "louisiana",
+    "me": "maine",
+    "md": "maryland",
+    "ma": "massachusetts",
+    "mi": "michigan",
+    "mn": "minnesota",
+    "ms": "mississippi",
+    "mo": "missouri",
+    "mt": "montana",
+    "ne": "nebraska",
+    "nv": "nevada",
+    "nh": "new hampshire",
+    "nj": "new jersey",
+    "nm": "new mexico",
+    "ny": "new york",
+    "nc": "north carolina",
+    "nd": "north dakota",
+    "oh": "ohio",
+    "ok": "oklahoma",
+    "or": "oregon",
+    "pa": "pennsylvania",
+    "ri": "rhode island",
+    "sc": "south carolina",
+    "sd": "south dakota",
+    "tn": "tennessee",
+    "tx": "texas",
+    "ut": "utah",
+    "vt": "vermont",
+    "va": "virginia",
+    "wa": "washington",
+    "wv": "west virginia",
+    "wi": "wisconsin",
+    "wy": "wyoming",
+}
+
+# Full state names that are not also the name of a well known city or country.
+US_STATE_NAMES = {name for name in US_STATES.values() if name not in {"new york", "washington", "georgia", "district of columbia"}}
+
+CA_PROVINCES = {"ab", "bc", "mb", "nb", "nl", "ns", "nt", "nu", "on", "pe", "qc", "sk", "yt"}
+
+VIRTUAL_ADDRESSES = {"remote", "virtual", "virtual office", "work from home", "wfh", "home office"}
+VIRTUAL_KEYWORDS = ("virtual office", "remote office", "remote worker")
+
+# Postal code formats that identify a country on their own.
+US_STATE_ZIP = re.compile(r"\b([a-z]{2})\s+\d{5}(?:-\d{4})?$")
+CA_PROVINCE_POSTAL = re.compile(r"\b([a-z]{2})\s+[a-z]\d[a-z]\s?\d[a-z]\d$")
+CA_POSTAL = re.compile(r"^[a-z]\d[a-z]\s?\d[a-z]\d$")
+UK_POSTCODE = re.compile(r"(?:^|\s)(?:gir\s?0aa|[a-z]{1,2}\d[a-z\d]?\s?\d[a-z]{2})$")
+
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(component: str) -> str:
+    """Lowercase a component and collapse punctuation and whitespace."""
+    component = _PUNCTUATION.sub(" ", component.casefold())
+    return _WHITESPACE.sub(" ", component).strip()
+
+
+def resolve_country(country: Optional[str]) -> Optional[str]:
+    """
+    Map a country name to its region.
+
+    Args:
+        country (Optional[str]): The country name, in any casing or punctuation.
+
+    Returns:
+        Optional[str]: The region, or None if the country is not in the gazetteer.
+    """
+    return COUNTRY_REGIONS.get(_normalize(country)) if country else None
+
+
+def _resolve_component(component: str) -> Optional[str]:
+    """
+    Resolve a single normalized address component to a region.
+
+    Args:
+        component (str): A normalized, comma-separated address component.
+
+    Returns:
+        Optional[str]: The region, or None if the component is not conclusive.
+    """
+    if not component:
+        return None
+
+    if component in COUNTRY_REGIONS:
+        return COUNTRY_REGIONS[component]
+    if component in ISO3_REGIONS:
+        return ISO3_REGIONS[component]
+    if component in ISO2_REGIONS:
+        return ISO2_REGIONS[component]
+
+    state_zip = US_STATE_ZIP.search(component)
+    if state_zip and state_zip.group(1) in US_STATES:
+        return UNITED_STATES
+
+    province_postal = CA_PROVINCE_POSTAL.search(component)
+    if province_postal and province_postal.group(1) in CA_PROVINCES:
+        return NORTH_AMERICA
+    if CA_POSTAL.match(component):
+        return NORTH_AMERICA
+
+    if UK_POSTCODE.search(component):
+        return EMEA
+
+    # "Texas 78701" or "California"
+    words = component.split(" ")
+    if words[-1].isdigit() and len(words[-1]) == 5:
+        words = words[:-1]
+    if " ".join(words) in US_STATE_NAMES:
+        return UNITED_STATES
+
+    return None
+
+
+def resolve_region(full_address: Optional[str]) -> Optional[str]:
+    """
+    Resolve the region of an address without calling a model.
+
+    Only the trailing components of the address are inspected (country, then state/postal code),
+    so a street or company name that happens to contain a country name does not trigger a match.
+
+    Args:
+        full_address (Optional[str]): The full postal address of the location.
+
+    Returns:
+        Optional[str]: The region if it can be resolved with high confidence, None otherwise.
+    """
+    if not full_address:
+        return None
+
+    normalized_address = _normalize(full_address)
+    if not normalized_address or normalized_address in {"n a", "nan", "none"}:
+        return None
+
+    if normalized_address in VIRTUAL_ADDRESSES or any(keyword in normalized_address for keyword in VIRTUAL_KEYWORDS):
+        return VIRTUAL
+
+    components = [_normalize(component) for component in full_address.split(",")]
+    components = [component for component in components if component]
+    if not components:
+        return None
+
+    # The country is almost always the last component; fall back to the one before it for
+    # addresses that end with a postal code or a state abbreviation ("Austin, TX 78701").
+    region = _resolve_component(components[-1])
+    if region is None and len(components) > 1 and components[-1].isdigit():
+        region = _resolve_component(f"{components[-2]} {components[-1]}")
+    return region
+
+
+class RegionResolver:
+    """Thread-safe wrapper around resolve_region that keeps hit/miss counters."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def resolve(self, full_address: Optional[str]) -> Optional[str]:
+        """
+        Resolve the region of an address and record whether it was a hit.
+
+        Args:
+            full_address (Optional[str]): The full postal address of the location.
+
+        Returns:
+            Optional[str]: The region, or None if the address needs to go to the model.
+        """
+        region = resolve_region(full_address)
+        with self._lock:
+            if region is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return region
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of addresses resolved without a model call."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        """Human readable summary of the resolver's hit rate."""
+        total = self.hits + self.misses
+        return f"Rule engine resolved {self.hits}/{total} addresses ({self.hit_rate:.1%}) without an LLM call"
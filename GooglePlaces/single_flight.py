@@ -0,0 +1,59 @@
+"""
+Coalescing of identical concurrent calls ("single flight").
+
+While a call for a key is in flight, further calls for the same key do not start their own; they
+wait for the first one and share its result (or its exception). Once the call finishes the key is
+forgotten, so this only removes duplicate work that overlaps in time; a cache is what serves
+repeats after that.
+
+AsyncSingleFlight coalesces calls made by tasks on one event loop.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class AsyncSingleFlight:
+    """Single flight for coroutines running on one event loop."""
+
+    def __init__(self, name: str = "Single flight"):
+        """
+        Args:
+            name (str, optional): Label used in report().
+        """
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Await fn(*args, **kwargs), or wait for the call already running for key.
+
+        Args:
+            key (Hashable): Identifies calls that are interchangeable.
+            fn (Callable[..., Awaitable[Any]]): Coroutine function to call.
+
+        Returns:
+            Any: The result of the (possibly shared) call; its exception is raised in every caller.
+        """
+        self.calls += 1
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.shared += 1
+            # Shielded so one waiter being cancelled does not cancel the call for the others
+            return await asyncio.shield(future)
+
+        future = self._in_flight[key] = asyncio.ensure_future(fn(*args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                del self._in_flight[key]
+            else:
+                # The leader was cancelled; forget the call once it finishes for the remaining waiters
+                future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+    def report(self) -> str:
+        """Human readable summary of the calls coalesced so far."""
+        return f"{self.name}: {self.calls} calls, {self.shared} served by an identical call already in flight"
@@ -0,0 +1,42 @@
+"""
+Streaming execution of per-row work with a bounded in-flight window.
+
+Rows are pulled from the input lazily and only as finished ones are handed to the consumer: the
+window is refilled before the finished results are yielded, so at most `max_in_flight` rows are
+being processed plus the batch that just finished and is waiting for the consumer. When the
+consumer (usually the CSV writer) is slow, reading stops too, so memory stays flat however large
+the input file is. An exception raised for one item ends the whole run, so callers catch per-row
+errors inside the work function.
+
+bounded_as_completed runs a coroutine function as tasks on the event loop.
+"""
+
+import asyncio
+import itertools
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable
+
+
+async def bounded_as_completed(fn: Callable[[Any], Awaitable[Any]], items: Iterable[Any], max_in_flight: int) -> AsyncIterator[Any]:
+    """
+    Run fn for every item as tasks on the running event loop, yielding results as they complete.
+
+    Args:
+        fn (Callable[[Any], Awaitable[Any]]): Coroutine function doing the work for one item.
+        items (Iterable[Any]): The items; consumed lazily.
+        max_in_flight (int): Most items running at once; up to max_in_flight more may be finished and
+            waiting to be yielded, since the window is refilled before they are handed over.
+
+    Yields:
+        Any: The result of fn(item) for every item, in completion order. An exception raised by fn is raised here.
+    """
+    items = iter(items)
+    pending = {asyncio.ensure_future(fn(item)) for item in itertools.islice(items, max_in_flight)}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.update(asyncio.ensure_future(fn(item)) for item in itertools.islice(items, len(done)))
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,101 @@
+"""
+Token counting and token-budget-aware batch planning.
+
+Batches are packed with as many rows as fit in the model's context and output budget, based on
+tiktoken counts of each row's input text and an estimate of the answer it will produce, instead of
+a fixed number of rows per request.
+"""
+
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import tiktoken
+
+DEFAULT_CONTEXT_TOKENS = 16000
+DEFAULT_MAX_OUTPUT_TOKENS = 4000
+# Output estimates are rough, so only this fraction of the output budget is planned for
+DEFAULT_OUTPUT_SAFETY = 0.8
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: Optional[str] = None) -> tiktoken.Encoding:
+    """
+    Return the tokenizer of a model, falling back to cl100k_base for models tiktoken does not know.
+
+    Args:
+        model (Optional[str]): The model name.
+
+    Returns:
+        tiktoken.Encoding: The encoding to count tokens with.
+    """
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count the tokens of a text.
+
+    Args:
+        text (str): The text to count.
+        model (Optional[str]): The model whose tokenizer to use.
+
+    Returns:
+        int: The number of tokens.
+    """
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def plan_batches(
+    input_tokens: Sequence[int],
+    output_tokens: Sequence[int],
+    prompt_tokens: int,
+    context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    max_output_tokens: int = DEFAULT_MAX_OUTPUT_TOKENS,
+    output_safety: float = DEFAULT_OUTPUT_SAFETY,
+    max_rows: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """
+    Split rows into contiguous batches that fit the context and output budget.
+
+    A batch is closed when adding the next row would push the prompt past the input budget
+    (context_tokens - max_output_tokens - prompt_tokens) or the estimated answer past
+    output_safety * max_output_tokens. A single row that exceeds the budget gets a batch of its own.
+    The plan only depends on the inputs, so the same file always produces the same batches.
+
+    Args:
+        input_tokens (Sequence[int]): Prompt tokens contributed by each row.
+        output_tokens (Sequence[int]): Estimated answer tokens for each row.
+        prompt_tokens (int): Fixed tokens of the prompt template (instructions, examples, system message).
+        context_tokens (int, optional): The model's context window.
+        max_output_tokens (int, optional): Maximum answer tokens per request.
+        output_safety (float, optional): Fraction of max_output_tokens to plan for.
+        max_rows (Optional[int], optional): Optional cap on rows per batch.
+
+    Returns:
+        List[Tuple[int, int]]: (start, end) row ranges, end exclusive.
+    """
+    input_budget = context_tokens - max_output_tokens - prompt_tokens
+    output_budget = max_output_tokens * output_safety
+    if input_budget <= 0:
+        raise ValueError(f"The prompt template ({prompt_tokens} tokens) does not fit the context budget")
+
+    batches = []
+    start = 0
+    batch_input = batch_output = 0
+    for row, (row_input, row_output) in enumerate(zip(input_tokens, output_tokens)):
+        batch_full = max_rows is not None and row - start >= max_rows
+        over_budget = batch_input + row_input > input_budget or batch_output + row_output > output_budget
+        if row > start and (batch_full or over_budget):
+            batches.append((start, row))
+            start = row
+            batch_input = batch_output = 0
+        batch_input += row_input
+        batch_output += row_output
+    if start < len(input_tokens):
+        batches.append((start, len(input_tokens)))
+    return batches
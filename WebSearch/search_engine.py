@@ -1,9 +1,13 @@
+import os
+import sys
 import requests
 from time import sleep
 from typing import List, Dict, Any
-from bs4 import BeautifulSoup
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "GooglePlaces"))
+from page_parser import parse_page
+
 def get_search_results(query: str, api_key: str, num_results: int = 5) -> List[Dict[str, Any]]:
     headers = {"Accept": "application/json", "X-Subscription-Token": api_key}
     response = requests.get(
@@ -25,10 +29,8 @@ def get_page_content(url: str) -> str:
         }
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract text from the page
-        text = soup.get_text(separator='\n', strip=True)
+        # Extract the visible text in one lxml pass, without building a tree
+        text = parse_page(response.content).text
         
         # Limit the text to a reasonable length (e.g., 1000 words)
         words = text.split()
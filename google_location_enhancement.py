@@ -1,75 +1,65 @@
-import requests
+import asyncio
+import httpx
 import pandas as pd
 import os
-import time
+import sys
 from tqdm import tqdm
 
 from config import GOOGLE_API_KEY
 
-# Base URL for the Google Places API (using Text Search)
-PLACES_API_BASE_URL = "https://maps.googleapis.com/maps/api/place/textsearch/json"
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "GooglePlaces"))
+from address_normalization import AddressGroups
+from places_cache import PlacesCache
+from places_client import GEOCODE_FIELDS, PlacesClient
+from rate_limiting import TokenBucket
+from region_geometry import RegionPolygons
+
+# Requests per second across all lookups; set it to the project's Places quota
+PLACES_QPS = float(os.environ.get("PLACES_QPS", 10))
+# Lookups in flight at once; enough to keep PLACES_QPS busy while individual requests are in flight
+MAX_CONCURRENCY = int(os.environ.get("PLACES_CONCURRENCY", 100))
+REQUEST_TIMEOUT = 30
+
+# Shared by every lookup: one pacing budget and one lookup cache
+rate_limiter = TokenBucket(PLACES_QPS)
+places_cache = PlacesCache()
+
+# Labels geocoded rows with their region offline, without an LLM call
+region_polygons = RegionPolygons()
 
 
 # --- Function to get Place Details from the Places API ---
-def get_place_details(address):
+async def get_place_details(places_client, address):
     """
-    Fetches place details from the Google Places API using the Text Search endpoint.
+    Fetches place details from the Google Places API with a single field-masked Text Search request.
 
     Args:
+        places_client (PlacesClient): The client to look the address up with.
         address (str): The full postal address to search for.
 
     Returns:
         dict: A dictionary containing place details, or None if an error occurs.
     """
 
-    params = {
-        "query": address,
-        "key": GOOGLE_API_KEY,
-    }
-
     try:
-        response = requests.get(PLACES_API_BASE_URL, params=params)
-        response.raise_for_status()  # Raise an exception for bad status codes
-
-        data = response.json()
-
-        if data["status"] == "OK" and data["results"]:
-            # Extract relevant details (customize as needed)
-            place = data["results"][0]  # Get the first result (usually the most relevant)
-            place_id = place.get("place_id")
-            formatted_address = place.get("formatted_address")
-            location_type = place.get("types", [])  # Get the place types
-            rating = place.get("rating")
-            user_ratings_total = place.get("user_ratings_total")
-
-            # Get latitude and longitude
-            location = place.get("geometry", {}).get("location", {})
-            latitude = location.get("lat")
-            longitude = location.get("lng")
-
-            # You can add more fields here if needed.
-
-            return {
-                "place_id": place_id,
-                "formatted_address": formatted_address,
-                "location_type": location_type,
-                "rating": rating,
-                "user_ratings_total": user_ratings_total,
-                "latitude": latitude,
-                "longitude": longitude,
-            }
-
-        elif data["status"] == "ZERO_RESULTS":
-            print(f"No results found for address: {address}")
-            return None
+        place = await places_client.search_text(address, GEOCODE_FIELDS)
 
-        else:
-            print(f"Error for address: {address}. Status: {data['status']}")
-            if "error_message" in data:
-                print(f"Error message: {data['error_message']}")
+        if place is None:
+            print(f"No results found for address: {address}")
             return None
 
-    except requests.exceptions.RequestException as e:
+        location = place.get("location", {})
+        return {
+            "place_id": place.get("id"),
+            "formatted_address": place.get("formattedAddress"),
+            "location_type": place.get("types", []),
+            "rating": place.get("rating"),
+            "user_ratings_total": place.get("userRatingCount"),
+            "latitude": location.get("latitude"),
+            "longitude": location.get("longitude"),
+        }
+
+    except httpx.HTTPError as e:
         print(f"Request error for address: {address}: {e}")
         return None
 
@@ -78,11 +68,35 @@ def get_place_details(address):
         return None
 
 
+async def get_all_place_details(addresses):
+    """
+    Fetches place details for many addresses concurrently on one event loop.
+
+    Args:
+        addresses (list): The addresses to search for; empty ones are skipped.
+
+    Returns:
+        list: The place details of each address (None where there are none), in input order.
+    """
+    async with PlacesClient(
+        GOOGLE_API_KEY, max_concurrency=MAX_CONCURRENCY, rate_limiter=rate_limiter, timeout=REQUEST_TIMEOUT, cache=places_cache
+    ) as places_client:
+        tasks = [asyncio.create_task(get_place_details(places_client, address)) for address in addresses if address]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing addresses"):
+            await task
+        print(places_client.report())
+    results = iter([task.result() for task in tasks])
+    return [next(results) if address else None for address in addresses]
+
+
 # --- Main script ---
 def main():
     """
     Reads a CSV file with location IDs and addresses, fetches place details from the Google Places API,
     and saves the appended data to a new CSV file.
+
+    Rows are grouped by canonical address first, so each unique address is looked up once, and every
+    geocoded row is labelled with its region from its coordinates.
     """
 
     input_csv_file = "/Users/hunterdunlap/Downloads/advoda-location-info.csv"  # Replace with your input CSV file name
@@ -92,51 +106,27 @@ def main():
         # Read the CSV file into a pandas DataFrame
         df = pd.read_csv(input_csv_file)
 
-        # let's start with just the first 10 rows
-        df = df.head(10)
-
         # Check if the required columns exist
         if not {"LocationID", "FullPostalAddress"}.issubset(df.columns):
             raise ValueError("CSV file must contain 'LocationID' and 'FullPostalAddress' columns.")
 
-        # Create empty lists to store the appended data
-        place_ids = []
-        formatted_addresses = []
-        location_types = []
-        ratings = []
-        user_ratings_totals = []
-        latitudes = []
-        longitudes = []
-
-        # Iterate through each row in the DataFrame with tqdm progress bar
-        for index, row in tqdm(df.iterrows(), total=len(df), desc="Processing addresses"):
-            location_id = row["LocationID"]
-            address = row["FullPostalAddress"]
-
-            print(f"Processing locationID: {location_id}, Address: {address}")
-
-            place_details = get_place_details(address)
-
-            if place_details:
-                place_ids.append(place_details["place_id"])
-                formatted_addresses.append(place_details["formatted_address"])
-                location_types.append(place_details["location_type"])
-                ratings.append(place_details["rating"])
-                user_ratings_totals.append(place_details["user_ratings_total"])
-                latitudes.append(place_details["latitude"])
-                longitudes.append(place_details["longitude"])
-
-            else:
-                # Append None or empty values if no details are found
-                place_ids.append(None)
-                formatted_addresses.append(None)
-                location_types.append(None)
-                ratings.append(None)
-                user_ratings_totals.append(None)
-                latitudes.append(None)
-                longitudes.append(None)
-
-            time.sleep(0.2)  # Add a small delay to avoid hitting rate limits
+        # Collapse duplicate addresses so each one is looked up only once
+        address_groups = AddressGroups(df["FullPostalAddress"])
+        unique_addresses = address_groups.unique_addresses()
+
+        # Look up the unique addresses concurrently; the shared rate limiter keeps them within PLACES_QPS
+        unique_place_details = asyncio.run(get_all_place_details(unique_addresses))
+
+        # Fan the results back out to every row; rows without details get None values
+        empty_details = dict.fromkeys(["place_id", "formatted_address", "location_type", "rating", "user_ratings_total", "latitude", "longitude"])
+        row_details = [place_details or empty_details for place_details in address_groups.fan_out(unique_place_details)]
+        place_ids = [details["place_id"] for details in row_details]
+        formatted_addresses = [details["formatted_address"] for details in row_details]
+        location_types = [details["location_type"] for details in row_details]
+        ratings = [details["rating"] for details in row_details]
+        user_ratings_totals = [details["user_ratings_total"] for details in row_details]
+        latitudes = [details["latitude"] for details in row_details]
+        longitudes = [details["longitude"] for details in row_details]
 
         # Add the new columns to the DataFrame
         df["place_id"] = place_ids
@@ -146,10 +136,15 @@ def main():
         df["user_ratings_total"] = user_ratings_totals
         df["latitude"] = latitudes
         df["longitude"] = longitudes
+        df["Region"] = region_polygons.classify(df["latitude"], df["longitude"])
 
         # Save the updated DataFrame to a new CSV file
         df.to_csv(output_csv_file, index=False)
 
+        print(address_groups.report())
+        print(places_cache.report())
+        print(rate_limiter.report())
+        print(region_polygons.report())
         print(f"Data successfully saved to {output_csv_file}")
 
     except FileNotFoundError:
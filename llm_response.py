@@ -0,0 +1,138 @@
+"""
+Parsing helpers for batch answers returned by the LLM.
+
+Answers are parsed strictly as JSON first. If that fails (truncated output, stray text, single
+quotes) the well-formed top-level entries are salvaged one by one, so a partially broken answer
+still yields every row it got right and only the remaining rows need to be asked again.
+"""
+
+import ast
+import json
+import random
+import re
+from typing import Any, Callable, Dict, Iterable, Optional
+
+MAX_ATTEMPTS = 4
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+
+_CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+_KEY = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*')
+_decoder = json.JSONDecoder()
+
+
+def _strip_fences(text: str) -> str:
+    return _CODE_FENCE.sub("", text.strip())
+
+
+def _as_dict(value: Any) -> Optional[Dict[str, Any]]:
+    """Accept a dict, or a list wrapping a single dict (a shape the model sometimes returns)."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], dict):
+        return value[0]
+    return None
+
+
+def salvage_entries(text: str) -> Dict[str, Any]:
+    """
+    Recover the well-formed top-level "key": value entries of a malformed JSON object.
+
+    Each value is decoded independently, so one truncated or broken entry does not take the
+    others down with it. Nested objects are consumed whole and never mistaken for top-level keys.
+
+    Args:
+        text (str): The raw answer.
+
+    Returns:
+        Dict[str, Any]: The entries that could be decoded.
+    """
+    entries: Dict[str, Any] = {}
+    position = text.find("{") + 1
+    while True:
+        match = _KEY.search(text, position)
+        if match is None:
+            break
+        try:
+            key = json.loads(f'"{match.group(1)}"')
+            value, position = _decoder.raw_decode(text, match.end())
+        except ValueError:
+            position = match.end()
+            continue
+        entries[key] = value
+    return entries
+
+
+def parse_answer(text: Optional[str]) -> Dict[str, Any]:
+    """
+    Parse a batch answer: strict JSON first, then Python literal syntax, then entry salvage.
+
+    Args:
+        text (Optional[str]): The raw answer content.
+
+    Returns:
+        Dict[str, Any]: The parsed entries; empty if nothing could be recovered.
+    """
+    if not text:
+        return {}
+    text = _strip_fences(text)
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            parsed = _as_dict(parse(text))
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            continue
+        if parsed is not None:
+            return parsed
+    return salvage_entries(text)
+
+
+def backoff_delay(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for the given (1-based) retry attempt."""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class AnswerCollector:
+    """
+    Collects validated answers for a set of row keys across several attempts.
+
+    After each answer, the keys that are still pending are the only ones that need to be resent.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        normalize_key: Callable[[Any], str] = lambda key: " ".join(str(key).split()).casefold(),
+        is_valid: Callable[[Any], bool] = lambda value: value is not None,
+    ):
+        """
+        Args:
+            keys (Iterable[str]): The keys of the rows that were sent (addresses or LocationIDs).
+            normalize_key (Callable, optional): Maps both sent and returned keys to a comparable form.
+            is_valid (Callable, optional): Returns whether an answer value is usable.
+        """
+        self.normalize_key = normalize_key
+        self.is_valid = is_valid
+        self.pending: Dict[str, str] = {normalize_key(key): key for key in keys}
+        self.results: Dict[str, Any] = {}
+
+    def absorb(self, answer_text: Optional[str]) -> int:
+        """
+        Parse an answer and keep the valid entries for keys that are still pending.
+
+        Args:
+            answer_text (Optional[str]): The raw answer content.
+
+        Returns:
+            int: The number of rows recovered from this answer.
+        """
+        recovered = 0
+        for key, value in parse_answer(answer_text).items():
+            normalized_key = self.normalize_key(key)
+            if normalized_key in self.pending and self.is_valid(value):
+                self.results[self.pending.pop(normalized_key)] = value
+                recovered += 1
+        return recovered
+
+    def pending_keys(self) -> list:
+        """The original keys that have no valid answer yet."""
+        return list(self.pending.values())
@@ -1,39 +1,116 @@
-import ast
 import csv
+import hashlib
+import json
+import os
+import sys
+import time
 from os import environ as env
 
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIError, OpenAI
 from tqdm import tqdm
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "GooglePlaces"))
+from classification_cache import ClassificationCache
+from llm_response import MAX_ATTEMPTS, AnswerCollector, backoff_delay
+from row_encoding import RowEncoder
+from token_budget import count_tokens, plan_batches
+
 load_dotenv()
 e = env.get
 client = OpenAI(api_key=e('OPENAI_API_KEY'))
 
+# Bump whenever the prompt changes so stale cached answers are not reused.
+PROMPT_VERSION = "location_extraction:v2"
+classification_cache = ClassificationCache(model=e('MODEL'), prompt_version=PROMPT_VERSION)
+
 file_path = "input/Location Information.csv"
+filename = 'location_extraction.csv'
+# Progress journal: one JSON line per finished batch with the output file size after it was written
+journal_filename = filename + '.progress.jsonl'
+# Batches are packed to fit these budgets instead of a fixed number of rows
+context_tokens = int(e('CONTEXT_TOKENS', 16000))
+max_output_tokens = int(e('MAX_OUTPUT_TOKENS', 4000))
+
+
+def file_fingerprint(path):
+    """SHA-256 of a file's content, so a resume notices edited input even at the same path."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+run_config = {
+    "input": file_path,
+    "input_sha256": file_fingerprint(file_path),
+    "model": e('MODEL'),
+    "prompt_version": PROMPT_VERSION,
+    "context_tokens": context_tokens,
+    "max_output_tokens": max_output_tokens,
+}
+
+SYSTEM_PROMPT = "You are a address analyzer and answerer who only responds with the appropriate JSON format. You give the best guess based on the information provided and follow the JSON format exactly."
+
+
+def load_progress(journal_path, run_config):
+    """
+    Read the progress journal of a previous run.
+
+    Returns the set of finished batch start rows and the output file size after the last one.
+    A journal written for a different input (path or content), model, prompt or token budget is ignored,
+    since its batches would not line up with this run's. A finished run removes its journal.
+    """
+    if not os.path.exists(journal_path):
+        return set(), 0
+    with open(journal_path, encoding='utf-8') as journal:
+        lines = [json.loads(line) for line in journal if line.strip()]
+    if not lines or lines[0] != run_config:
+        print(f"[ALERT] {journal_path} belongs to a different run, starting from scratch")
+        return set(), 0
+    finished = {line["batch"] for line in lines[1:]}
+    output_size = lines[-1].get("output_size", 0)
+    return finished, output_size
+
+
+def finish_batch(batch_start, batch_answers):
+    """Append a finished batch to the output, then record it in the journal."""
+    for key, value in batch_answers.items():
+        categorization = value
+        writer.writerow([key, categorization])
+    output.flush()
+    os.fsync(output.fileno())
+    journal.write(json.dumps({"batch": batch_start, "output_size": output.tell()}) + '\n')
+    journal.flush()
+
+
+# Prompt columns and the input columns they are rendered from
+ROW_FIELDS = [
+    ("Full Address", ["FullPostalAddress"]),
+    ("Country", ["Country"]),
+    ("City", ["City"]),
+    ("Location Name", ["LocationName"]),
+    ("State", ["State"]),
+    ("Zip", ["Zip"]),
+    ("Street Information", ["Street1", "Street2"]),
+]
+row_encoder = RowEncoder(ROW_FIELDS, count_tokens=lambda text: count_tokens(text, e('MODEL')))
 
-our_data = pd.read_csv(file_path)
 
-data = {}
+def encode_rows(rows):
+    """Render every row as its line of the compact prompt table."""
+    return row_encoder.encode(rows)[1]
 
-# Iterate over 20 rows at a time
-for i in tqdm(range(0, len(our_data), 20)):
-    # Get the next 20 rows
-    next_batch = our_data.iloc[i:i+20]
 
+def build_prompt(next_batch, location_input=None):
+    """Build the classification prompt for a batch of rows, from its table when it is already rendered."""
     # Create location input string
-    location_input = next_batch.apply(lambda row: (
-        f"Full Address: {row['FullPostalAddress']}, "
-        f"Country: {row['Country']}, "
-        f"City: {row['City']}, "
-        f"Location Name: {row['LocationName']}, "
-        f"State: {row['State']}, "
-        f"Zip: {row['Zip']}, "
-        f"Street Information: {row['Street1']} {row['Street2']}"
-    ), axis=1).tolist()
-
-    prompt = f"""I have a list of 20 addresses and details on the address. This data is not perfect so some of the fields may be blank, that is to be expected.
+    if location_input is None:
+        location_input = row_encoder.table(next_batch)
+
+    prompt = f"""I have a list of {len(next_batch)} addresses and details on the address. This data is not perfect so some of the fields may be blank, that is to be expected.
         
         You have one objective with this information, determine the categorization based on these 6 options:
 
@@ -48,8 +125,9 @@ for i in tqdm(range(0, len(our_data), 20)):
 
     
     Please be careful and diligent while reviewing these addresses. Do not skip any addresses. The ordering is extremely important. 
+    The locations are a table: the first line names the columns, every other line is one location, and blank or missing columns are unknown.
                 ```
-                {location_input},
+                {location_input}
                 ```
 
                 Please format your response as a traditional JSON format as follows:
@@ -82,46 +160,118 @@ for i in tqdm(range(0, len(our_data), 20)):
     DO NOT SAY ANYTHING ELSE OTHER THAN THE JSON FORMAT AND ANSWER FOR ALL COMPANIES.
     IMPORTANT: DO NOT WRAP ANSWER IN JSON``` ```, JUST ANSWER AND START WITH CURLY BRACE - NOTHING ELSE. 
     """
+    return prompt
+
 
-    def get_answer(prompt):
+def get_answer(prompt):
+    """Send a prompt in JSON mode and return the raw answer text, or None if the request failed."""
+    try:
         completion = client.chat.completions.create(
             model=e('MODEL'),
             messages=[
-                {"role": "system", "content": "You are a address analyzer and answerer who only responds with the appropriate JSON format. You give the best guess based on the information provided and follow the JSON format exactly."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": f"{prompt}"},
-            ]
+            ],
+            response_format={"type": "json_object"},
+            max_tokens=max_output_tokens,
         )
-        answer = completion.choices[0].message
-        useful_format_answer = None
-        try:
-            useful_format_answer = ast.literal_eval(answer.content)
-        except:
+    except APIError as error:
+        print(f"[ALERT] Request failed: {error}")
+        return None
+    return completion.choices[0].message.content
+
+
+def plan_token_batches(our_data):
+    """Plan contiguous batches that fill each request without overrunning the context or output budget."""
+    if our_data.empty:
+        return []
+    model = e('MODEL')
+    # Each row costs its table line plus the line break; its answer echoes the address plus the category
+    input_tokens = [count_tokens(text, model) + 1 for text in encode_rows(our_data)]
+    output_tokens = [count_tokens(str(address), model) + 10 for address in our_data['FullPostalAddress']]
+    prompt_tokens = count_tokens(SYSTEM_PROMPT + build_prompt(our_data.iloc[:1]), model)
+    return plan_batches(input_tokens, output_tokens, prompt_tokens, context_tokens=context_tokens, max_output_tokens=max_output_tokens)
+
+
+our_data = pd.read_csv(file_path)
+batches = plan_token_batches(our_data)
+print(f"Planned {len(batches)} batches for {len(our_data)} rows")
+
+finished_batches, output_size = load_progress(journal_filename, run_config)
+if finished_batches and os.path.exists(filename):
+    print(f"Resuming: {len(finished_batches)} batches already written to {filename}")
+    # Drop anything written after the last journaled batch (e.g. a batch interrupted mid-write)
+    output = open(filename, mode='r+', newline='', encoding='utf-8')
+    output.truncate(output_size)
+    output.seek(output_size)
+    journal = open(journal_filename, mode='a', encoding='utf-8')
+    writer = csv.writer(output)
+else:
+    finished_batches = set()
+    output = open(filename, mode='w', newline='', encoding='utf-8')
+    journal = open(journal_filename, mode='w', encoding='utf-8')
+    journal.write(json.dumps(run_config) + '\n')
+    writer = csv.writer(output)
+    writer.writerow(["Full Address", "Categorization"])
+    output.flush()
+
+# Batches left with unanswered rows; they stay out of the journal
+incomplete_batches = []
+
+# Iterate over the planned batches, skipping batches finished by a previous run
+for i, batch_end in tqdm(batches):
+    if i in finished_batches:
+        continue
+
+    # Get the rows of this batch
+    next_batch = our_data.iloc[i:batch_end]
+
+    # Serve addresses classified on a previous run from the cache
+    cached = classification_cache.get_many(next_batch['FullPostalAddress'])
+    batch_answers = dict(cached)
+    next_batch = next_batch[~next_batch['FullPostalAddress'].isin(list(cached))]
+    if next_batch.empty:
+        finish_batch(i, batch_answers)
+        continue
+
+    # Ask for the rows that are still missing, with a bounded retry budget and backoff
+    collector = AnswerCollector(next_batch['FullPostalAddress'].astype(str))
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(backoff_delay(attempt))
+        pending_batch = next_batch[next_batch['FullPostalAddress'].astype(str).isin(collector.pending_keys())]
+        # Rendered once for both the savings measurement and the prompt
+        location_input = row_encoder.table(pending_batch)
+        row_encoder.record(pending_batch, location_input)
+        answer = get_answer(build_prompt(pending_batch, location_input))
+        if not collector.absorb(answer):
             print("[ALERT] Data was not formatted in expected way")
             print("Bad Answer: \n \n \n", answer)
-        return useful_format_answer
+        if not collector.pending:
+            break
 
-    useful_format_answer = None
-    while useful_format_answer is None:
-        useful_format_answer = get_answer(prompt)
-    try:
-        data.update(useful_format_answer)
-    except ValueError:
-        try:
-            # Possibly returned this single list thing...
-            data.update(useful_format_answer[0])
-        except:
-            raise ValueError("Unexpected response format")
-
-# Writing to CSV
-filename = 'location_extraction.csv'
+    batch_answers.update(collector.results)
+
+    for address, categorization in collector.results.items():
+        classification_cache.set(address, categorization)
+
+    if collector.pending:
+        # Neither written nor journaled, so the next run retries the batch; its answered rows come from the cache then
+        print(f"[ALERT] No usable answer after {MAX_ATTEMPTS} attempts for: {collector.pending_keys()}")
+        incomplete_batches.append(i)
+        continue
 
-def write_dict_to_csv(input_dict, file_name):
-    with open(file_name, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.writer(file)
-        writer.writerow(["Full Address", "Categorization"])
-        for key, value in input_dict.items():
-            categorization = value
-            writer.writerow([key, categorization])
+    # Write the batch as soon as it is done so an interrupted run can resume from here
+    finish_batch(i, batch_answers)
 
-write_dict_to_csv(data, filename)
+output.close()
+journal.close()
+if incomplete_batches:
+    print(f"[ALERT] {len(incomplete_batches)} batches still have rows without an answer and were not written; run again to retry them")
+else:
+    # Every batch is written; a later run on this path starts fresh instead of resuming
+    os.remove(journal_filename)
+print(classification_cache.report())
+print(row_encoder.report())
+print(f"Results written to {filename}")
 print("Script completed successfully")
\ No newline at end of file
@@ -1,38 +1,68 @@
-import ast
+import asyncio
 import csv
+import os
+import sys
 from os import environ as env
+import httpx
 import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIError, AsyncOpenAI
 from tqdm import tqdm
-import multiprocessing as mp
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "GooglePlaces"))
+from classification_cache import ClassificationCache
+from llm_response import MAX_ATTEMPTS, AnswerCollector, backoff_delay
+from row_encoding import RowEncoder
+from token_budget import count_tokens, plan_batches
 
 load_dotenv()
 e = env.get
-client = OpenAI(api_key=e("OPENAI_API_KEY"))
+
+# Bump whenever the prompt changes so stale cached answers are not reused.
+PROMPT_VERSION = "location_extraction_parallel:v2"
 
 # file_path = "/Users/hunterdunlap/Downloads/advoda-location-info.csv"
 file_path = "/Users/hunterdunlap/Downloads/null-locations.csv"
 output_file = "location_extraction_skeptical_null.csv"
-batch_size = 20
-
-
-def process_batch(batch_data):
-    client = OpenAI(api_key=e("OPENAI_API_KEY"))
-
-    location_input = batch_data.apply(
-        lambda row: (
-            f"LocationID: [{row['LocationID']}], "
-            f"Full Address: {row['FullPostalAddress']}, "
-            f"Country: {row['Country']}, "
-            f"City: {row['City']}, "
-            f"Location Name: {row['LocationName']}, "
-            f"State: {row['State']}, "
-            f"Zip: {row['Zip']}, "
-            f"Street Information: {row['Street1']} {row['Street2']}"
-        ),
-        axis=1,
-    ).tolist()
+# Batches are packed to fit these budgets instead of a fixed number of rows
+context_tokens = int(e("CONTEXT_TOKENS", 16000))
+max_output_tokens = int(e("MAX_OUTPUT_TOKENS", 4000))
+# Number of batches in flight at once; tune to the account's rate limit rather than the CPU count
+max_concurrency = int(e("MAX_CONCURRENCY", 32))
+
+# One shared async client whose keep-alive pool is sized to the concurrency limit
+client = AsyncOpenAI(
+    api_key=e("OPENAI_API_KEY"),
+    http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)),
+)
+
+
+SYSTEM_PROMPT = "You are a address analyzer and answerer who only responds with the appropriate JSON format. You give the best guess based on the information provided and follow the JSON format exactly."
+
+
+# Prompt columns and the input columns they are rendered from
+ROW_FIELDS = [
+    ("LocationID", ["LocationID"]),
+    ("Full Address", ["FullPostalAddress"]),
+    ("Country", ["Country"]),
+    ("City", ["City"]),
+    ("Location Name", ["LocationName"]),
+    ("State", ["State"]),
+    ("Zip", ["Zip"]),
+    ("Street Information", ["Street1", "Street2"]),
+]
+row_encoder = RowEncoder(ROW_FIELDS, count_tokens=lambda text: count_tokens(text, e("MODEL")))
+
+
+def encode_rows(rows):
+    """Render every row as its line of the compact prompt table."""
+    return row_encoder.encode(rows)[1]
+
+
+def build_prompt(batch_data, location_input=None):
+    """Build the classification prompt for a batch of rows, from its table when it is already rendered."""
+    if location_input is None:
+        location_input = row_encoder.table(batch_data)
 
     prompt = f"""I have a list of {len(batch_data)} addresses and details on the address. This data is not perfect so some of the fields may be blank, that is to be expected.
         
@@ -46,8 +76,9 @@ def process_batch(batch_data):
 
     
     Please be careful and diligent while reviewing these addresses. Do not skip any addresses. The ordering is extremely important. 
+    The locations are a table: the first line names the columns, every other line is one location, and blank or missing columns are unknown.
                 ```
-                {location_input},
+                {location_input}
                 ```
 
                 Please format your response as a traditional JSON format as follows, where the key is the location ID:
@@ -83,58 +114,115 @@ def process_batch(batch_data):
     }}
     ```
 
-    Please use the exact location ID (number in square brackets) and FullPostalAddress from the input.
+    Please use the exact LocationID and Full Address from the input.
     Please answer for every location - there is no reason to not do all of them. 
     VERY IMPORTANT: Only answer in the JSON format say no more or less than the JSON format! This is being used in a script and any additional text will break it. 
     DO NOT SAY ANYTHING ELSE OTHER THAN THE JSON FORMAT AND ANSWER FOR ALL LOCATIONS.
     IMPORTANT: DO NOT WRAP ANSWER IN JSON``` ```, JUST ANSWER AND START WITH CURLY BRACE - NOTHING ELSE. 
     """
+    return prompt
+
 
-    def get_answer(prompt):
-        completion = client.chat.completions.create(
+async def get_answer(prompt):
+    """Send a prompt in JSON mode and return the raw answer text, or None if the request failed."""
+    try:
+        completion = await client.chat.completions.create(
             model=e("MODEL"),
             messages=[
-                {
-                    "role": "system",
-                    "content": "You are a address analyzer and answerer who only responds with the appropriate JSON format. You give the best guess based on the information provided and follow the JSON format exactly.",
-                },
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": f"{prompt}"},
             ],
+            response_format={"type": "json_object"},
+            max_tokens=max_output_tokens,
         )
-        answer = completion.choices[0].message
-        useful_format_answer = None
-        try:
-            useful_format_answer = ast.literal_eval(answer.content)
-        except:
+    except APIError as error:
+        print(f"[ALERT] Request failed: {error}")
+        return None
+    return completion.choices[0].message.content
+
+
+async def process_batch(batch_data):
+    """
+    Classify a batch, salvaging partial answers and resending only the rows that are still missing.
+
+    Gives up after MAX_ATTEMPTS so a flaky batch cannot stall its worker indefinitely.
+    """
+    collector = AnswerCollector(
+        batch_data["LocationID"].astype(str),
+        normalize_key=lambda key: str(key).strip("[] "),
+        is_valid=lambda value: isinstance(value, dict) and "category" in value,
+    )
+    for attempt in range(MAX_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt))
+        pending_batch = batch_data[batch_data["LocationID"].astype(str).isin(collector.pending_keys())]
+        # Rendered once for both the savings measurement and the prompt
+        location_input = row_encoder.table(pending_batch)
+        row_encoder.record(pending_batch, location_input)
+        answer = await get_answer(build_prompt(pending_batch, location_input))
+        if not collector.absorb(answer):
             print("[ALERT] Data was not formatted in expected way")
             print("Bad Answer: \n \n \n", answer)
-        return useful_format_answer
+        if not collector.pending:
+            break
+
+    if collector.pending:
+        print(f"[ALERT] No usable answer after {MAX_ATTEMPTS} attempts for LocationIDs: {collector.pending_keys()}")
+    return collector.results
+
 
-    useful_format_answer = None
-    while useful_format_answer is None:
-        useful_format_answer = get_answer(prompt)
+async def process_batches(batches):
+    """Run all batches on the event loop with at most max_concurrency requests in flight."""
+    semaphore = asyncio.Semaphore(max_concurrency)
 
-    return useful_format_answer
+    async def process_bounded(batch_data):
+        async with semaphore:
+            return await process_batch(batch_data)
+
+    tasks = [asyncio.create_task(process_bounded(batch_data)) for batch_data in batches]
+    results = []
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing batches"):
+        results.append(await task)
+    return results
+
+
+def plan_token_batches(our_data):
+    """Plan contiguous batches that fill each request without overrunning the context or output budget."""
+    if our_data.empty:
+        return []
+    model = e("MODEL")
+    # Each row costs its table line plus the line break; its answer echoes the ID and address plus the category
+    input_tokens = [count_tokens(text, model) + 1 for text in encode_rows(our_data)]
+    output_tokens = [
+        count_tokens(f"{location_id} {address}", model) + 20 for location_id, address in zip(our_data["LocationID"], our_data["FullPostalAddress"])
+    ]
+    prompt_tokens = count_tokens(SYSTEM_PROMPT + build_prompt(our_data.iloc[:1]), model)
+    return plan_batches(input_tokens, output_tokens, prompt_tokens, context_tokens=context_tokens, max_output_tokens=max_output_tokens)
 
 
 def main():
     our_data = pd.read_csv(file_path)
     # our_data = our_data.head(100)
-    num_batches = len(our_data) // batch_size + (1 if len(our_data) % batch_size else 0)
-
-    with mp.Pool(processes=mp.cpu_count()) as pool:
-        results = list(
-            tqdm(
-                pool.imap(process_batch, [our_data.iloc[i : i + batch_size] for i in range(0, len(our_data), batch_size)]),
-                total=num_batches,
-                desc="Processing batches",
-            )
-        )
 
-    # Combine results
+    # Serve locations classified on a previous run from the cache and only send the rest to the model
+    classification_cache = ClassificationCache(model=e("MODEL"), prompt_version=PROMPT_VERSION)
     combined_data = {}
+    cached = classification_cache.get_many(our_data["FullPostalAddress"])
+    for location_id, address in zip(our_data["LocationID"], our_data["FullPostalAddress"]):
+        if address in cached:
+            combined_data[str(location_id)] = {"address": address, "category": cached[address]}
+    our_data = our_data[~our_data["LocationID"].astype(str).isin(list(combined_data))]
+    input_addresses = dict(zip(our_data["LocationID"].astype(str), our_data["FullPostalAddress"]))
+
+    batches = [our_data.iloc[start:end] for start, end in plan_token_batches(our_data)]
+    results = asyncio.run(process_batches(batches))
+
+    # Combine results; the address is taken from the input, since a salvaged answer may lack or garble it
     for result in results:
-        combined_data.update(result)
+        for location_id, value in result.items():
+            address = input_addresses[str(location_id)]
+            combined_data[str(location_id)] = {"address": address, "category": value["category"]}
+            classification_cache.set(address, value["category"])
 
     # Writing to CSV
     with open(output_file, mode="w", newline="", encoding="utf-8") as file:
@@ -143,6 +231,8 @@ def main():
         for key, value in combined_data.items():
             writer.writerow([key, value["address"], value["category"]])
 
+    print(classification_cache.report())
+    print(row_encoder.report())
     print(f"Script completed successfully. Results written to {output_file}")
 
 